@@ -1,7 +1,9 @@
 from flask import Blueprint, render_template, session, redirect, url_for, flash, current_app, request, jsonify, Response, send_file
-from app.util.fileMgmt import ensure_folder, rename_file_columns, extractDataframes, format_date, get_statistics_A, extractBCDataframes, preprocess_data, getDataframes
-from app.services.unifyFiles import unifyBCFiles, unifyADFiles, create_D_file, create_E_file
+from app.util.fileMgmt import ensure_folder, preprocess_data, getDataframes
+from app.util.dataStore import dataset_exists, dataset_path, export_csv, catalog_path
+from app.services.unifyFiles import create_D_file, create_E_file
 from app.services.dataCleaning import removeOutliers
+from app.services.assignPortals import assign_portals
 from app.util.createPDFs import crear_pdf
 from app.services.Algoritmo_cluster_basico import cluster_por_diametro
 import json
@@ -32,7 +34,7 @@ def upload_file():
     save_path = os.path.join(save_path_temp, data_filename)
     f.save(save_path)
 
-    statistics_response = preprocess_data(save_path, type)
+    statistics_response = preprocess_data(save_path, type, current_app.config.get("PREPROCESS_CHUNK_SIZE"))
 
 
     if isinstance(statistics_response, Response):
@@ -73,13 +75,7 @@ def upload_A_file():
     current_app.logger.info(f"Archivo guardado correctamente en {save_path}")
     
     # Preprocess data and get statistics
-
-    #rename_file_columns(save_path, type)
-    #format_date(save_path, type)
-
-    #statistics_response = get_statistics_A(save_path)
-
-    statistics_response = preprocess_data(save_path, type)
+    statistics_response = preprocess_data(save_path, type, current_app.config.get("PREPROCESS_CHUNK_SIZE"))
 
 
     if isinstance(statistics_response, Response):
@@ -105,7 +101,7 @@ def unifyFilesBC():
     for file_type in ('B', 'C'):
         for root, _, files in os.walk(id_path):
             for file in files:
-                if file.endswith('.pkl') and f'Fichero_{file_type}' in file:
+                if file.endswith('.parquet') and f'Fichero_{file_type}' in file:
                     wout_extension = os.path.splitext(file)[0]
                     parts = wout_extension.split('_')
                     if len(parts) == 2:
@@ -113,14 +109,11 @@ def unifyFilesBC():
                         files_paths[type] = os.path.join(root, file)
     
     current_app.logger.info(f"Se han encontrado {len(files_paths)} archivos en la carperta de la sesion {id}")
-    #df_B, df_C, read_info = extractBCDataframes(files_paths['B'], files_paths['C'])
-    df_B, df_C = getDataframes(files_paths['B'], files_paths['C'])
+    df_B, df_C = getDataframes(id_path, 'B', 'C')
 
     if ((len(df_B) == 0) or (len(df_C) == 0)):
         return jsonify({"Registros totales: 0"})
-    #
-    # erased_info = unifyBCFiles(df_B, df_C, id_path)
-    erased_info = create_D_file(df_B, df_C, id_path)
+    erased_info = create_D_file(df_B, df_C, id_path, current_app.config.get("MERGE_WORKERS"))
     
     #if isinstance(read_info, Response):
     #    read_info = read_info.get_json()
@@ -173,7 +166,7 @@ def unifyAllFiles():
 
     for root, _, files in os.walk(id_path):
         for file in files:
-            if file.endswith('.pkl') and 'Fichero_' in file:
+            if file.endswith('.parquet') and 'Fichero_' in file:
                 wout_extension = os.path.splitext(file)[0]
                 parts = wout_extension.split('_')
                 if len(parts) == 2:
@@ -181,8 +174,7 @@ def unifyAllFiles():
                     files_paths[type] = os.path.join(root, file)
     
     current_app.logger.info(f"Se han encontrado {len(files_paths)} archivos en la carperta de la sesion {id}")
-    #df_A, df_D, read_info = extractBCDataframes(files_paths['A'], files_paths['D'])
-    df_A, df_D = getDataframes(files_paths['A'], files_paths['D'])
+    df_A, df_D = getDataframes(id_path, 'A', 'D')
 
     # if len(df_D) == 0:
     #     df_A['esParada'] = False
@@ -190,10 +182,12 @@ def unifyAllFiles():
     #     df_A.to_csv(path, sep=';', index=False)
     #     return jsonify({"logs": f'Fichero D sin registros. Se usará solamente el fichero A.'})
     
-    #erased_info = unifyADFiles(df_A, df_D, id_path)
 
     erased_info = create_E_file(df_A, df_D, id_path)
-    #outliers_info = removeOutliers(id_path)
+
+    # Portal mas cercano de cada fila, para las oficinas con GeoJSON
+    assign_portals(id_path, current_app.config.get("GEOJSON_FOLDER"), current_app.config.get("PORTAL_WORKERS"))
+    #outliers_info = removeOutliers(id_path, current_app.config["OUTLIER_MAX_ITERATIONS"], current_app.config.get("OUTLIER_WORKERS"))
     
     #if isinstance(read_info, Response):
     #    read_info = read_info.get_json()
@@ -252,21 +246,31 @@ def descargar_estadisticas():
 
 @api_bp.route("/get_fichero_unificado", methods=['POST'])
 def get_fichero_unificado():
-    # Ruta al CSV
+    # Fichero E (o A si no se han unificado los ficheros) de la sesion
     id = request.form.get('id')
+    file_format = request.form.get('format', 'csv')
     base_upload = current_app.config.get("UPLOAD_FOLDER")
     id_path = os.path.join(base_upload, str(id))
-    csv_path = os.path.join(id_path, 'Fichero_E.csv')
-    current_app.logger.info({csv_path})
+    file_type = 'E'
     # Comprobar si existe
-    if not os.path.exists(csv_path):
-        csv_path = os.path.join(id_path, 'Fichero_A.csv')
-        if not os.path.exists(csv_path):
+    if not dataset_exists(id_path, file_type):
+        file_type = 'A'
+        if not dataset_exists(id_path, file_type):
             return "El archivo no existe", 404
-
-    # Devolver el CSV
+    current_app.logger.info(dataset_path(id_path, file_type))
+
+    # Devolver el Parquet tal cual se almacena
+    if file_format == 'parquet':
+        return send_file(
+            dataset_path(id_path, file_type),
+            mimetype="application/vnd.apache.parquet",
+            as_attachment=True,
+            download_name="Fichero_E.parquet"
+        )
+
+    # Devolver el CSV (se genera solo cuando se pide)
     return send_file(
-        csv_path,
+        export_csv(id_path, file_type),
         mimetype="text/csv",
         as_attachment=True,
         download_name="Fichero_E.csv"
@@ -281,15 +285,14 @@ def get_fichero_intermedio():
     id = request.form.get('id')
     base_upload = current_app.config.get("UPLOAD_FOLDER")
     id_path = os.path.join(base_upload, str(id))
-    csv_path = os.path.join(id_path, 'Fichero_D.csv')
-    current_app.logger.info({csv_path})
+    current_app.logger.info(dataset_path(id_path, 'D'))
     # Comprobar si existe
-    if not os.path.exists(csv_path):
+    if not dataset_exists(id_path, 'D'):
         return "El archivo no existe", 404
 
-    # Devolver el CSV
+    # Devolver el CSV (se genera solo cuando se pide)
     return send_file(
-        csv_path,
+        export_csv(id_path, 'D'),
         mimetype="text/csv",
         as_attachment=True,
         download_name="Fichero_D.csv"
@@ -298,6 +301,27 @@ def get_fichero_intermedio():
 
 
 
+@api_bp.route("/get_catalogo", methods=['POST'])
+def get_catalogo():
+    # Catalogo oficinas -> PDAs -> fechas del fichero E
+    id = request.form.get('id')
+    base_upload = current_app.config.get("UPLOAD_FOLDER")
+    id_path = os.path.join(base_upload, str(id))
+    json_path = catalog_path(id_path)
+    # Comprobar si existe
+    if not os.path.exists(json_path):
+        return "El archivo no existe", 404
+
+    return send_file(
+        json_path,
+        mimetype="application/json",
+        as_attachment=True,
+        download_name="Fichero_E_catalogo.json"
+    )
+
+
+
+
 @api_bp.route("/agrupar_diametro", methods=['POST'])
 def agrupar_diametro():
 
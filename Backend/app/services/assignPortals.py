@@ -0,0 +1,128 @@
+from flask import current_app
+from app.util.dataStore import load_dataset, add_dataset_columns, load_catalog, save_catalog
+from shared.portal_index import load_portal_index, geojson_stamp
+from shared.coordinates import decimal_coordinates
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import numpy as np
+import os
+
+
+# Columns added to Fichero_E with the nearest portal of each row
+PORTAL_COLUMNS = ["portal_calle", "portal_numero", "portal_cp", "portal_latitud", "portal_longitud", "portal_distancia"]
+
+
+
+
+def match_office_portals(file_geojson, latitud, longitud):
+    """
+        Finds the nearest portal of every row of an office. Runs in a worker
+        process, so it only receives and returns plain arrays.
+        Args:
+            file_geojson : GeoJSON file with the portals of the office
+            latitud, longitud : coordinates of the rows of the office (float32, as stored in E)
+        Returns:
+            Dict with one array per column of PORTAL_COLUMNS, or None if the
+            GeoJSON has no valid points
+    """
+    index = load_portal_index(file_geojson)
+    if index is None:
+        return None
+
+    # Los puntos GPS se repiten mucho (paradas): una busqueda por coordenada distinta
+    codes, locations = pd.factorize(np.asarray(latitud, dtype=np.float64) + 1j * np.asarray(longitud, dtype=np.float64))
+
+    # Las coordenadas se guardan en float32: se usa su valor decimal, igual que
+    # los puntos de las rutas en el frontend
+    nearest, distance = index.query_nearest(decimal_coordinates(locations.real), decimal_coordinates(locations.imag))
+
+    # Filas sin coordenadas (codigo -1) o sin portal: sin datos
+    nearest = np.where(codes >= 0, nearest[codes], -1)
+    distance = np.where(codes >= 0, distance[codes], np.nan)
+    found = nearest >= 0
+    safe = np.where(found, nearest, 0)
+
+    return {
+        "portal_calle": np.where(found, index.street[safe], None),
+        "portal_numero": np.where(found, index.number[safe], None),
+        "portal_cp": np.where(found, index.post_code[safe], None),
+        "portal_latitud": np.where(found, index.latitud[safe], np.nan),
+        "portal_longitud": np.where(found, index.longitud[safe], np.nan),
+        "portal_distancia": np.where(found, distance, np.nan)
+    }
+
+
+
+
+def assign_portals(folder, geojson_folder, workers=None):
+    """
+        Assigns the nearest portal (street, number, postcode, coordinates and
+        distance) to every row of Fichero_E whose office has a GeoJSON, and
+        stores them as the PORTAL_COLUMNS of the file. Each office is matched
+        in its own worker process.
+        The catalog records the size and modification time of the GeoJSON used
+        for each office ("portales"), so the frontend only uses these columns
+        while the GeoJSON has not been replaced.
+        Args:
+            folder : session folder, with Fichero_E and its catalog
+            geojson_folder : folder with the GeoJSON of each office ({cod_unidad}.geojson)
+            workers : number of worker processes (one per CPU by default)
+        Returns:
+            Dict {cod_unidad: rows with a portal} of the offices with a GeoJSON
+    """
+    catalog = load_catalog(folder)
+    if catalog is None or not geojson_folder:
+        return {}
+
+    offices = {
+        unit: os.path.join(geojson_folder, f"{unit}.geojson")
+        for unit in catalog
+        if os.path.exists(os.path.join(geojson_folder, f"{unit}.geojson"))
+    }
+    if not offices:
+        current_app.logger.info("No hay GeoJSON de ninguna oficina: no se asignan portales")
+        return {}
+
+    df_E = load_dataset(folder, "E", columns=['latitud', 'longitud'])
+    latitud = df_E['latitud'].to_numpy()
+    longitud = df_E['longitud'].to_numpy()
+
+    # Fichero_E esta ordenado por oficina: las filas de cada una son un rango contiguo
+    stamps = {unit: geojson_stamp(path) for unit, path in offices.items()}
+    tasks = {
+        unit: (path, latitud[catalog[unit]["start"]:catalog[unit]["end"]], longitud[catalog[unit]["start"]:catalog[unit]["end"]])
+        for unit, path in offices.items()
+    }
+
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    current_app.logger.info(f"Asignando portales de {len(tasks)} oficinas con {workers} procesos")
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {unit: executor.submit(match_office_portals, *task) for unit, task in tasks.items()}
+            results = {unit: future.result() for unit, future in futures.items()}
+    else:
+        results = {unit: match_office_portals(*task) for unit, task in tasks.items()}
+
+    columns = {
+        "portal_calle": np.full(len(df_E), None, dtype=object),
+        "portal_numero": np.full(len(df_E), None, dtype=object),
+        "portal_cp": np.full(len(df_E), None, dtype=object),
+        "portal_latitud": np.full(len(df_E), np.nan),
+        "portal_longitud": np.full(len(df_E), np.nan),
+        "portal_distancia": np.full(len(df_E), np.nan)
+    }
+    assigned = {}
+    for unit, result in results.items():
+        entry = catalog[unit]
+        if result is None:
+            continue
+        for name, values in result.items():
+            columns[name][entry["start"]:entry["end"]] = values
+        entry["portales"] = stamps[unit]
+        assigned[unit] = int(np.count_nonzero(~np.isnan(result["portal_distancia"])))
+
+    add_dataset_columns(folder, "E", columns)
+    save_catalog(catalog, folder)
+
+    current_app.logger.info(f"Portales asignados por oficina: {assigned}")
+    return assigned
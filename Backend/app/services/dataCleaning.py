@@ -1,103 +1,367 @@
 from flask import jsonify, current_app
 from app.services.unifyFiles import convert_numpy
+from app.util.dataStore import load_dataset
+from app.util.fileSchema import format_dates, format_date_columns
+from pandas.api.indexers import BaseIndexer
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pyproj import Geod
 import pandas as pd
 import numpy as np
 import os
 
 
-def create_dict(df):
-    df_dict = {}
-    for pda, group_pda in df.groupby('cod_pda'):
-        df_dict[pda] = {}
-        for fecha, group_fecha in group_pda.groupby('solo_fecha'):
-            #current_app.logger.info(f"Encontrado {pda}: {fecha}")
-            df_dict[pda][fecha] = group_fecha
-    return df_dict
+# Deteccion de outliers: ventana de las medias moviles, factor sobre la media
+# y velocidad maxima
+OUTLIER_WINDOW = 12
+OUTLIER_RATIO = 1.5
+MAX_SPEED = 3.5
 
+# Puntos a partir de los cuales las rutas se limpian en varios procesos
+OUTLIER_PARALLEL_MIN_ROWS = 200_000
 
-def calculateDistance(df):
-    geod = Geod(ellps="WGS84")
+GEOD = Geod(ellps="WGS84")
 
-    lons = df['longitud'].str.replace(',', '.', regex=False).astype(float).values
-    lats = df['latitud'].str.replace(',', '.', regex=False).astype(float).values
 
-    lons2 = np.roll(lons, -1)
-    lats2 = np.roll(lats, -1)
+def sort_routes(df):
+    """
+    Ordena las filas por ruta, primero por PDA y despues por fecha,
+    conservando el orden del fichero dentro de cada ruta. Las filas sin PDA
+    o sin fecha no pertenecen a ninguna ruta y se descartan.
+
+    Args:
+        df (pandas.DataFrame): Fichero E.
+
+    Returns:
+        tuple: (filas ordenadas, numero de ruta de cada fila). Las rutas
+        quedan contiguas y numeradas desde 0 en orden.
+    """
+    pda_codes = pd.factorize(df['cod_pda'], sort=True)[0]
+    date_codes = pd.factorize(df['solo_fecha'], sort=True)[0]
+    valid = np.flatnonzero((pda_codes >= 0) & (date_codes >= 0))
+    order = valid[np.lexsort((date_codes[valid], pda_codes[valid]))]
+    pda_codes = pda_codes[order]
+    date_codes = date_codes[order]
+
+    route_start = np.ones(len(order), dtype=bool)
+    route_start[1:] = (pda_codes[1:] != pda_codes[:-1]) | (date_codes[1:] != date_codes[:-1])
+    return df.take(order).reset_index(drop=True), np.cumsum(route_start) - 1
+
+
+
+
+def route_bounds(route):
+    """Mascaras del primer y del ultimo punto de cada ruta (rutas contiguas)"""
+    first = np.ones(len(route), dtype=bool)
+    first[1:] = route[1:] != route[:-1]
+    last = np.ones(len(route), dtype=bool)
+    last[:-1] = first[1:]
+    return first, last
+
+
+
+
+def speed(dist, delta_t):
+    """Cociente distancia / tiempo, 0 si es indeterminado (distancia y tiempo 0)"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vel = dist / delta_t
+    vel[np.isnan(vel)] = 0
+    return vel
+
+
+
+
+def route_metrics(lon, lat, seconds, route):
+    """
+    Distancia, tiempo y velocidad de todas las rutas a la vez. En cada ruta,
+    distancia geodesica al punto siguiente (0 en el ultimo), tiempo desde el
+    punto anterior (0 en el primero) y su cociente (0 si es indeterminado).
+
+    Args:
+        lon, lat (numpy.ndarray): Coordenadas de cada punto.
+        seconds (numpy.ndarray): Hora de cada punto en segundos desde medianoche.
+        route (numpy.ndarray): Numero de ruta de cada punto (rutas contiguas).
+
+    Returns:
+        tuple: (dist_anterior, delta_t, velocidad) de cada punto.
+    """
+    first, last = route_bounds(route)
+
+    _, _, dist = GEOD.inv(lon, lat, np.roll(lon, -1), np.roll(lat, -1))
+    dist = np.asarray(dist, dtype=np.float64)
+    dist[last] = 0
+
+    delta_t = np.zeros(len(route))
+    delta_t[1:] = np.diff(seconds.astype(np.float64))
+    delta_t[first] = 0
+
+    return dist, delta_t, speed(dist, delta_t)
+
 
-    _, _, dist = geod.inv(lons, lats, lons2, lats2) # Devuelve metros
 
-    df['dist_anterior'] = dist
-    df.iloc[-1, df.columns.get_loc('dist_anterior')] = 0
-    return df
 
+class RouteWindowIndexer(BaseIndexer):
+    """Ventanas de window_size filas que no empiezan antes del inicio de su ruta (route_first)"""
 
-def calculateTime(df):
-    df['solo_hora'] = pd.to_datetime(df['solo_hora'], format="%H:%M:%S")
-    df['delta_t'] = (df['solo_hora'] - df['solo_hora'].shift(1)).dt.total_seconds()
-    df['delta_t'] = df['delta_t'].fillna(0)
-    return df
+    def get_window_bounds(self, num_values=0, min_periods=None, center=None, closed=None, step=None):
+        end = np.arange(1, num_values + 1, dtype=np.int64)
+        start = np.maximum(end - self.window_size, self.route_first)
+        return start, end
 
 
-def calculateVel(df):
-    df['velocidad'] = df['dist_anterior']/df['delta_t']
-    df['velocidad'] = df['velocidad'].fillna(0)
-    return df
 
 
+def outlier_flags(vel, route):
+    """
+    Marca los outliers de todas las rutas a la vez: puntos cuya velocidad es
+    mayor que OUTLIER_RATIO veces la media movil anterior y la siguiente
+    (OUTLIER_WINDOW puntos), o mayor que MAX_SPEED. Las medias moviles de cada
+    ruta se calculan en una sola pasada con ventanas limitadas a la ruta.
 
-def deleteOutliers(df):
-    df_clean = df.copy()
-    total_deleted = 0
+    Args:
+        vel (numpy.ndarray): Velocidad de cada punto.
+        route (numpy.ndarray): Numero de ruta de cada punto (rutas contiguas).
 
-    ref = pd.Series(dtype=float)
-    vel = df_clean['velocidad']
-    i = 0
-    while not ref.equals(vel):
-        current_app.logger.info(f'ITERACION {i} PARA QUITAR OUTLIERES')
-        vel = df_clean['velocidad']
+    Returns:
+        numpy.ndarray: Mascara de los puntos a eliminar.
+    """
+    first, last = route_bounds(route)
 
-        ref = vel.copy()
+    # Velocidad del punto anterior y del siguiente dentro de la ruta
+    vel_prev = np.roll(vel, 1)
+    vel_prev[first] = np.nan
+    vel_next = np.roll(vel, -1)
+    vel_next[last] = np.nan
 
-        # ---- media de los 4 anteriores ----
-        media_prev = vel.shift(1).rolling(window=12).mean()
-        # ---- media de los 4 siguientes ----
-        media_next = vel.shift(-1).rolling(window=12).mean()
+    starts = np.flatnonzero(first)
+    windows = RouteWindowIndexer(window_size=OUTLIER_WINDOW, route_first=starts[np.cumsum(first) - 1])
+    media_prev = pd.Series(vel_prev).rolling(windows, min_periods=OUTLIER_WINDOW).mean().to_numpy()
+    media_next = pd.Series(vel_next).rolling(windows, min_periods=OUTLIER_WINDOW).mean().to_numpy()
 
-        # Condiciones
-        cond_actual = vel > 1.5 * media_prev
-        cond_next = vel > 1.5 * media_next
-        cond_med = vel > 3.5
+    return is_outlier(vel, media_prev, media_next)
 
-        # marcar registros a eliminar
-        to_delete = (cond_actual & cond_next) | cond_med
 
-        deleted_now = to_delete.sum()
-        current_app.logger.info(f'SE HAN DETECTADO {deleted_now} OUTLIERS EN ESTA ITELACION')
 
-        total_deleted += deleted_now
 
-        # ---- eliminar ----
-        df_clean = df_clean[~to_delete].reset_index(drop=True)
+def is_outlier(vel, media_prev, media_next):
+    """Outlier si la velocidad supera OUTLIER_RATIO veces ambas medias moviles, o MAX_SPEED"""
+    cond_actual = vel > OUTLIER_RATIO * media_prev
+    cond_next = vel > OUTLIER_RATIO * media_next
+    cond_med = vel > MAX_SPEED
+    return (cond_actual & cond_next) | cond_med
 
-        # ---- recalcular datos ----
-        df_clean = calculateDistance(df_clean)
-        df_clean = calculateTime(df_clean)
-        df_clean = calculateVel(df_clean)
-        i += 1
 
-    return df_clean, total_deleted
 
 
+def _step(links, points):
+    """Punto anterior o siguiente (segun links) de cada punto, -1 si no hay"""
+    return np.where(points >= 0, links[np.maximum(points, 0)], -1)
 
-def removeOutliers(file_path):
+
+
+
+def window_means(vel, prev, nxt, points):
+    """
+    Medias moviles anterior y siguiente de algunos puntos, recorriendo la
+    lista de puntos que quedan en su ruta. Son las ventanas de outlier_flags:
+    los OUTLIER_WINDOW puntos anteriores, y los OUTLIER_WINDOW - 2 anteriores,
+    el propio punto y el siguiente. La media es NaN si a la ventana le faltan
+    puntos o tiene velocidades infinitas, como en la media movil de pandas.
+
+    Args:
+        vel (numpy.ndarray): Velocidad de cada punto.
+        prev, nxt (numpy.ndarray): Punto anterior y siguiente de cada punto (-1 si no hay).
+        points (numpy.ndarray): Puntos de los que se calculan las medias.
+
+    Returns:
+        tuple: (media anterior, media siguiente) de cada punto.
+    """
+    # Puntos anteriores, del mas lejano al mas cercano
+    before = [points]
+    for _ in range(OUTLIER_WINDOW):
+        before.insert(0, _step(prev, before[0]))
+    windows = np.stack(before + [_step(nxt, points)], axis=1)
+
+    values = np.where(windows >= 0, vel[np.maximum(windows, 0)], np.nan)
+    full = np.isfinite(values)
+
+    def mean(columns):
+        return np.where(full[:, columns].all(axis=1), values[:, columns].sum(axis=1) / OUTLIER_WINDOW, np.nan)
+
+    return mean(slice(0, OUTLIER_WINDOW)), mean(slice(2, OUTLIER_WINDOW + 2))
+
+
+
+
+def clean_routes_incremental(lon, lat, seconds, route, max_iterations):
+    """
+    Igual que clean_routes pero, tras la primera pasada, sin recalcular las
+    rutas enteras: los puntos que quedan forman una lista enlazada, al
+    eliminar un tramo de puntos solo se recalculan la distancia del punto
+    anterior al tramo y el tiempo del siguiente, y solo se vuelven a evaluar
+    los puntos cuyas ventanas incluyen el tramo o esas velocidades. El coste
+    de cada pasada es proporcional a los puntos eliminados.
+
+    Args:
+        lon, lat (numpy.ndarray): Coordenadas de cada punto.
+        seconds (numpy.ndarray): Hora de cada punto en segundos desde medianoche.
+        route (numpy.ndarray): Numero de ruta de cada punto (rutas contiguas).
+        max_iterations (int): Numero maximo de pasadas de eliminacion.
+
+    Returns:
+        tuple: (mascara de los puntos que se conservan,
+                (dist_anterior, delta_t, velocidad) de esos puntos)
+    """
+    first, last = route_bounds(route)
+    prev = np.arange(-1, len(route) - 1)
+    prev[first] = -1
+    nxt = np.arange(1, len(route) + 1)
+    nxt[last] = -1
+
+    keep = np.ones(len(route), dtype=bool)
+    dist, delta_t, vel = route_metrics(lon, lat, seconds, route)
+    outliers = np.flatnonzero(outlier_flags(vel, route))
+
+    for iteration in range(1, max_iterations + 1):
+        if not len(outliers):
+            break
+        keep[outliers] = False
+
+        # Tramos de puntos eliminados consecutivos y los puntos que quedan a cada lado
+        run_start = np.ones(len(outliers), dtype=bool)
+        run_start[1:] = nxt[outliers[:-1]] != outliers[1:]
+        run_end = np.ones(len(outliers), dtype=bool)
+        run_end[:-1] = run_start[1:]
+        left = prev[outliers[run_start]]
+        right = nxt[outliers[run_end]]
+        has_left = left >= 0
+        has_right = right >= 0
+        nxt[left[has_left]] = right[has_left]
+        prev[right[has_right]] = left[has_right]
+
+        # Distancia del punto izquierdo a su nuevo siguiente y tiempo del derecho desde su nuevo anterior
+        both = has_left & has_right
+        _, _, new_dist = GEOD.inv(lon[left[both]], lat[left[both]], lon[right[both]], lat[right[both]])
+        dist[left[both]] = new_dist
+        dist[left[has_left & ~has_right]] = 0
+        delta_t[right[both]] = seconds[right[both]].astype(np.float64) - seconds[left[both]]
+        delta_t[right[has_right & ~has_left]] = 0
+        changed = np.union1d(left[has_left], right[has_right])
+        vel[changed] = speed(dist[changed], delta_t[changed])
+        if iteration == max_iterations:
+            break
+
+        # Puntos cuyas ventanas cambian: desde el anterior al punto izquierdo
+        # hasta OUTLIER_WINDOW puntos despues del derecho
+        affected = [left, _step(prev, left)]
+        point = right
+        for _ in range(OUTLIER_WINDOW + 1):
+            affected.append(point)
+            point = _step(nxt, point)
+        affected = np.unique(np.concatenate(affected))
+        affected = affected[affected >= 0]
+
+        media_prev, media_next = window_means(vel, prev, nxt, affected)
+        outliers = affected[is_outlier(vel[affected], media_prev, media_next)]
+
+    return keep, (dist[keep], delta_t[keep], vel[keep])
+
+
+
+
+def clean_routes(lon, lat, seconds, route, max_iterations=1, incremental=True):
+    """
+    Elimina los outliers de todas las rutas a la vez, sin separar el fichero
+    en un dataframe por ruta. En cada pasada se calculan las metricas, se
+    marcan los outliers y se eliminan, hasta que no quedan outliers o se
+    llega a max_iterations. Por defecto se hace una sola pasada.
+
+    Args:
+        lon, lat (numpy.ndarray): Coordenadas de cada punto.
+        seconds (numpy.ndarray): Hora de cada punto en segundos desde medianoche.
+        route (numpy.ndarray): Numero de ruta de cada punto (rutas contiguas).
+        max_iterations (int, optional): Numero maximo de pasadas de eliminacion.
+        incremental (bool, optional): Tras la primera pasada, recalcular solo
+            alrededor de los puntos eliminados (clean_routes_incremental) en
+            lugar de todas las rutas.
+
+    Returns:
+        tuple: (mascara de los puntos que se conservan,
+                (dist_anterior, delta_t, velocidad) de esos puntos)
+    """
+    if incremental:
+        return clean_routes_incremental(lon, lat, seconds, route, max_iterations)
+
+    kept = np.arange(len(route))
+    for _ in range(max_iterations):
+        _, _, vel = route_metrics(lon[kept], lat[kept], seconds[kept], route[kept])
+        outliers = outlier_flags(vel, route[kept])
+        if not outliers.any():
+            break
+        kept = kept[~outliers]
+
+    keep = np.zeros(len(route), dtype=bool)
+    keep[kept] = True
+    return keep, route_metrics(lon[kept], lat[kept], seconds[kept], route[kept])
+
+
+
+
+def clean_routes_parallel(lon, lat, seconds, route, max_iterations=1, workers=None):
+    """
+    clean_routes repartiendo las rutas en fragmentos de rutas consecutivas
+    con un numero parecido de puntos, que se limpian en paralelo, cada uno en
+    un proceso. Las rutas son independientes, asi que el resultado es el
+    mismo que el de clean_routes sobre todos los puntos.
+
+    Args:
+        lon, lat (numpy.ndarray): Coordenadas de cada punto.
+        seconds (numpy.ndarray): Hora de cada punto en segundos desde medianoche.
+        route (numpy.ndarray): Numero de ruta de cada punto (rutas contiguas).
+        max_iterations (int, optional): Numero maximo de pasadas de eliminacion.
+        workers (int, optional): Numero de procesos (uno por CPU por defecto).
+
+    Returns:
+        tuple: (mascara de los puntos que se conservan,
+                (dist_anterior, delta_t, velocidad) de esos puntos)
+    """
+    starts = np.flatnonzero(route_bounds(route)[0])
+    workers = min(workers or os.cpu_count() or 1, len(starts))
+    if workers <= 1 or len(route) < OUTLIER_PARALLEL_MIN_ROWS:
+        return clean_routes(lon, lat, seconds, route, max_iterations)
+
+    # Cada fragmento empieza en la primera ruta a partir de su parte de los puntos
+    targets = np.arange(1, workers) * len(route) // workers
+    cuts = np.append(starts, len(route))[np.searchsorted(starts, targets)]
+    bounds = np.unique(np.concatenate([[0], cuts, [len(route)]]))
+    shards = [slice(start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+
+    # Se envian solo los arrays de cada fragmento
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(
+            clean_routes,
+            [lon[shard] for shard in shards],
+            [lat[shard] for shard in shards],
+            [seconds[shard] for shard in shards],
+            [route[shard] for shard in shards],
+            repeat(max_iterations)
+        ))
+
+    # Unir en el orden de los fragmentos
+    keep = np.concatenate([shard_keep for shard_keep, _ in results])
+    metrics = tuple(np.concatenate([shard_metrics[i] for _, shard_metrics in results]) for i in range(3))
+    return keep, metrics
+
+
+
+
+def removeOutliers(file_path, max_iterations=1, workers=None):
     try:
-        path = os.path.join(file_path, 'Fichero_E.csv')
-        df = pd.read_csv(path, delimiter=';', low_memory=False)
+        df = load_dataset(file_path, "E")
     except Exception:
         return jsonify({})
     
-    codireds = df['codired'].sort_values().unique()
+    codireds = df['cod_unidad'].sort_values().unique()
     pdas = df['cod_pda'].sort_values().unique()
     dates = df['solo_fecha'].sort_values().unique()
 
@@ -109,50 +373,33 @@ def removeOutliers(file_path):
         "Num PDAs": len(pdas),
         "Lista PDAs": pdas,
         "Num fechas": len(dates),
-        "Primera fecha": dates.tolist()[0],
-        "Ultima fecha": dates.tolist()[-1]
+        "Primera fecha": format_dates(dates[:1])[0],
+        "Ultima fecha": format_dates(dates[-1:])[0]
     }
-    num_routes = 0
-    deleted_points = 0
-
-    # Crear dict: { "PDA": {"fecha": df, "fecha": df, ...}, ...}
-    df_dict = create_dict(df)
-
-    for pda, dates in df_dict.items():
-        for date, dataframe in dates.items():
-            # Contar el num rutas
-            num_routes += 1
-            # Calcular distancia con el pto anterior
-            dataframe = calculateDistance(dataframe)
-            # Calcular tiempo con el pto anterior
-            dataframe = calculateTime(dataframe)
-            # Calclar velocidad
-            dataframe = calculateVel(dataframe)
-
-            # Eliminar olutiers
-            dataframe, num_deleted_points = deleteOutliers(dataframe)
-
-            # Contar registros eliminados
-            deleted_points += num_deleted_points
-
-            # Guardar modificaciones
-            df_dict[pda][date] = dataframe
-
-    # Reconstruir dataframe
-    frames = []
-    for pda, dates in df_dict.items():
-        for date, dataframe in dates.items():
-            frames.append(dataframe)
-
-    df = pd.concat(frames, ignore_index=True)
-    df['solo_hora'] = pd.to_datetime(df['solo_hora'])
-    df['solo_hora'] = df['solo_hora'].dt.strftime('%H:%M:%S')
-
-    # Escribir CSV
+
+    # Ordenar por ruta (PDA y fecha) y eliminar los outliers de todas las rutas
+    df, route = sort_routes(df)
+    num_routes = int(route[-1]) + 1 if len(route) else 0
+    keep, (dist, delta_t, vel) = clean_routes_parallel(
+        df['longitud'].to_numpy(dtype=np.float64),
+        df['latitud'].to_numpy(dtype=np.float64),
+        df['solo_hora'].to_numpy(),
+        route,
+        max_iterations,
+        workers
+    )
+    deleted_points = int(len(keep) - keep.sum())
+
+    df = df[keep].reset_index(drop=True)
+    df['dist_anterior'] = dist
+    df['delta_t'] = delta_t
+    df['velocidad'] = vel
+
+    # Escribir CSV (fechas y horas como texto)
     path = os.path.join(file_path, 'Fichero_E_filtrado.csv')
-    df.to_csv(path, sep=';', index=False)
+    format_date_columns(df).to_csv(path, sep=';', index=False)
 
-    deleted_points_mean = deleted_points/num_routes
+    deleted_points_mean = deleted_points/num_routes if num_routes else 0
 
     after_info = {
         "Registros totales": len(df),
@@ -168,9 +415,3 @@ def removeOutliers(file_path):
     current_app.logger.info(f'Informacion devuelta por la union: {str(final_info)}')
 
     return jsonify(convert_numpy(final_info))
-
-
-
-
-
-        
@@ -1,77 +1,59 @@
 from flask import jsonify, current_app
-from datetime import time
+from app.util.dataStore import save_dataset, save_catalog, load_dataset, DatasetWriter, ROW_GROUP_SIZE
+from app.util.dataProfile import DataProfile
+from app.util.fileSchema import format_dates
+from concurrent.futures import ProcessPoolExecutor
 import datetime
 import pandas as pd
 import numpy as np
 import os,json
 
 TIME_THRESHOLD = '59s'
-START_TIME = time(7, 30)
-END_TIME = time(22, 0)
+# Filas de B a partir de las que la union de B y C se reparte entre procesos
+MERGE_PARTITION_MIN_ROWS = 200_000
 
 
-def count_and_drop_duplicates(df):
-    df_length = len(df)
-    df = df.drop_duplicates(ignore_index=True)
-    duplicates_count = df_length - len(df)
-    return df, duplicates_count
-
-
-def align_two_dfs_on_zone_date(df1, df2):
-    keys = ['cod_pda', 'solo_fecha']
-
-    common = df1[keys].merge(df2[keys]).drop_duplicates()
-
-    df1_filt = df1.merge(common, on=keys, how='inner')
-    df2_filt = df2.merge(common, on=keys, how='inner')
-
-    return df1_filt, df2_filt
+# Motivo por el que se elimina un registro de df2 en align_one_df_on_zone_date,
+# indexado por 2 * (cod_pda no existe en df1) + (fecha no existe en df1)
+REMOVAL_REASONS = [
+    "solo_combinacion_no_existe",
+    "solo_fecha_no_existe",
+    "solo_cod_pda_no_existe",
+    "cod_pda_y_fecha_no_existen"
+]
 
 
 def align_one_df_on_zone_date(df1, df2):
     keys = ['cod_pda', 'solo_fecha']
 
-    # Claves comunes
-    common = df1[keys].merge(df2[keys]).drop_duplicates()
+    # Claves comunes (sin duplicados antes de unir, para no multiplicar filas)
+    common = df1[keys].drop_duplicates().merge(df2[keys].drop_duplicates())
 
-    # Filtrar df2
-    df_filt = df2.merge(common, on=keys, how='inner')
+    # Una sola union: registros conservados y eliminados de df2
+    merged = df2.merge(common, on=keys, how='left', indicator=True)
+    kept = (merged['_merge'] == 'both').to_numpy()
+    df_filt = merged[kept].drop(columns='_merge').reset_index(drop=True)
+    df_removed = merged[~kept].copy()
 
-    # Registros eliminados
-    df_removed = df2.merge(common, on=keys, how='left', indicator=True)
-    df_removed = df_removed[df_removed['_merge'] == 'left_only']
-    
     total_removed = len(df_removed)
 
-    # Conjuntos para comprobar existencia individual
-    set_pda   = set(df1['cod_pda'])
-    set_fecha = set(df1['solo_fecha'])
-    set_pairs = set(map(tuple, df1[keys].drop_duplicates().to_numpy()))
-
-    def clasificar(row):
-        cod_ok   = row['cod_pda'] in set_pda
-        fecha_ok = row['solo_fecha'] in set_fecha
-
-        # Todos los removed tienen pair_ok == False
-        if not cod_ok and fecha_ok:
-            return "solo_cod_pda_no_existe"
-        elif cod_ok and not fecha_ok:
-            return "solo_fecha_no_existe"
-        elif not cod_ok and not fecha_ok:
-            return "cod_pda_y_fecha_no_existen"
-        else:
-            return "solo_combinacion_no_existe"
-
-    df_removed["motivo"] = df_removed.apply(clasificar, axis=1)
+    # Existencia individual de cada clave en df1 (todos los eliminados tienen
+    # la combinacion inexistente): motivo = 2 * (falta cod_pda) + (falta fecha)
+    cod_missing = ~df_removed['cod_pda'].isin(df1['cod_pda'].unique()).to_numpy()
+    fecha_missing = ~df_removed['solo_fecha'].isin(df1['solo_fecha'].unique()).to_numpy()
+    df_removed["motivo"] = pd.Categorical.from_codes(
+        2 * cod_missing + fecha_missing,
+        categories=REMOVAL_REASONS
+    )
 
     # Diccionario de conteos
-    #conteo = df_removed["motivo"].value_counts().to_dict()
+    counts = df_removed["motivo"].value_counts()
     conteo = {
-    "solo_cod_pda_no_existe": (df_removed["motivo"] == "solo_cod_pda_no_existe").sum(),
-    "solo_fecha_no_existe": (df_removed["motivo"] == "solo_fecha_no_existe").sum(),
-    "cod_pda_y_fecha_no_existen": (df_removed["motivo"] == "cod_pda_y_fecha_no_existen").sum(),
-    "solo_combinacion_no_existe": (df_removed["motivo"] == "solo_combinacion_no_existe").sum()
-}
+        "solo_cod_pda_no_existe": counts["solo_cod_pda_no_existe"],
+        "solo_fecha_no_existe": counts["solo_fecha_no_existe"],
+        "cod_pda_y_fecha_no_existen": counts["cod_pda_y_fecha_no_existen"],
+        "solo_combinacion_no_existe": counts["solo_combinacion_no_existe"]
+    }
 
     # Añadir total al diccionario
     conteo["total_eliminados"] = total_removed
@@ -81,11 +63,14 @@ def align_one_df_on_zone_date(df1, df2):
     return df_filt, conteo
 
 
-def filter_by_time_range(df, start_time, end_time):
-    df_copy = df.copy()
-    df_copy['solo_hora'] = pd.to_datetime(df_copy['solo_hora']).dt.time
-    mask = (df_copy['solo_hora'] >= start_time) & (df_copy['solo_hora'] <= end_time)
-    return df[mask]
+def unify_categories(df1, df2, columns):
+    """Gives both dataframes the same categories in the categorical columns"""
+    for col in columns:
+        if isinstance(df1[col].dtype, pd.CategoricalDtype) and isinstance(df2[col].dtype, pd.CategoricalDtype):
+            categories = df1[col].cat.categories.union(df2[col].cat.categories)
+            df1[col] = df1[col].cat.set_categories(categories)
+            df2[col] = df2[col].cat.set_categories(categories)
+    return df1, df2
 
 
 def convert_numpy(obj):
@@ -99,6 +84,9 @@ def convert_numpy(obj):
     if isinstance(obj, (pd.Index,)):
         return convert_numpy(obj.tolist())
 
+    if isinstance(obj, pd.api.extensions.ExtensionArray):
+        return convert_numpy(obj.tolist())
+
     if isinstance(obj, (pd.Timestamp, datetime.datetime)):
         return obj.isoformat()
 
@@ -141,517 +129,215 @@ def convert_numpy(obj):
     return obj
 
 
-def calculate_base_statistics(df_B, df_C):
-    # Longitud de dataframes
-    B_length = len(df_B)
-    C_length = len(df_C)
-    total_length = B_length + C_length
-
-    length_statistics = {
-        "Registros totales": total_length,
-        "Registros B": B_length,
-        "Registros C": C_length
-    }
-
-    # Estadisticas de codigos de unidad
-    codireds_B = df_B['codired'].sort_values().unique()
-    codireds_B_length = len(codireds_B)
-    codireds_C = df_C['codired'].sort_values().unique()
-    codireds_C_length = len(codireds_C)
-
-    shared_codireds = set(codireds_B.tolist()) & set(codireds_C.tolist())
-    shared_codireds = sorted(shared_codireds)
-    shared_codireds_length = len(shared_codireds)
-
-    codired_statistics = {
-        "Num codireds encontrados en fichero B": codireds_B_length,
-        "Codireds en fichero B": codireds_B,
-        "Num codireds encontrados en fichero C": codireds_C_length,
-        "Codireds en fichero C": codireds_C,
-        "Num codireds compartidos": shared_codireds_length,
-        "Codireds compartidos": shared_codireds
-    }
-
-    # Estadisticas de PDAs
-    pdas_B = df_B['cod_pda'].sort_values().unique()
-    pdas_C = df_C['cod_pda'].sort_values().unique()
-
-    shared_pdas = set(pdas_B.tolist()) & set(pdas_C.tolist())
-    shared_pdas = sorted(shared_pdas)
+def factorize_keys(df1, df2, key):
+    """
+    Codifica con enteros los valores de una columna de dos DataFrames,
+    con los mismos codigos para los valores comunes.
 
-    pda_statistics = {
-        "Num PDAs encontradas en el fichero B": len(pdas_B),
-        "PDAs en fichero B": pdas_B,
-        "Num PDAs encontradas en el fichero C": len(pdas_C),
-        "PDAs en fichero C": pdas_C,
-        "Num PDAs compartida": len(shared_pdas),
-        "PDAs compartidas": shared_pdas
-    }
+    Args:
+        df1 (pandas.DataFrame): Primer DataFrame.
+        df2 (pandas.DataFrame): Segundo DataFrame.
+        key (str): Columna a codificar.
 
-    # Estadisticas de Fechas
-    dates_B = df_B['solo_fecha'].sort_values().unique()
-    dates_B_length = len(dates_B)
-    dates_C = df_C['solo_fecha'].sort_values().unique()
-    dates_C_length = len(dates_C)
-
-    shared_dates = set(dates_B.tolist()) & set(dates_C.tolist())
-    shared_dates = sorted(shared_dates)
-
-    dates_statistics = {
-        "Num fechas en fichero B": dates_B_length,
-        "Lista fecha en fichero B": dates_B,
-        "Num fechas en fichero C": dates_C_length,
-        "Lista fecha en fichero C": dates_C,
-        "Num fechas compartidas": len(shared_dates),
-        "Lista fecha compartida": shared_dates
-    }
+    Returns:
+        tuple: (codigos de df1, codigos de df2, numero de valores distintos).
+            Los valores nulos se codifican como -1.
+    """
+    codes, uniques = pd.factorize(pd.concat([df1[key], df2[key]], ignore_index=True))
+    return codes[:len(df1)], codes[len(df1):], len(uniques)
 
-    base_statistics = {
-        "Conteo de registros": length_statistics,
-        "Conteo codireds": codired_statistics,
-        "Conteo PDAs": pda_statistics,
-        "Conteo fechas": dates_statistics
-    }
 
-    return base_statistics
+def combine_keys(codes_a, codes_b):
+    """
+    Combina los codigos de dos claves en un unico codigo por pareja de valores.
 
+    Args:
+        codes_a (tuple): Codigos de la primera clave, como los devuelve factorize_keys.
+        codes_b (tuple): Codigos de la segunda clave.
 
-def unifyBCFiles(df_B, df_C, save_path):
+    Returns:
+        tuple: Codigos de la pareja con el mismo formato (-1 si algun valor es nulo).
     """
-        Calls necesary functions for creating new files from unifying the files
-        Args:
-            df_B : dataframe with data from file B
-            df_C : dataframe with data from file C
-        Returns:
-            JSON with all the erased data and its related information
+    a1, a2, size_a = codes_a
+    b1, b2, size_b = codes_b
+    combined = np.concatenate([
+        np.where((a1 < 0) | (b1 < 0), -1, a1.astype(np.int64) * size_b + b1),
+        np.where((a2 < 0) | (b2 < 0), -1, a2.astype(np.int64) * size_b + b2)
+    ])
+    # Renumerar para que los codigos sigan siendo pequenos al combinar mas claves
+    codes, uniques = pd.factorize(combined, use_na_sentinel=False)
+    codes = np.where(combined < 0, -1, codes)
+    return codes[:len(a1)], codes[len(a1):], len(uniques)
+
+
+def synchronize_on_keys(df1, df2, steps):
     """
-    
-    # Obtener Estadísticas iniciales
-    current_app.logger.info(f'======================== CALCULANDO ESTADISTICAS INICIALES')
-    first_info = calculate_base_statistics(df_B, df_C)
-
-    # TODO: añadir a las estadisticas
-
-    # Eliminar PDAs defectuosas
-    current_app.logger.info(f'======================== ELIMINANDO PDAS DEFECTUOSAS')
-    VALORES_DEFECTUOSOS = ['#N/D', '#N/A', '', 'NULL']
-    current_app.logger.info("--------------- Procesando Fichero B")
-    df_B['cod_pda'] = df_B['cod_pda'].replace(VALORES_DEFECTUOSOS, pd.NA)
-    df_B = df_B[df_B['cod_pda'].notna()]
-    current_app.logger.info("--------------- Procesando Fichero C")
-    df_C['cod_pda'] = df_C['cod_pda'].replace(VALORES_DEFECTUOSOS, pd.NA)
-    df_C = df_C[df_C['cod_pda'].notna()]
-    current_app.logger.info("--------------- Calculando estadisticas")
-    pda_erase_info = calculate_base_statistics(df_B, df_C)
-
-    # TODO: eliminar fechas defectuosas
-
-
-
-    # Eliminar duplicados
-    current_app.logger.info(f'SEPARANDO FICHEROS POR PDAS Y POR FECHAS ELIMINANDO DUPLICADOS')
-    current_app.logger.info("--------------- Procesando Fichero B")
-    df_B, duplicates_B = count_and_drop_duplicates(df_B)
-    current_app.logger.info(f"Duplicados: {duplicates_B}")
-    current_app.logger.info("--------------- Procesando Fichero C")
-    df_C, duplicates_C = count_and_drop_duplicates(df_C)
-    current_app.logger.info(f"Duplicados: {duplicates_C}")
-    current_app.logger.info("--------------- Calculando estadisticas")
-    total_duplicates = duplicates_B + duplicates_C
-    current_app.logger.info(f"Duplicados totales: {total_duplicates}")
-
-    df_B_clean = len(df_B)
-    df_C_clean = len(df_C)
-    total_clean = df_B_clean + df_C_clean
-
-    duplicates_info = {
-        "Duplicados totales": total_duplicates,
-        "Duplicados B": duplicates_B,
-        "Duplicados C": duplicates_C,
-        "Registros totales no duplicados": total_clean,
-        "Registros B no duplicados": df_B_clean,
-        "Registros C no duplicados": df_C_clean
-    }
-
-    # Extraer PDAS y Fechas compartidas
-    current_app.logger.info(f'======================== SINCORNIZANDO DATAFRAMES')
-    df_B, df_C = align_two_dfs_on_zone_date(df_B, df_C)
-    
-    current_app.logger.info("--------------- Calculando estadisticas")
-    
-    clean_df_info = calculate_base_statistics(df_B, df_C)
+    Sincroniza dos DataFrames aplicando en cascada varias claves: en cada paso
+    solo se mantienen las filas cuyo valor de la clave aparece en las filas
+    restantes de ambos DataFrames.
 
-    # Union por la izquierda (Fichero B) con un umbral de tiempo
-    current_app.logger.info(f'======================== CREANDO FICHERO D: UNIFICANDO FICHEROS B Y C')
-    
-    # Ordenar por hora
-    df_B_sorted = df_B.sort_values(['solo_hora'])
-    df_C_sorted = df_C.sort_values(['solo_hora'])
-
-    # Convertir hora a datatime
-    df_B_sorted['solo_hora'] = pd.to_datetime(df_B_sorted['solo_hora'])
-    df_C_sorted['solo_hora'] = pd.to_datetime(df_C_sorted['solo_hora'])
-
-    # Convertir codigo pda a string
-    df_B_sorted['cod_pda'] = df_B_sorted['cod_pda'].astype(str)
-    df_C_sorted['cod_pda'] = df_C_sorted['cod_pda'].astype(str)
+    Cada columna se codifica una sola vez y los pasos se aplican sobre mascaras
+    booleanas, de modo que los DataFrames filtrados solo se construyen al final.
 
-    # Convertir fecha a datetime
-    df_B_sorted['solo_fecha'] = pd.to_datetime(df_B_sorted['solo_fecha'])
-    df_C_sorted['solo_fecha'] = pd.to_datetime(df_C_sorted['solo_fecha'])
+    Args:
+        df1 (pandas.DataFrame): Primer DataFrame.
+        df2 (pandas.DataFrame): Segundo DataFrame.
+        steps (list): Claves de cada paso, una columna (str) o una lista de columnas.
 
-    # Convertir fecha formateada a datetime
-    df_B_sorted['formatted_fecha_hora'] = pd.to_datetime(df_B_sorted['formatted_fecha_hora'])
-    df_C_sorted['formatted_fecha_hora'] = pd.to_datetime(df_C_sorted['formatted_fecha_hora'])
-
-    # Realizar la union
-    df_D = pd.merge_asof(df_B_sorted, df_C_sorted, on='solo_hora', by=['cod_pda', 'solo_fecha'], tolerance=pd.Timedelta(TIME_THRESHOLD), direction='nearest')
-
-    # Ordenar por PDA, fecha y hora
-    df_D = df_D.sort_values(['cod_pda', 'solo_fecha', 'solo_hora'])
-
-    # Rellenar registros sin correspondencia con nan
-    df_D['longitud'] = df_D['longitud'].replace("", np.nan)
-
-    # Contar registros sin correspondencia
-    unmerged_rows = df_D['longitud'].isna().sum()
-
-    # Eliminar registros sin correspondencia
-    df_D = df_D.dropna(subset=['longitud'])
+    Returns:
+        tuple: (df1 filtrado, df2 filtrado, registros eliminados de df1 en cada
+            paso, registros eliminados de df2 en cada paso).
+    """
+    keep1 = np.ones(len(df1), dtype=bool)
+    keep2 = np.ones(len(df2), dtype=bool)
+    erased1 = []
+    erased2 = []
+    factorized = {}
+
+    for keys in steps:
+        current_app.logger.info(f"Claves a usar: {keys}")
+        keys = [keys] if isinstance(keys, str) else list(keys)
+        for key in keys:
+            if key not in factorized:
+                factorized[key] = factorize_keys(df1, df2, key)
+        codes = factorized[keys[0]]
+        for key in keys[1:]:
+            codes = combine_keys(codes, factorized[key])
+        codes1, codes2, size = codes
+
+        # Valores presentes en las filas que siguen en cada DataFrame
+        present1 = np.zeros(size + 1, dtype=bool)
+        present2 = np.zeros(size + 1, dtype=bool)
+        present1[codes1[keep1]] = True
+        present2[codes2[keep2]] = True
+        # La ultima posicion corresponde a los nulos (-1), que nunca son comunes
+        common = present1 & present2
+        common[-1] = False
+
+        before1, before2 = keep1.sum(), keep2.sum()
+        keep1 &= common[codes1]
+        keep2 &= common[codes2]
+        erased1.append(int(before1 - keep1.sum()))
+        erased2.append(int(before2 - keep2.sum()))
+
+    df1_filt = df1[keep1].reset_index(drop=True)
+    df2_filt = df2[keep2].reset_index(drop=True)
+
+    return df1_filt, df2_filt, erased1, erased2
 
-    # Calcular diferencia temporal entre registros correspondientes
-    df_D['dif_temp'] = (df_D['formatted_fecha_hora_x'] - df_D['formatted_fecha_hora_y']).abs().dt.total_seconds()
 
-    # Definir un nuevo campo para definir que son paradas
-    df_D['esParada'] = True
+def align_one_dfs_on_keys(df1, df2, keys): 
+    current_app.logger.info(f"Claves a usar: {keys}")
+    current_app.logger.info(isinstance(keys, str))
+    if isinstance(keys, str):
+        common = set(df1[keys].dropna()) & set(df2[keys].dropna())
+        
+        # Filtrar ambos DataFrames
+        df2_filt = df2[df2[keys].isin(common)]
+        
+        return df2_filt
 
-    # Elinimar y renombrar columnas repetidas
-    repeated_columns = ['codired_y', 'formatted_fecha_hora_y', 'fecha_hora_y']
-    df_D.drop(repeated_columns, axis=1, inplace=True)
-    df_D.rename(columns={
-                "codired_x": "codired",
-                "formatted_fecha_hora_x": "formatted_fecha_hora",
-                "fecha_hora_x": "fecha_hora"
-            }, inplace=True)
+    common = df1[keys].merge(df2[keys]).drop_duplicates()
     
-
-    current_app.logger.info(f'======================== ESCRIBIENDO FICHERO D')
-    path = os.path.join(save_path, 'Fichero_D.csv')
-    df_D.to_csv(path, sep=';', index=False)
-
-    # Registros usados de cada df
-    C_not_used = len(df_C)-len(df_D)
-    total_not_used = unmerged_rows + C_not_used
-    dates_D = df_D['solo_fecha'].sort_values().unique()
-    dates_D_length = len(dates_D)
-    if (dates_D_length != 0):
-        not_used_day_mean = total_not_used/dates_D_length
-        B_not_used_day_mean = unmerged_rows/dates_D_length
-        C_not_used_day_mean = C_not_used/dates_D_length
-    else:
-        not_used_day_mean = 0
-        B_not_used_day_mean = 0
-        C_not_used_day_mean = 0
+    df2_filt = df2.merge(common, on=keys, how='inner')
     
-    unused_info = {
-        "Totales no usados en la union": total_not_used,
-        "B_no_usados en la union": unmerged_rows,
-        "C_no_usados en la union": len(df_C)-len(df_D),
-        "Media diaria de registros sin correspondencia total": not_used_day_mean,
-        "Media diaria de registros sin correspondencia fichero B": B_not_used_day_mean,
-        "Media diaria de registros sin correspondencia fichero C": C_not_used_day_mean,
-    }
+    return df2_filt
 
 
-    # Estructurar informacion final
-    return_info = {
-        "Informacion inicial": first_info,
-        "Duplicados": duplicates_info,
-        "Información de sincronizacion": clean_df_info,
-        "Registros_no_usados": unused_info,
-        "Registros_finales": len(df_D)
-    }
-    current_app.logger.info(f'Informacion devuelta por la union: {str(return_info)}')
 
-    return jsonify(convert_numpy(return_info))
+def merge_asof_partition(df_B, df_C):
+    """
+    Une cada fila de B con la fila de C mas cercana en hora de la misma
+    seccion, turno y fecha. Se ejecuta en un proceso aparte, por lo que no
+    usa current_app.
 
+    Args:
+        df_B (pandas.DataFrame): Filas de B ordenadas por hora.
+        df_C (pandas.DataFrame): Filas de C ordenadas por hora.
 
-def unifyADFiles(df_A, df_D, save_path):
-    """
-        Calls necesary functions for creating new files from unifying the files
-        Args:
-            df_A : dataframe with data from file A
-            df_D : dataframe with data from file D (files B and C)
-        Returns:
-            JSON with all the erased data and its related information
+    Returns:
+        pandas.DataFrame: Union con una fila por cada fila de B, en su orden.
     """
+    # Convertir codigo pda a string (la hora ya esta en segundos)
+    df_B = df_B.assign(cod_pda=df_B['cod_pda'].astype(str))
 
-    # Obtener Estadísticas iniciales
-    current_app.logger.info(f'======================== CALCULANDO ESTADISTICAS INICIALES')
-    first_info = calculate_base_statistics(df_A, df_D)
-
-
-    # Eliminar PDAs defectuosas
-    current_app.logger.info(f'======================== ELIMINANDO PDAS DEFECTUOSAS')
-    VALORES_DEFECTUOSOS = ['#N/D', '#N/A', '', 'NULL']
-    current_app.logger.info("--------------- Procesando Fichero A")
-    before_A_length = len(df_A)
-    df_A['cod_pda'] = df_A['cod_pda'].replace(VALORES_DEFECTUOSOS, pd.NA)
-    df_A = df_A[df_A['cod_pda'].notna()]
-    pda_A_length = before_A_length - len(df_A)
-    current_app.logger.info("--------------- Procesando Fichero D")
-    before_D_length = len(df_D)
-    df_D['cod_pda'] = df_D['cod_pda'].replace(VALORES_DEFECTUOSOS, pd.NA)
-    df_D = df_D[df_D['cod_pda'].notna()]
-    pda_D_length = before_D_length - len(df_D)
-
-    # Eliminar fechas defectuosas
-    current_app.logger.info(f'======================== ELIMINANDO FECHAS DEFECTUOSAS')
-    current_app.logger.info("--------------- Procesando Fichero A")
-    before_A_length = len(df_A)
-    df_A = df_A.dropna(subset=['solo_fecha'])
-    fechas_A_length = before_A_length - len(df_A)
-    current_app.logger.info("--------------- Procesando Fichero D")
-    before_D_length = len(df_D)
-    df_D = df_D.dropna(subset=['solo_fecha'])
-    fechas_D_length = before_D_length - len(df_D)
-
-    # Eliminar horas defectuosas
-    current_app.logger.info(f'======================== ELIMINANDO HORAS DEFECTUOSAS')
-    current_app.logger.info("--------------- Procesando Fichero A")
-    before_A_length = len(df_A)
-    df_A = filter_by_time_range(df_A, START_TIME, END_TIME)
-    horas_A_length = before_A_length - len(df_A)
-    current_app.logger.info("--------------- Procesando Fichero D")
-    before_D_length = len(df_D)
-    df_D = filter_by_time_range(df_D, START_TIME, END_TIME)
-    hora_D_length = before_D_length - len(df_D)
-
-    current_app.logger.info("--------------- Calculando estadisticas")
-    defective_info = {
-        "PDAs A": pda_A_length,
-        "PDAs D": pda_D_length,
-        "Fechas A": fechas_A_length,
-        "Fechas D": fechas_D_length,
-        "Horas A": horas_A_length,
-        "Horas D": hora_D_length
-    }
-
+    return pd.merge_asof(
+        df_B,
+        df_C,
+        on='solo_hora',
+        by=["seccion", "turno", "solo_fecha"],
+        tolerance=int(pd.Timedelta(TIME_THRESHOLD).total_seconds()),
+        direction='nearest'
+        )
 
-    # Eliminar duplicados
-    current_app.logger.info(f'SEPARANDO FICHEROS POR PDAS Y POR FECHAS ELIMINANDO DUPLICADOS')
-    current_app.logger.info("--------------- Procesando Fichero A")
-    df_A, duplicates_A = count_and_drop_duplicates(df_A)
-    current_app.logger.info(f"Duplicados: {duplicates_A}")
-    current_app.logger.info("--------------- Procesando Fichero D")
-    df_D, duplicates_D = count_and_drop_duplicates(df_D)
-    current_app.logger.info(f"Duplicados: {duplicates_D}")
-    current_app.logger.info("--------------- Calculando estadisticas")
-    total_duplicates = duplicates_A + duplicates_D
-    current_app.logger.info(f"Duplicados totales: {total_duplicates}")
-
-    df_A_clean = len(df_A)
-    df_D_clean = len(df_D)
-    total_clean = df_A_clean + df_D_clean
-
-    duplicates_info = {
-        "Duplicados totales": total_duplicates,
-        "Duplicados A": duplicates_A,
-        "Duplicados D": duplicates_D,
-        "Registros totales no duplicados": total_clean,
-        "Registros A no duplicados": df_A_clean,
-        "Registros D no duplicados": df_D_clean
-    }
 
+def merge_B_C_files(df_B, df_C, workers=None):
+    """
+    Une los ficheros B y C por hora mas cercana (merge_asof).
 
-    # Extraer PDAS y Fechas compartidas
-    current_app.logger.info(f'======================== SINCORNIZANDO DATAFRAMES')
-    df_D, aling_info = align_one_df_on_zone_date(df_A, df_D)
+    Como la fecha es una de las claves de la union, las fechas se reparten en
+    particiones con un numero parecido de filas de B que se unen en paralelo,
+    cada una en un proceso. Las particiones conservan el orden de las filas
+    de los ficheros ordenados, de modo que el resultado es el mismo que el de
+    una unica union global.
 
-    current_app.logger.info("--------------- Calculando estadisticas")
-    clean_df_info = calculate_base_statistics(df_A, df_D)
-    
+    Args:
+        df_B (pandas.DataFrame): Fichero B sincronizado.
+        df_C (pandas.DataFrame): Fichero C sincronizado.
+        workers (int, optional): Numero de procesos (uno por CPU por defecto).
 
-    # Union por la izquierda (Fichero B) con un umbral de tiempo
-    current_app.logger.info(f'======================== CREANDO FICHERO E: UNIFICANDO FICHEROS A Y D')
-    
+    Returns:
+        pandas.DataFrame: Union con una fila por cada fila de B, ordenada por hora.
+    """
     # Ordenar por hora
-    df_A_sorted = df_A.sort_values(['solo_hora'])
-    df_D_sorted = df_D.sort_values(['solo_hora'])
-
-    # Convertir hora a datatime
-    df_A_sorted['solo_hora'] = pd.to_datetime(df_A_sorted['solo_hora'])
-    df_D_sorted['solo_hora'] = pd.to_datetime(df_D_sorted['solo_hora'])
-    df_A_sorted['solo_hora'] = df_A_sorted['solo_hora'].dt.strftime('%H:%M:%S')
-    df_D_sorted['solo_hora'] = df_D_sorted['solo_hora'].dt.strftime('%H:%M:%S')
-
-    # Convertir codigo pda a string
-    df_A_sorted['cod_pda'] = df_A_sorted['cod_pda'].astype(str)
-    df_D_sorted['cod_pda'] = df_D_sorted['cod_pda'].astype(str)
-
-    # Convertir fecha a datetime
-    df_A_sorted['solo_fecha'] = pd.to_datetime(df_A_sorted['solo_fecha'])
-    df_D_sorted['solo_fecha'] = pd.to_datetime(df_D_sorted['solo_fecha'])
-
-    # Convertir fecha formateada a datetime
-    df_A_sorted['formatted_fecha_hora'] = pd.to_datetime(df_A_sorted['formatted_fecha_hora'])
-    df_D_sorted['formatted_fecha_hora'] = pd.to_datetime(df_D_sorted['formatted_fecha_hora'])
-
-    # Realizar la union
-    df_E = df_A_sorted.merge(df_D_sorted, how='outer')
-
-    # Ordenar por PDA, fecha y hora
-    df_E = df_E.sort_values(['cod_pda', 'solo_fecha', 'solo_hora'])
-
-    # Eliminar y renombrar columnas necesarias
-    df_E.drop('fecha_hora', axis=1, inplace=True)
-    df_E.rename(columns={
-                "formatted_fecha_hora": "fecha_hora"
-            }, inplace=True)
-    
-    # Rellenar datos necesarios
-    df_E['esParada'] = df_E['esParada'].fillna(False)
-
-    # Rellenar registros defectuosos con nan
-    df_D['fecha_hora'] = df_D['fecha_hora'].replace("", np.nan)
-
-    # Eliminar registros defectuosos
-    df_D = df_D.dropna(subset=['fecha_hora'])
-
-    current_app.logger.info(f'======================== ESCRIBIENDO FICHERO E')
-    path = os.path.join(save_path, 'Fichero_E.csv')
-    df_E.to_csv(path, sep=';', index=False)
-
-
-
-    # Estructurar informacion final
-    return_info = {
-        "Informacion inicial": first_info,
-        "Defectuoso": defective_info,
-        "Duplicados": duplicates_info,
-        "Motivo eliminar sincronizacion": aling_info,
-        "Información de sincronizacion": clean_df_info,
-        #"Registros_no_usados": unused_info,
-        "Registros_finales": len(df_E)
-    }
-    current_app.logger.info(f'Informacion devuelta por la union: {str(return_info)}')
-
-    return jsonify(convert_numpy(return_info))
-
-
+    df_B_sorted = df_B.sort_values(['solo_hora'])
+    df_C_sorted = df_C.sort_values(['solo_hora'])
 
-def get_data_info(df):
-    # Dataframe length
-    length = len(df)
+    # Igualar categorias de las claves de union
+    df_B_sorted, df_C_sorted = unify_categories(df_B_sorted, df_C_sorted, ["seccion", "turno"])
 
-    # Unit codes
-    unit_codes = df['cod_unidad'].sort_values().unique()
-    unit_codes_length = len(unit_codes)
+    codes_B, dates = pd.factorize(df_B_sorted['solo_fecha'])
+    workers = min(workers or os.cpu_count() or 1, len(dates))
+    if workers <= 1 or len(df_B_sorted) < MERGE_PARTITION_MIN_ROWS:
+        return merge_asof_partition(df_B_sorted, df_C_sorted)
 
-    # Estadisticas de PDAs
-    if set(['cod_pda', 'seccion', 'turno', 'solo_fecha']).issubset(df.columns):
-        # File B
-        pdas_dics = (
-            df[['cod_pda', 'seccion', 'turno', 'solo_fecha']]
-            .drop_duplicates()
-            .sort_values(by=['cod_pda', 'seccion', 'turno', 'solo_fecha'])
-        )
-        pdas_list = pdas_dics.values.tolist()
-        pdas_length = len(pdas_list)
-        num_inv = df['cod_pda'].sort_values().unique()
-        num_inv_length = len(num_inv)
-    elif set(['seccion', 'turno', 'solo_fecha']).issubset(df.columns):
-        # File C
-        pdas_dics = (
-            df[['seccion', 'turno', 'solo_fecha']]
-            .drop_duplicates()
-            .sort_values(by=['seccion', 'turno', 'solo_fecha'])
-        )
-        pdas_list = pdas_dics.values.tolist()
-        pdas_length = len(pdas_list)
-        num_inv = []
-        num_inv_length = 0
-    elif 'cod_pda' in df.columns:
-        # File A
-        pdas_list = df['cod_pda'].sort_values().unique()
-        pdas_length = len(pdas_list)
-        num_inv = pdas_list
-        num_inv_length = pdas_length
-    else:
-        # No file
-        pdas_list = []
-        pdas_length = 0
-        num_inv = []
-        num_inv_length = 0
-
-    # Estadisticas de Fechas
-    dates = df['solo_fecha'].sort_values().unique()
-    dates_length = len(dates)
-
-
-    base_statistics = {
-        "length" : length,
-        "unit_codes_length" : unit_codes_length,
-        "unit_codes" : unit_codes,
-        "pdas_length" : pdas_length,
-        "pdas" : pdas_list,
-        "num_inv_length" : num_inv_length,
-        "num_inv" : num_inv,
-        "dates_length" : dates_length,
-        "dates" : dates
-    }
-    current_app.logger.info(f"Las pdas son: {base_statistics['num_inv']}")
+    # Asignar cada fecha a una particion segun las filas de B acumuladas
+    rows_per_date = np.bincount(codes_B, minlength=len(dates))
+    first_row = np.cumsum(rows_per_date) - rows_per_date
+    partition_of_date = np.minimum(first_row * workers // len(df_B_sorted), workers - 1)
 
-    return base_statistics
+    # Las filas de C de fechas sin filas en B no se pueden unir: particion extra que se descarta
+    codes_C = pd.Index(dates).get_indexer(df_C_sorted['solo_fecha'])
+    partition_B = partition_of_date[codes_B]
+    partition_C = np.where(codes_C >= 0, partition_of_date[codes_C], workers)
 
+    # Posiciones de cada particion, en el orden de los ficheros ordenados
+    positions_B = np.split(np.argsort(partition_B, kind='stable'), np.cumsum(np.bincount(partition_B, minlength=workers))[:-1])
+    positions_C = np.split(np.argsort(partition_C, kind='stable'), np.cumsum(np.bincount(partition_C, minlength=workers + 1))[:-1])
+    tasks = [(pos_B, pos_C) for pos_B, pos_C in zip(positions_B, positions_C[:workers]) if len(pos_B)]
 
+    current_app.logger.info(f"Uniendo B y C en {len(tasks)} particiones de fechas con {workers} procesos")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(
+            merge_asof_partition,
+            [df_B_sorted.take(pos_B) for pos_B, _ in tasks],
+            [df_C_sorted.take(pos_C) for _, pos_C in tasks]
+        ))
 
+    # Recuperar el orden de B de la union global
+    df_D = pd.concat(results, ignore_index=True)
+    positions = np.concatenate([pos_B for pos_B, _ in tasks])
+    return df_D.take(np.argsort(positions)).reset_index(drop=True)
 
-def align_two_dfs_on_keys(df1, df2, keys): 
-    current_app.logger.info(f"Claves a usar: {keys}")
-    current_app.logger.info(isinstance(keys, str))
-    if isinstance(keys, str):
-        common = set(df1[keys].dropna()) & set(df2[keys].dropna())
-        
-        # Filtrar ambos DataFrames
-        df1_filt = df1[df1[keys].isin(common)]
-        df2_filt = df2[df2[keys].isin(common)]
-        
-        return df1_filt, df2_filt
 
-    common = df1[keys].merge(df2[keys]).drop_duplicates()
-    
-    df1_filt = df1.merge(common, on=keys, how='inner')
-    df2_filt = df2.merge(common, on=keys, how='inner')
-    
-    return df1_filt, df2_filt
 
 
-def align_one_dfs_on_keys(df1, df2, keys): 
-    current_app.logger.info(f"Claves a usar: {keys}")
-    current_app.logger.info(isinstance(keys, str))
-    if isinstance(keys, str):
-        common = set(df1[keys].dropna()) & set(df2[keys].dropna())
-        
-        # Filtrar ambos DataFrames
-        df2_filt = df2[df2[keys].isin(common)]
-        
-        return df2_filt
-
-    common = df1[keys].merge(df2[keys]).drop_duplicates()
-    
-    df2_filt = df2.merge(common, on=keys, how='inner')
-    
-    return df2_filt
-
-
-
-def create_D_file(df_B, df_C, save_path):
+def create_D_file(df_B, df_C, save_path, workers=None):
     # Initical read
     current_app.logger.info(f"======================== READING: FILES B AND C")
 
-    b_initial_read = get_data_info(df_B)
-    c_initial_read = get_data_info(df_C)
+    b_initial_read = DataProfile(df_B)
+    c_initial_read = DataProfile(df_C)
 
 
     # Getting delivery attempts only
@@ -667,8 +353,9 @@ def create_D_file(df_B, df_C, save_path):
     b_after_length = len(df_B)
     #c_after_length = len(df_C)
 
+    b_delivery_read = DataProfile(df_B)
     b_delivery_attempts = {
-        "data_info" : get_data_info(df_B),
+        "data_info" : b_delivery_read.to_dict(),
         "erased_info" : b_before_length - b_after_length
     }
     #c_delivery_attempts = {
@@ -680,68 +367,44 @@ def create_D_file(df_B, df_C, save_path):
     # Sinchronizing data
     current_app.logger.info(f"======================== SINCHRONIZING DATA: FILES B AND C")
 
-    b_before_info = get_data_info(df_B)
-    c_before_info = get_data_info(df_C)
+    # Los ficheros no han cambiado desde el ultimo perfil
+    b_before_info = b_delivery_read
+    c_before_info = c_initial_read
 
     b_before_length = len(df_B)
     c_before_length = len(df_C)
 
-    # Sinchronize unit code
-    current_app.logger.info(f"============ UNIT CODE")
-    df_B, df_C = align_two_dfs_on_keys(df_B, df_C, "cod_unidad")
-
-    b_mid_unit_code_length = len(df_B)
-    c_mid_unit_code_length = len(df_C)
-
-    # Sinchronize section
-    current_app.logger.info(f"============ SECTION")
-    df_B, df_C = align_two_dfs_on_keys(df_B, df_C, "seccion")
+    # Sinchronize unit code, section, shift, dates and all of them together
+    df_B, df_C, b_erased, c_erased = synchronize_on_keys(
+        df_B,
+        df_C,
+        ["cod_unidad", "seccion", "turno", "solo_fecha", ["cod_unidad", "seccion", "turno", "solo_fecha"]]
+    )
 
-    b_mid_section_length = len(df_B)
-    c_mid_section_length = len(df_C)
-
-    # Sinchronize shift
-    current_app.logger.info(f"============ SHIFT")
-    df_B, df_C = align_two_dfs_on_keys(df_B, df_C, "turno")
-
-    b_mid_shift_length = len(df_B)
-    c_mid_shift_length = len(df_C)
-
-    # Sinchronize dates
-    current_app.logger.info(f"============ DATES")
-    df_B, df_C = align_two_dfs_on_keys(df_B, df_C, "solo_fecha")
-
-    b_mid_dates_length = len(df_B)
-    c_mid_dates_length = len(df_C)
-
-    # Sinchronize all
-    current_app.logger.info(f"============ ALL")
-    df_B, df_C = align_two_dfs_on_keys(df_B, df_C, ["cod_unidad", "seccion", "turno", "solo_fecha"])
-
-    b_after_info = get_data_info(df_B)
-    c_after_info = get_data_info(df_C)
+    b_after_info = DataProfile(df_B)
+    c_after_info = DataProfile(df_C)
 
     b_after_length = len(df_B)
     c_after_length = len(df_C)
 
     sinchronized = {
-        "b_before" : b_before_info,
-        "c_before" : c_before_info,
-        "b_unit_code_reg_erased" : b_before_length - b_mid_unit_code_length,
-        "c_unit_code_reg_erased" : c_before_length - c_mid_unit_code_length,
-        "b_section_reg_erased" : b_mid_unit_code_length - b_mid_section_length,
-        "c_section_reg_erased" : c_mid_unit_code_length - c_mid_section_length,
-        "b_shift_reg_erased" : b_mid_section_length - b_mid_shift_length,
-        "c_shift_reg_erased" : c_mid_section_length - c_mid_shift_length,
-        "b_dates_reg_erased" : b_mid_shift_length - b_mid_dates_length,
-        "c_dates_reg_erased" : c_mid_shift_length - c_mid_dates_length,
-        "b_sinchronized_reg_erased" : b_mid_dates_length - b_after_length,
-        "c_sinchronized_reg_erased" : c_mid_dates_length - c_after_length,
+        "b_before" : b_before_info.to_dict(),
+        "c_before" : c_before_info.to_dict(),
+        "b_unit_code_reg_erased" : b_erased[0],
+        "c_unit_code_reg_erased" : c_erased[0],
+        "b_section_reg_erased" : b_erased[1],
+        "c_section_reg_erased" : c_erased[1],
+        "b_shift_reg_erased" : b_erased[2],
+        "c_shift_reg_erased" : c_erased[2],
+        "b_dates_reg_erased" : b_erased[3],
+        "c_dates_reg_erased" : c_erased[3],
+        "b_sinchronized_reg_erased" : b_erased[4],
+        "c_sinchronized_reg_erased" : c_erased[4],
         "b_total_reg_erased" : b_before_length - b_after_length,
         "c_total_reg_erased" : c_before_length - c_after_length,
         "total_reg_erased" : b_before_length - b_after_length + c_before_length - c_after_length,
-        "b_after" : b_after_info,
-        "c_after" : c_after_info
+        "b_after" : b_after_info.to_dict(values=True),
+        "c_after" : c_after_info.to_dict(values=True)
     }
 
 
@@ -751,26 +414,8 @@ def create_D_file(df_B, df_C, save_path):
     b_before_length = len(df_B)
     c_before_length = len(df_C)
 
-    # Ordenar por hora
-    df_B_sorted = df_B.sort_values(['solo_hora'])
-    df_C_sorted = df_C.sort_values(['solo_hora'])
-    # Convertir hora a datatime
-    df_B_sorted['solo_hora'] = pd.to_timedelta(df_B_sorted['solo_hora'].astype(str))
-    df_C_sorted['solo_hora'] = pd.to_timedelta(df_C_sorted['solo_hora'].astype(str))
-
-    # Convertir codigo pda a string
-    df_B_sorted['cod_pda'] = df_B_sorted['cod_pda'].astype(str)
-    #df_C_sorted['cod_pda'] = df_C_sorted['cod_pda'].astype(str)
-
     # Realizar la union
-    df_D = pd.merge_asof(
-        df_B_sorted,
-        df_C_sorted,
-        on='solo_hora',
-        by=["seccion", "turno", "solo_fecha"],
-        tolerance=pd.Timedelta(TIME_THRESHOLD),
-        direction='nearest'
-        )
+    df_D = merge_B_C_files(df_B, df_C, workers)
 
     # Ordenar por PDA, fecha y hora
     df_D = df_D.sort_values(['cod_pda', 'solo_fecha', 'solo_hora'])
@@ -803,21 +448,18 @@ def create_D_file(df_B, df_C, save_path):
         "c_used" : c_used,
         "b_unused" : b_unused,
         "c_unused" : c_before_length - c_used,
-        "final" : get_data_info(df_D)
+        "final" : DataProfile(df_D).to_dict(values=True)
     }
 
 
     current_app.logger.info(f"======================== WRINTING: FILE D")
-    path = os.path.join(save_path, 'Fichero_D.csv')
-    df_D.to_csv(path, sep=';', index=False)
-    pkl_path = path.replace(".csv", ".pkl")
-    df_D.to_pickle(pkl_path)
+    save_dataset(df_D, save_path, "D")
 
 
     # Save statistics in JSON
     process_info = {
-        "B_initial" : convert_numpy(b_initial_read),
-        "C_initial" : convert_numpy(c_initial_read),
+        "B_initial" : convert_numpy(b_initial_read.to_dict(values=True)),
+        "C_initial" : convert_numpy(c_initial_read.to_dict(values=True)),
         "B_delivery" : convert_numpy(b_delivery_attempts),
         #"C_delivery" : convert_numpy(c_delivery_attempts),
         "sinchronized" : convert_numpy(sinchronized),
@@ -851,17 +493,190 @@ def create_D_file(df_B, df_C, save_path):
 
 
 
+def build_catalog(df, offset=0):
+    """
+        Builds the catalog used by the option selectors of the frontend:
+        offices -> PDAs -> dates, with the number of rows of each level and
+        the range of rows [start, end) it covers
+        Args:
+            df : unified dataframe (E), sorted by cod_unidad, cod_pda, solo_fecha and solo_hora
+            offset : row of the file where df starts, when E is written in parts
+        Returns:
+            dict {cod_unidad: {"rows", "start", "end", "dates",
+                  "pdas": {cod_pda: {"rows", "start", "end", "dates": {fecha: {"rows", "start", "end"}}}}}}
+    """
+    positions = pd.Series(np.arange(offset, offset + len(df)), index=df.index)
+
+    def ranges(keys):
+        grouped = positions.groupby([df[key] for key in keys], observed=True, sort=True)
+        return grouped.agg(['min', 'size']).itertuples()
+
+    catalog = {}
+    for unit, start, rows in ranges(['cod_unidad']):
+        catalog[str(unit)] = {"rows": int(rows), "start": int(start), "end": int(start + rows), "dates": set(), "pdas": {}}
+
+    for (unit, pda), start, rows in ranges(['cod_unidad', 'cod_pda']):
+        catalog[str(unit)]["pdas"][str(pda)] = {"rows": int(rows), "start": int(start), "end": int(start + rows), "dates": {}}
+
+    date_ranges = list(ranges(['cod_unidad', 'cod_pda', 'solo_fecha']))
+    dates = format_dates([date for (_, _, date), _, _ in date_ranges])
+    for ((unit, pda, _), start, rows), date in zip(date_ranges, dates):
+        catalog[str(unit)]["dates"].add(date)
+        catalog[str(unit)]["pdas"][str(pda)]["dates"][date] = {"rows": int(rows), "start": int(start), "end": int(start + rows)}
+
+    for unit_entry in catalog.values():
+        unit_entry["dates"] = sorted(unit_entry["dates"])
+
+    return catalog
+
+
+
+
+def _sort_codes(values):
+    """Array with the same order as the values of a column, used as a key of np.lexsort"""
+    if values.dtype.kind in "mM":
+        return values.array.asi8
+    if values.dtype.kind in "biuf":
+        return values.to_numpy()
+    return pd.factorize(values, sort=True)[0]
+
+
+
+
+def combine_A_D_rows(df_A, df_D):
+    """
+        Combines rows of A and D into rows of E. The result is the same as an
+        outer merge on every shared column, already sorted by cod_unidad,
+        cod_pda, solo_fecha and solo_hora: rows of A without an identical row
+        in D keep the D columns empty, and an A row identical to D rows takes
+        the D columns (once per D row).
+        The rows are ordered with one lexsort of integer keys instead of the
+        hash table of the merge and a sort of the whole dataframe.
+        Args:
+            df_A : rows of A (cod_pda as string)
+            df_D : rows of D of the same offices
+        Returns:
+            Dataframe with the columns of A followed by the other columns of D
+    """
+    keys = [col for col in df_A.columns if col in df_D.columns]
+    extra = [col for col in df_D.columns if col not in keys]
+    n_A = len(df_A)
+
+    values = {col: pd.concat([df_A[col], df_D[col]], ignore_index=True) for col in keys}
+    codes = {col: _sort_codes(values[col]) for col in keys}
+
+    # Orden (cod_unidad, cod_pda, solo_fecha, solo_hora) y, a igualdad, el orden del
+    # resto de claves, que es el que deja la union completa
+    order_keys = ['cod_unidad', 'cod_pda', 'solo_fecha', 'solo_hora']
+    order_keys += [col for col in keys if col not in order_keys]
+    order = np.lexsort([codes[col] for col in reversed(order_keys)])
+
+    # Grupos de filas identicas en todas las claves
+    same_as_previous = np.zeros(len(order), dtype=bool)
+    same_as_previous[1:] = True
+    for col in keys:
+        sorted_codes = codes[col][order]
+        same_as_previous[1:] &= sorted_codes[1:] == sorted_codes[:-1]
+    group = np.cumsum(~same_as_previous) - 1
+    from_D = order >= n_A
+    n_groups = len(order) - int(same_as_previous.sum())
+    rows_A = np.bincount(group[~from_D], minlength=n_groups)
+    rows_D = np.bincount(group[from_D], minlength=n_groups)
+
+    # Grupos con filas de A y de D: cada fila de A se une con cada fila de D
+    mixed = np.flatnonzero((rows_A > 0) & (rows_D > 0))
+    if len(mixed):
+        starts = np.flatnonzero(~same_as_previous)
+        ends = np.append(starts[1:], len(order))
+        parts = []
+        last = 0
+        for g in mixed:
+            segment = order[starts[g]:ends[g]]
+            parts.append(order[last:starts[g]])
+            parts.append(np.tile(segment[segment >= n_A], rows_A[g]))
+            last = ends[g]
+        parts.append(order[last:])
+        order = np.concatenate(parts)
+
+    columns = {col: values[col].take(order).reset_index(drop=True) for col in keys}
+    # Filas de A sin fila de D: columnas de D vacias
+    positions_D = np.where(order >= n_A, order - n_A, -1)
+    for col in extra:
+        columns[col] = pd.Series(df_D[col].array.take(positions_D, allow_fill=True))
+
+    return pd.DataFrame(columns, columns=list(df_A.columns) + extra)
+
+
+
+
+def write_E_file(df_A, df_D, save_path):
+    """
+        Writes Fichero_E progressively. The offices are processed in order, in
+        batches of about ROW_GROUP_SIZE rows, and each batch is combined
+        (combine_A_D_rows) and appended to the file, so E is never held in
+        memory as a whole and never sorted as a whole.
+        Args:
+            df_A : file A (cod_pda as string)
+            df_D : file D synchronized with A
+            save_path : session folder
+        Returns:
+            (catalog of E, number of rows of E)
+    """
+    # Filas de cada oficina, en orden de oficina y conservando el orden de cada fichero
+    unit_codes, units = pd.factorize(pd.concat([df_A['cod_unidad'], df_D['cod_unidad']], ignore_index=True), sort=True)
+    codes_A, codes_D = unit_codes[:len(df_A)], unit_codes[len(df_A):]
+    order_A = np.argsort(codes_A, kind='stable')
+    order_D = np.argsort(codes_D, kind='stable')
+    bounds_A = np.concatenate([[0], np.cumsum(np.bincount(codes_A, minlength=len(units)))])
+    bounds_D = np.concatenate([[0], np.cumsum(np.bincount(codes_D, minlength=len(units)))])
+
+    # Lotes de oficinas consecutivas con unas ROW_GROUP_SIZE filas
+    batches = []
+    first = 0
+    for unit in range(len(units)):
+        rows = bounds_A[unit + 1] - bounds_A[first] + bounds_D[unit + 1] - bounds_D[first]
+        if rows >= ROW_GROUP_SIZE or unit == len(units) - 1:
+            batches.append((first, unit + 1))
+            first = unit + 1
+
+    writer = DatasetWriter(save_path, "E")
+    catalog = {}
+    length = 0
+    # Sin filas se escribe igualmente un fichero vacio
+    for first, end in batches or [(0, 0)]:
+        df_E = combine_A_D_rows(
+            df_A.take(order_A[bounds_A[first]:bounds_A[end]]),
+            df_D.take(order_D[bounds_D[first]:bounds_D[end]])
+        )
+
+        # Eliminar y renombrar columnas necesarias
+        df_E.drop('fecha_hora', axis=1, inplace=True)
+        df_E.rename(columns={
+                    "fecha_hora_formateada": "fecha_hora"
+                }, inplace=True)
+
+        writer.write(df_E)
+        catalog.update(build_catalog(df_E, length))
+        length += len(df_E)
+    writer.close()
+
+    return catalog, length
+
+
+
+
 def create_E_file(df_A, df_D, save_path):
     # Initical read
     current_app.logger.info(f"======================== READING: FILES A AND D")
 
-    a_initial_read = get_data_info(df_A)
-    d_initial_read = get_data_info(df_D)
+    a_initial_read = DataProfile(df_A)
+    d_initial_read = DataProfile(df_D)
 
     # Sinchronizing data
     current_app.logger.info(f"======================== SINCHRONIZING DATA: FILES A AND D")
 
-    d_before_info = get_data_info(df_D)
+    # El fichero D no ha cambiado desde el perfil inicial
+    d_before_info = d_initial_read
 
     d_before_length = len(df_D)
 
@@ -887,59 +702,41 @@ def create_E_file(df_A, df_D, save_path):
     current_app.logger.info(f"============ ALL")
     df_D = align_one_dfs_on_keys(df_A, df_D, ["cod_unidad", "cod_pda", "solo_fecha"])
 
-    d_after_info = get_data_info(df_D)
+    d_after_info = DataProfile(df_D)
 
     d_after_length = len(df_D)
 
     sinchronized = {
-        "d_before" : d_before_info,
+        "d_before" : d_before_info.to_dict(),
         "d_unit_code_reg_erased" : d_before_length - d_mid_unit_code_length,
         "d_pda_reg_erased" : d_mid_unit_code_length - d_mid_pda_length,
         "d_dates_reg_erased" : d_mid_pda_length - d_mid_dates_length,
         "d_sinchronized_reg_erased" : d_mid_dates_length - d_after_length,
         "d_total_reg_erased" : d_before_length - d_after_length,
-        "d_after" : d_after_info
+        "d_after" : d_after_info.to_dict(values=True)
     }
 
     # Merge data
     current_app.logger.info(f"======================== MERGING DATA: FILES A AND D")
 
-    # Ordenar por hora
-    df_A_sorted = df_A.sort_values(['solo_hora'])
-    df_D_sorted = df_D.sort_values(['solo_hora'])
-
-    # Convertir hora a datatime
-    df_A_sorted['solo_hora'] = pd.to_timedelta(df_A_sorted['solo_hora'].astype(str))
-    df_D_sorted['solo_hora'] = pd.to_timedelta(df_D_sorted['solo_hora'].astype(str))
-
     # Convertir codigo pda a string
-    df_A_sorted['cod_pda'] = df_A_sorted['cod_pda'].astype(str)
-    #df_C_sorted['cod_pda'] = df_C_sorted['cod_pda'].astype(str)
-
-    # Realizar la union
-    df_E = df_A_sorted.merge(df_D_sorted, how='outer')
-
-    # Ordenar por PDA, fecha y hora
-    df_E = df_E.sort_values(['cod_pda', 'solo_fecha', 'solo_hora'])
-
-    # Eliminar y renombrar columnas necesarias
-    df_E.drop('fecha_hora', axis=1, inplace=True)
-    df_E.rename(columns={
-                "fecha_hora_formateada": "fecha_hora"
-            }, inplace=True)
-
-    final_data = get_data_info(df_E)
-
+    df_A = df_A.assign(cod_pda=df_A['cod_pda'].astype(str))
 
+    # Realizar la union por oficinas, escribiendo E a medida que se une
     current_app.logger.info(f"======================== WRINTING: FILE E")
-    path = os.path.join(save_path, 'Fichero_E.csv')
-    df_E.to_csv(path, sep=';', index=False)
+    catalog, length = write_E_file(df_A, df_D, save_path)
+    save_catalog(catalog, save_path)
+    current_app.logger.info(f"Fichero E escrito con {length} registros")
+
+    final_data = DataProfile(
+        load_dataset(save_path, "E", columns=['cod_unidad', 'cod_pda', 'seccion', 'turno', 'solo_fecha'])
+    ).to_dict(values=True)
 
 
     # Save statistics in JSON
     process_info = {
-        "A_initial" : convert_numpy(a_initial_read),
-        "D_initial" : convert_numpy(d_initial_read),
+        "A_initial" : convert_numpy(a_initial_read.to_dict(values=True)),
+        "D_initial" : convert_numpy(d_initial_read.to_dict(values=True)),
         "sinchronized" : convert_numpy(sinchronized),
         "final" : convert_numpy(final_data)
     }
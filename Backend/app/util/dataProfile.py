@@ -0,0 +1,120 @@
+from app.util.fileSchema import format_dates
+import pandas as pd
+import numpy as np
+
+
+# Columns that identify a route of file B (and D): the "pdas" of the profile
+ROUTE_COLUMNS = ['cod_pda', 'seccion', 'turno', 'solo_fecha']
+
+
+
+
+def _factorize(series):
+    """
+        Distinct values of a column without sorting it
+        Args:
+            series : column to encode
+        Returns:
+            (codes, uniques, has_nulls). Nulls are encoded as -1 and are not in uniques
+    """
+    codes, uniques = pd.factorize(series)
+    return codes, uniques, bool((codes < 0).any())
+
+
+
+
+def _count_combinations(factorized):
+    """Number of distinct combinations of several factorized columns (nulls included)"""
+    combined = np.zeros(len(factorized[0][0]), dtype=np.int64)
+    for codes, uniques, _ in factorized:
+        # Nulls (-1) become one more value
+        combined = combined * (len(uniques) + 1) + (codes + 1)
+        # Renumber so the codes stay small when combining more columns
+        combined = pd.factorize(combined)[0]
+    return int(combined.max()) + 1 if len(combined) else 0
+
+
+
+
+class DataProfile:
+    """
+        Profile of a dataset: number of rows and of distinct unit codes, PDAs,
+        routes (pda, seccion, turno, fecha) and dates.
+
+        The counts are computed when the profile is created by encoding each
+        column once, without sorting the data. The sorted lists of values
+        are only built when requested (to_dict(values=True)), which is only
+        needed by the entries of statistics.json shown in the PDF.
+        Args:
+            df : dataset to profile. No reference to it is kept
+    """
+
+    def __init__(self, df):
+        self.length = len(df)
+        self._uniques = {}
+
+        columns = {}
+        for col in ['cod_unidad', 'cod_pda', 'seccion', 'turno', 'solo_fecha']:
+            if col in df.columns:
+                columns[col] = _factorize(df[col])
+                self._uniques[col] = columns[col][1:]
+
+        self.unit_codes_length = self._count('cod_unidad')
+        self.dates_length = self._count('solo_fecha')
+
+        if set(ROUTE_COLUMNS).issubset(columns):
+            # File B
+            self.pdas_length = _count_combinations([columns[col] for col in ROUTE_COLUMNS])
+            self.num_inv_length = self._count('cod_pda')
+        elif set(ROUTE_COLUMNS[1:]).issubset(columns):
+            # File C
+            self.pdas_length = _count_combinations([columns[col] for col in ROUTE_COLUMNS[1:]])
+            self.num_inv_length = 0
+        elif 'cod_pda' in columns:
+            # File A
+            self.pdas_length = self._count('cod_pda')
+            self.num_inv_length = self.pdas_length
+        else:
+            # No file
+            self.pdas_length = 0
+            self.num_inv_length = 0
+
+    def _count(self, col):
+        if col not in self._uniques:
+            return 0
+        uniques, has_nulls = self._uniques[col]
+        return len(uniques) + has_nulls
+
+    def values(self, col):
+        """Sorted distinct values of a column, with nulls (None) at the end"""
+        if col not in self._uniques:
+            return []
+        uniques, has_nulls = self._uniques[col]
+        values = pd.Series(uniques).sort_values().tolist()
+        if has_nulls:
+            values.append(None)
+        return values
+
+    def to_dict(self, values=False):
+        """
+            Profile as a JSON serializable dict, with the keys of the statistics
+            Args:
+                values : also include the sorted lists of unit codes, PDAs and dates
+            Returns:
+                dict with the counts (and the values)
+        """
+        info = {
+            "length" : self.length,
+            "unit_codes_length" : self.unit_codes_length,
+            "pdas_length" : self.pdas_length,
+            "num_inv_length" : self.num_inv_length,
+            "dates_length" : self.dates_length
+        }
+        if values:
+            info["unit_codes"] = self.values('cod_unidad')
+            info["num_inv"] = self.values('cod_pda') if self.num_inv_length else []
+            info["dates"] = format_dates(self.values('solo_fecha')).tolist()
+        return info
+
+    def __repr__(self):
+        return f"DataProfile({self.to_dict()})"
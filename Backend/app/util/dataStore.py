@@ -0,0 +1,206 @@
+from app.util.fileSchema import apply_schema_dtypes, format_date_columns
+import pyarrow as pa
+import pyarrow.parquet as pq
+import json
+import os
+
+
+# Rows per row group: the unit skipped by predicate pushdown when reading
+ROW_GROUP_SIZE = 100_000
+
+
+
+
+def dataset_path(folder, file_type):
+    """Path of the Parquet file with the dataset of the given type"""
+    return os.path.join(folder, f"Fichero_{file_type}.parquet")
+
+
+
+
+def dataset_exists(folder, file_type):
+    return os.path.exists(dataset_path(folder, file_type))
+
+
+
+
+def _writer_schema(df):
+    """
+        Arrow schema used to store df. Categorical columns are always stored
+        with int32 indices so chunks with different categories share the schema.
+    """
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    fields = [
+        pa.field(field.name, pa.dictionary(pa.int32(), field.type.value_type))
+        if pa.types.is_dictionary(field.type) else field
+        for field in schema
+    ]
+    return pa.schema(fields, metadata=schema.metadata)
+
+
+
+
+def save_dataset(df, folder, file_type):
+    """
+        Stores a dataset of the session as Parquet
+        Args:
+            df : dataframe to store
+            folder : session folder
+            file_type : type of the dataset (A, B, C, D or E)
+        Returns:
+            Path of the Parquet file
+    """
+    path = dataset_path(folder, file_type)
+    tmp_path = path + ".tmp"
+    table = pa.Table.from_pandas(df, schema=_writer_schema(df), preserve_index=False)
+    pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp_path, path)
+    return path
+
+
+
+
+class DatasetWriter:
+    """
+        Writes a dataset of the session to Parquet incrementally, one dataframe
+        at a time, so it never has to be fully held in memory.
+    """
+
+    def __init__(self, folder, file_type):
+        self.path = dataset_path(folder, file_type)
+        self.tmp_path = self.path + ".tmp"
+        self.writer = None
+        self.empty = None
+
+    def _open(self, df):
+        self.schema = _writer_schema(df)
+        self.writer = pq.ParquetWriter(self.tmp_path, self.schema)
+
+    def write(self, df):
+        # The schema is taken from the first dataframe with rows: an empty one
+        # (e.g. a chunk with only duplicated or invalid rows) may have columns
+        # without a type. It is only written if no dataframe has rows.
+        if len(df) == 0:
+            if self.empty is None:
+                self.empty = df
+            return
+        if self.writer is None:
+            self._open(df)
+        table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        self.writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+
+    def close(self):
+        if self.writer is None:
+            if self.empty is None:
+                return None
+            self._open(self.empty)
+            self.writer.write_table(pa.Table.from_pandas(self.empty, schema=self.schema, preserve_index=False))
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+        return self.path
+
+
+
+
+def load_dataset(folder, file_type, columns=None, filters=None):
+    """
+        Reads a dataset of the session with a memory mapped Parquet read
+        Args:
+            folder : session folder
+            file_type : type of the dataset (A, B, C, D or E)
+            columns : columns to read (all by default)
+            filters : predicates pushed down to the Parquet reader, e.g.
+                      [("cod_unidad", "=", 2801234), ("cod_pda", "in", ["PDA01"])]
+        Returns:
+            Dataframe with the dtypes of the file schema
+    """
+    table = pq.read_table(
+        dataset_path(folder, file_type),
+        columns=columns,
+        filters=filters,
+        memory_map=True
+    )
+    return apply_schema_dtypes(table.to_pandas(), file_type)
+
+
+
+
+def add_dataset_columns(folder, file_type, columns):
+    """
+        Adds (or replaces) columns of a stored dataset, keeping the rest of
+        the file as it is
+        Args:
+            folder : session folder
+            file_type : type of the dataset (A, B, C, D or E)
+            columns : dict {column name: array with one value per row}
+        Returns:
+            Path of the Parquet file
+    """
+    path = dataset_path(folder, file_type)
+    tmp_path = path + ".tmp"
+    table = pq.read_table(path, memory_map=True)
+    for name, values in columns.items():
+        if name in table.column_names:
+            table = table.drop_columns([name])
+        table = table.append_column(name, pa.array(values, from_pandas=True))
+    pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp_path, path)
+    return path
+
+
+
+
+def export_csv(folder, file_type):
+    """
+        Writes the CSV version of a dataset (only when it is requested),
+        converting the Parquet file one row group at a time. Dates and
+        times are written as text (YYYY-MM-DD and HH:MM:SS).
+        Returns:
+            Path of the CSV file
+    """
+    path = dataset_path(folder, file_type)
+    csv_path = path.replace(".parquet", ".csv")
+
+    # Reuse the CSV if it is up to date
+    if os.path.exists(csv_path) and os.path.getmtime(csv_path) >= os.path.getmtime(path):
+        return csv_path
+
+    tmp_path = csv_path + ".tmp"
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    for i in range(parquet_file.num_row_groups):
+        df = format_date_columns(parquet_file.read_row_group(i).to_pandas())
+        df.to_csv(tmp_path, sep=';', index=False, mode='w' if i == 0 else 'a', header=(i == 0))
+    if parquet_file.num_row_groups == 0:
+        parquet_file.schema_arrow.empty_table().to_pandas().to_csv(tmp_path, sep=';', index=False)
+    os.replace(tmp_path, csv_path)
+
+    return csv_path
+
+
+
+
+def catalog_path(folder):
+    """Path of the catalog (offices -> PDAs -> dates) of the unified dataset"""
+    return os.path.join(folder, "Fichero_E_catalogo.json")
+
+
+
+
+def save_catalog(catalog, folder):
+    path = catalog_path(folder)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(catalog, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+
+
+def load_catalog(folder):
+    """Catalog of the unified dataset, or None if it has not been built"""
+    path = catalog_path(folder)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
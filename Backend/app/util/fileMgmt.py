@@ -1,4 +1,6 @@
 from flask import current_app, request, jsonify
+from app.util.fileSchema import FILE_SCHEMAS, read_typed_csv, apply_schema_dtypes, get_used_columns, split_date_time
+from app.util.dataStore import save_dataset, load_dataset, DatasetWriter
 import pandas as pd
 import numpy as np
 import os, datetime, json
@@ -31,175 +33,9 @@ def ensure_folder(name):
 
 
 
-def rename_file_columns(df, file_type):
-    if (file_type == "A"):
-        df.rename(columns={
-                "cod_inv_pda": "cod_pda",
-                "fec_lectura_medicion": "fecha_hora",
-                "longitud_wgs84_gd": "longitud",
-                "latitud_wgs84_gd": "latitud",
-                "codired": "cod_unidad"
-            }, inplace=True)
-    elif (file_type == "B"):
-        df.rename(columns={
-                "Num Inv": "cod_pda",
-                "Cod Unidad": "cod_unidad",
-                "Cod Actividad": "cod_actividad",
-                "Seccion": "seccion",
-                "Turno": "turno",
-                "Fec Actividad": "fecha_hora",
-                "Seg Transcurrido": "seg_transcurridos",
-            }, inplace=True)
-    elif (file_type == "C"):
-        df.rename(columns={
-                "COD_NODOEMI": "cod_unidad",
-                "COD_SECCION": "seccion",
-                "IND_TURNO": "turno",
-                "INSTANTE_EVENTO": "fecha_hora",
-                "NUM_GEO_LONGITUD": "longitud",
-                "NUM_GEO_LATITUD": "latitud"
-            }, inplace=True)
-    
-    current_app.logger.info(f"Archivo {file_type} renombrado con éxito")
-    return df
-
-
-
-
-def format_date(path, file_type):
-    try:
-        df = pd.read_csv(path, delimiter=';', low_memory=False)
-    except Exception:
-        return
-    
-    if file_type == "A":
-        date_format = '%Y-%m-%d %H:%M:%S.%f %z'
-        df['fecha_hora'] = pd.to_datetime(df['fecha_hora'], format=date_format, utc=True, errors='coerce')
-    elif file_type == "B":
-        date_format1 = '%d/%m/%Y %H:%M'
-        date_format2 = '%d-%m-%y %H:%M:%S'
-        date1 = pd.to_datetime(df['fecha_hora'], format=date_format1, errors='coerce')
-        date2 = pd.to_datetime(df['fecha_hora'], format=date_format2, errors='coerce')
-        df['fecha_hora'] = date1.fillna(date2)
-
-    elif file_type == "C":
-        date_format = '%Y-%m-%d %H:%M:%S.%f %z'
-        df['fecha_hora'] = pd.to_datetime(df['fecha_hora'], format=date_format, utc=True, errors='coerce')
-    else:
-        df['fecha_hora'] = pd.to_datetime(df['fecha_hora'], errors='coerce')
-    
-    current_app.logger.info(f"El tipo de dato de la columna es {df['fecha_hora'].dtype}")
-
-    if not pd.api.types.is_datetime64_any_dtype(df['fecha_hora']):
-        df['fecha_hora'] = pd.to_datetime(df['fecha_hora'], errors='coerce')
-
-    if df['fecha_hora'].dt.tz is not None:
-        df['fecha_hora'] = df['fecha_hora'].dt.tz_convert('Europe/Paris')
-    else:
-        df['fecha_hora'] = df['fecha_hora'].dt.tz_localize('Europe/Paris')
-    
-
-    df['formatted_fecha_hora'] = df['fecha_hora'].dt.strftime('%Y/%m/%d_%H:%M:%S')
-    df['formatted_fecha_hora'] = pd.to_datetime(df['formatted_fecha_hora'], format='%Y/%m/%d_%H:%M:%S', errors='coerce')
-    df['solo_fecha'] = df['formatted_fecha_hora'].dt.date
-    df['solo_hora'] = df['formatted_fecha_hora'].dt.time
-
-    df.to_csv(path, sep=';', index=False)
-    current_app.logger.info(f"Se han convertido las fechas del archivo {file_type} correctamente.")
-
-
-
-
-def get_statistics_A(path):
-    try:
-        df = pd.read_csv(path, delimiter=';', low_memory=False)
-    except Exception:
-        return jsonify({'info': 'No se pudo leer el fichero.'})
-
-    df_length = len(df)
-    df['esParada'] = False
-    df.to_csv(path, sep=';', index=False)
-    info = f'Nº elementos iniciales: {df_length}.\n'
-
-    df = df.drop_duplicates(ignore_index=True)
-    duplicates_count = df_length - len(df)
-    info += f'Nº elementos duplicados: {duplicates_count}.\n'
-    info += f'Nº elementos finales: {len(df)}.\n'
-
-    final_response = {
-        'info': info
-    }
-    return jsonify(final_response)
-
-
-
-
-def extractDataframes(pathA, pathB, pathC, cod):
-    current_app.logger.info("+++++++++++++++ ABRIENDO FICHEROS +++++++++++++++++++")
-    try:
-        df_A = pd.read_csv(pathA, delimiter=';', low_memory=False)
-        df_B = pd.read_csv(pathB, delimiter=';', low_memory=False)
-        df_C = pd.read_csv(pathC, delimiter=';', low_memory=False)
-    except Exception:
-        df_A = pd.DataFrame()
-        df_B = pd.DataFrame()
-        df_C = pd.DataFrame()
-        current_app.logger.error(f"Error al leer archivo CSV")
-        return df_A, df_B, df_C, jsonify({'error' : 'Not able to ope files'})
-    
-    current_app.logger.info("+++++++++++++++ FILTRANDO CODIGO DE UNIDAD +++++++++++++++++++")
-    df_A = df_A[df_A['codired'] == int(cod)]
-    df_B = df_B[df_B['codired'] == int(cod)]
-    df_C = df_C[df_C['codired'] == int(cod)]
-    df_A_length = len(df_A)
-    df_B_length = len(df_B)
-    df_C_length = len(df_C)
-    total_length = df_A_length + df_B_length + df_C_length
-    read_info = {
-        "Registros_totales": total_length,
-        "Registros_A": df_A_length,
-        "Registros_B": df_B_length,
-        "Registros_C": df_C_length
-    }
-
-    return df_A, df_B, df_C, jsonify(read_info)
-
-
-
-
-def extractBCDataframes(pathB, pathC):
-    current_app.logger.info("+++++++++++++++ ABRIENDO FICHEROS +++++++++++++++++++")
-    try:
-        df_B = pd.read_csv(pathB, delimiter=';', low_memory=False)
-        df_C = pd.read_csv(pathC, delimiter=';', low_memory=False)
-    except Exception:
-        df_B = pd.DataFrame()
-        df_C = pd.DataFrame()
-        current_app.logger.error(f"Error al leer archivo CSV")
-        return df_B, df_C, jsonify({'error' : 'Not able to ope files'})
-    
-    current_app.logger.info("+++++++++++++++ FILTRANDO CODIGO DE UNIDAD +++++++++++++++++++")
-    df_B_length = len(df_B)
-    df_C_length = len(df_C)
-    total_length =  + df_B_length + df_C_length
-    read_info = {
-        "Registros_totales": total_length,
-        "Registros_B": df_B_length,
-        "Registros_C": df_C_length
-    }
-
-    return df_B, df_C, jsonify(read_info)
-
-
-
-
 def delete_columns(df, file_type):
-    if (file_type == "A"):
-        used_columns = ["cod_pda", "fecha_hora", "longitud", "latitud", "cod_unidad"]
-    elif (file_type == "B"):
-        used_columns = ["cod_pda", "fecha_hora", "cod_unidad", "cod_actividad", "seccion", "turno", "seg_transcurridos"]
-    elif (file_type == "C"):
-        used_columns = ["cod_unidad", "seccion", "turno", "fecha_hora", "longitud", "latitud"]
+    if file_type in FILE_SCHEMAS:
+        used_columns = get_used_columns(file_type)
     else:
         used_columns = []
 
@@ -235,53 +71,58 @@ def format_date_new(df, file_type):
 
 
 def separate_date(df):
-    df['solo_fecha'] = df['fecha_hora_formateada'].dt.date
-    df['solo_hora'] = df['fecha_hora_formateada'].dt.time
-    return df
+    """
+        Adds solo_fecha (days since 1970-01-01) and solo_hora (seconds since
+        midnight) as int32 columns. Rows whose date could not be parsed are dropped
+    """
+    df = df.dropna(subset=['fecha_hora_formateada'])
+    days, seconds = split_date_time(df['fecha_hora_formateada'])
+    return df.assign(solo_fecha=days, solo_hora=seconds)
 
 
 
 
-def preprocess_data(save_path, file_type):
-    # Read file
+def delete_invalid_values(df, file_type):
+    """Deletes the rows with invalid values and casts the columns to the schema dtypes"""
+    # Invalid values are read as NaN (see INVALID_VALUES)
+    df = df.dropna()
+
+    # Numeric columns are still text in the uploaded files
+    for name, dtype in FILE_SCHEMAS[file_type]["dtypes"].items():
+        if dtype != "category" and name in df.columns:
+            df[name] = pd.to_numeric(df[name].astype(str).str.replace(',', '.'), errors='coerce')
+    df = df.dropna(subset=["cod_unidad"])
+
+    if "longitud" in df.columns:
+        df = df[(df["longitud"] != 0.0) & (df["latitud"] != 0.0)]
+
+    return apply_schema_dtypes(df, file_type)
+
+
+
+
+def preprocess_data(save_path, file_type, chunk_size=None):
+    # Large files are processed in chunks to keep memory bounded
+    if chunk_size:
+        return preprocess_data_chunked(save_path, file_type, chunk_size)
+
+    # Read file (only the used columns, already renamed)
     try:
-        df = pd.read_csv(save_path, delimiter=';', low_memory=False)
+        df = read_typed_csv(save_path, file_type)
     except Exception:
         return
     
-    # Rename columns
-    df_rename = rename_file_columns(df, file_type)
-    initial_length = len(df_rename)
+    initial_length = len(df)
     info = f"Número elementos iniciales: {initial_length}.\n"
 
-    # Delete unused columns
-    df_limited = delete_columns(df_rename, file_type)
-
     # Delete duplicates
-    df_wout_dup = df_limited.drop_duplicates()
+    df_wout_dup = df.drop_duplicates()
     wout_dup_length = len(df_wout_dup)
     duplicates = initial_length - wout_dup_length
     info += f"Número elementos duplicados: {duplicates}.\n"
 
     # Delete invalid values
-    invalid_values = [
-        "#N/A", "#N/D", "#N/A N/A", "#NA", "-N/A",
-        "#NULL!", "#DIV/0!", "#NUM!", "#NAME?", "#VALUE!",
-        "NULL", "null", "Nil", "nil", "",
-        "nan", "NaN", "NAN", "<NA>",
-        "#n/a", "N/A", "n/a", "NA", "na", "NULL", "-",
-        "?", "*", " ", ".."
-    ]
-    df_clean = df_wout_dup.replace(invalid_values, np.nan)
-    df_clean = df_clean.dropna()
-    if "longitud" in df.columns:
-        df_clean["longitud"] = pd.to_numeric(df_clean["longitud"].astype(str).str.replace(',', '.'), errors='coerce')
-        df_clean["latitud"] = pd.to_numeric(df_clean["latitud"].astype(str).str.replace(',', '.'), errors='coerce')
-
-        df_clean = df_clean[df_clean["longitud"] != 0.0]
-        df_clean = df_clean[df_clean["latitud"] != 0.0]
-    invalid = wout_dup_length - len(df_clean)
-    info += f"Número elementos inválidos: {invalid}.\n"
+    df_clean = delete_invalid_values(df_wout_dup, file_type)
 
     # Add "es_parada" column
     df_stop = df_clean.copy()
@@ -290,18 +131,113 @@ def preprocess_data(save_path, file_type):
     # Format date
     df_formatted = format_date_new(df_stop, file_type)
 
-    # Separate date and time
+    # Separate date and time (rows without a valid date are invalid too)
     df_final = separate_date(df_formatted)
+    invalid = wout_dup_length - len(df_final)
+    info += f"Número elementos inválidos: {invalid}.\n"
     final_length = len(df_final)
     info += f"Número elementos finales: {final_length}.\n"
 
-    # Save as pickle and csv
-    df_final.to_csv(save_path, sep=';', index=False)
+    # Save as parquet (the uploaded csv is no longer needed)
+    save_dataset(df_final, os.path.dirname(save_path), file_type)
+    os.remove(save_path)
 
-    pkl_path = save_path.replace(".csv", ".pkl")
-    df_final.to_pickle(pkl_path)
+    # Save statistics in JSON
+    save_preprocess_statistics(save_path, file_type, initial_length, duplicates, invalid, final_length)
+
+    # Return statistics
+    final_response = {
+        "info": info
+    }
+
+    return jsonify(final_response)
+
+
+
+
+def preprocess_data_chunked(save_path, file_type, chunk_size):
+    """
+        Same steps as preprocess_data, but reading the file in chunks of
+        chunk_size rows and appending them to the parquet file, so neither
+        the raw CSV nor the result are ever fully held in memory.
+        Duplicates across chunks are detected with a sorted array of the
+        hashes of the rows already kept (8 bytes per row).
+        Args:
+            save_path : path of the uploaded CSV (it is overwritten)
+            file_type : type of the file (A, B or C)
+            chunk_size : number of rows read per chunk
+        Returns:
+            JSON with the preprocess information
+    """
+    # Read file (only the used columns, already renamed)
+    try:
+        reader = read_typed_csv(save_path, file_type, chunksize=chunk_size)
+    except Exception:
+        return
+
+    writer = DatasetWriter(os.path.dirname(save_path), file_type)
+    seen_rows = np.zeros(0, dtype=np.uint64)
+    initial_length = 0
+    duplicates = 0
+    invalid = 0
+    final_length = 0
+
+    current_app.logger.info(f"Preprocesando fichero {file_type} en bloques de {chunk_size} registros")
+    for chunk in reader:
+        initial_length += len(chunk)
+
+        # Delete duplicates (inside the chunk and against previous chunks)
+        hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+        is_new = ~pd.Series(hashes).duplicated().to_numpy()
+        if len(seen_rows) > 0:
+            pos = np.minimum(np.searchsorted(seen_rows, hashes), len(seen_rows) - 1)
+            is_new &= seen_rows[pos] != hashes
+        # Both arrays are sorted, so the stable sort (timsort) only merges them
+        seen_rows = np.sort(np.concatenate([seen_rows, np.sort(hashes[is_new])]), kind='stable')
+        chunk = chunk[is_new]
+        wout_dup_length = len(chunk)
+        duplicates += len(is_new) - wout_dup_length
+
+        # Delete invalid values
+        chunk = delete_invalid_values(chunk, file_type)
+
+        # Add "es_parada" column
+        chunk = chunk.copy()
+        chunk["es_parada"] = (file_type != "A")
+
+        # Format date and separate date and time (rows without a valid date are invalid too)
+        chunk = separate_date(format_date_new(chunk, file_type))
+        invalid += wout_dup_length - len(chunk)
+
+        # Append to the parquet file
+        writer.write(chunk)
+        final_length += len(chunk)
+
+    if writer.close() is None:
+        return
+
+    # The uploaded csv is no longer needed
+    os.remove(save_path)
+
+    info = f"Número elementos iniciales: {initial_length}.\n"
+    info += f"Número elementos duplicados: {duplicates}.\n"
+    info += f"Número elementos inválidos: {invalid}.\n"
+    info += f"Número elementos finales: {final_length}.\n"
 
     # Save statistics in JSON
+    save_preprocess_statistics(save_path, file_type, initial_length, duplicates, invalid, final_length)
+
+    # Return statistics
+    final_response = {
+        "info": info
+    }
+
+    return jsonify(final_response)
+
+
+
+
+def save_preprocess_statistics(save_path, file_type, initial_length, duplicates, invalid, final_length):
     info_dic = {
         "initial" : initial_length,
         "duplicates" : duplicates,
@@ -328,17 +264,10 @@ def preprocess_data(save_path, file_type):
     with open(json_path, "w", encoding="utf-8") as f:
         json.dump(existing_data, f, ensure_ascii=False, indent=4)
 
-    # Return statistics
-    final_response = {
-        "info": info
-    }
-
-    return jsonify(final_response)
-
 
 
 
-def getDataframes(path_b, path_c):
-    df_B = pd.read_pickle(path_b)
-    df_C = pd.read_pickle(path_c)
-    return df_B, df_C
\ No newline at end of file
+def getDataframes(folder, type_1, type_2):
+    df_1 = load_dataset(folder, type_1)
+    df_2 = load_dataset(folder, type_2)
+    return df_1, df_2
\ No newline at end of file
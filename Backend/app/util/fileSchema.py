@@ -0,0 +1,233 @@
+from shared.date_format import format_dates, format_times
+import pandas as pd
+import numpy as np
+
+
+# Values treated as missing when reading any file
+INVALID_VALUES = [
+    "#N/A", "#N/D", "#N/A N/A", "#NA", "-N/A",
+    "#NULL!", "#DIV/0!", "#NUM!", "#NAME?", "#VALUE!",
+    "NULL", "null", "Nil", "nil", "",
+    "nan", "NaN", "NAN", "<NA>",
+    "#n/a", "N/A", "n/a", "NA", "na", "NULL", "-",
+    "?", "*", " ", ".."
+]
+
+# Uploaded files (A, B and C) still have to be cleaned, so only their
+# categorical columns are typed when read. The rest are read as text and
+# converted with apply_schema_dtypes once the invalid values are removed.
+RAW_FILE_TYPES = ("A", "B", "C")
+
+# solo_fecha and solo_hora are stored as integers from the preprocess on:
+# days since 1970-01-01 and seconds since midnight (local time). They are
+# only converted to text when a dataset is exported (see format_date_columns)
+SECONDS_PER_DAY = 86_400
+
+# Schema of every file handled by the backend:
+#   columns : column name in the file -> internal column name (only these are read)
+#   dtypes  : internal column name -> target dtype
+FILE_SCHEMAS = {
+    "A": {
+        "columns": {
+            "cod_inv_pda": "cod_pda",
+            "fec_lectura_medicion": "fecha_hora",
+            "longitud_wgs84_gd": "longitud",
+            "latitud_wgs84_gd": "latitud",
+            "codired": "cod_unidad"
+        },
+        "dtypes": {
+            "cod_pda": "category",
+            "cod_unidad": "int32",
+            "longitud": "float32",
+            "latitud": "float32"
+        }
+    },
+    "B": {
+        "columns": {
+            "Num Inv": "cod_pda",
+            "Fec Actividad": "fecha_hora",
+            "Cod Unidad": "cod_unidad",
+            "Cod Actividad": "cod_actividad",
+            "Seccion": "seccion",
+            "Turno": "turno",
+            "Seg Transcurrido": "seg_transcurridos"
+        },
+        "dtypes": {
+            "cod_pda": "category",
+            "cod_unidad": "int32",
+            "cod_actividad": "category",
+            "seccion": "category",
+            "turno": "category",
+            "seg_transcurridos": "float32"
+        }
+    },
+    "C": {
+        "columns": {
+            "COD_NODOEMI": "cod_unidad",
+            "COD_SECCION": "seccion",
+            "IND_TURNO": "turno",
+            "INSTANTE_EVENTO": "fecha_hora",
+            "NUM_GEO_LONGITUD": "longitud",
+            "NUM_GEO_LATITUD": "latitud"
+        },
+        "dtypes": {
+            "cod_unidad": "int32",
+            "seccion": "category",
+            "turno": "category",
+            "longitud": "float32",
+            "latitud": "float32"
+        }
+    },
+    "D": {
+        "columns": {
+            "cod_pda": "cod_pda",
+            "fecha_hora": "fecha_hora",
+            "cod_unidad": "cod_unidad",
+            "cod_actividad": "cod_actividad",
+            "seccion": "seccion",
+            "turno": "turno",
+            "seg_transcurridos": "seg_transcurridos",
+            "es_parada": "es_parada",
+            "fecha_hora_formateada": "fecha_hora_formateada",
+            "solo_fecha": "solo_fecha",
+            "solo_hora": "solo_hora",
+            "longitud": "longitud",
+            "latitud": "latitud",
+            "dif_temp_entre_datos": "dif_temp_entre_datos"
+        },
+        "dtypes": {
+            "cod_pda": "category",
+            "cod_unidad": "int32",
+            "cod_actividad": "category",
+            "seccion": "category",
+            "turno": "category",
+            "seg_transcurridos": "float32",
+            "es_parada": "bool",
+            "longitud": "float32",
+            "latitud": "float32",
+            "solo_fecha": "int32",
+            "solo_hora": "int32",
+            "dif_temp_entre_datos": "float32"
+        }
+    },
+    "E": {
+        "columns": {
+            "cod_pda": "cod_pda",
+            "longitud": "longitud",
+            "latitud": "latitud",
+            "cod_unidad": "cod_unidad",
+            "es_parada": "es_parada",
+            "fecha_hora": "fecha_hora",
+            "solo_fecha": "solo_fecha",
+            "solo_hora": "solo_hora",
+            "cod_actividad": "cod_actividad",
+            "seccion": "seccion",
+            "turno": "turno",
+            "seg_transcurridos": "seg_transcurridos",
+            "dif_temp_entre_datos": "dif_temp_entre_datos"
+        },
+        "dtypes": {
+            "cod_pda": "category",
+            "longitud": "float32",
+            "latitud": "float32",
+            "cod_unidad": "int32",
+            "es_parada": "bool",
+            "cod_actividad": "category",
+            "seccion": "category",
+            "turno": "category",
+            "seg_transcurridos": "float32",
+            "solo_fecha": "int32",
+            "solo_hora": "int32",
+            "dif_temp_entre_datos": "float32"
+        }
+    }
+}
+
+
+
+
+def get_used_columns(file_type):
+    """Internal names of the columns kept for the given file type"""
+    return list(FILE_SCHEMAS[file_type]["columns"].values())
+
+
+
+
+def read_typed_csv(path, file_type, columns=None, chunksize=None):
+    """
+        Reads a CSV file using the schema of its type. Only the columns of the
+        schema are parsed, already renamed and typed.
+        Args:
+            path : path of the CSV file
+            file_type : type of the file (A, B, C, D or E)
+            columns : internal names of the columns to read (all by default)
+            chunksize : if given, returns an iterator of dataframes
+        Returns:
+            Dataframe (or iterator of dataframes) with the internal column names
+    """
+    schema = FILE_SCHEMAS[file_type]
+    names = {
+        file_col: name for file_col, name in schema["columns"].items()
+        if columns is None or name in columns
+    }
+
+    dtypes = {}
+    for file_col, name in names.items():
+        dtype = schema["dtypes"].get(name, "str")
+        if file_type in RAW_FILE_TYPES and dtype != "category":
+            dtype = "str"
+        dtypes[file_col] = dtype
+
+    df = pd.read_csv(
+        path,
+        delimiter=';',
+        usecols=list(names),
+        dtype=dtypes,
+        na_values=INVALID_VALUES,
+        chunksize=chunksize
+    )
+
+    if chunksize:
+        return (chunk.rename(columns=names) for chunk in df)
+
+    return df.rename(columns=names)
+
+
+
+
+def apply_schema_dtypes(df, file_type):
+    """Casts the columns of df present in the schema to their target dtype"""
+    dtypes = {
+        name: dtype for name, dtype in FILE_SCHEMAS[file_type]["dtypes"].items()
+        if name in df.columns
+    }
+    return df.astype(dtypes)
+
+
+
+
+def split_date_time(values):
+    """
+        Day number and seconds since midnight of each datetime, in local time
+        Args:
+            values : datetime column (with or without time zone) without NaT
+        Returns:
+            (days since 1970-01-01, seconds since midnight) as int32 arrays
+    """
+    if values.dt.tz is not None:
+        values = values.dt.tz_localize(None)
+    seconds = values.to_numpy(dtype="datetime64[s]").astype(np.int64)
+    days = seconds // SECONDS_PER_DAY
+    return days.astype(np.int32), (seconds - days * SECONDS_PER_DAY).astype(np.int32)
+
+
+
+
+def format_date_columns(df):
+    """Copy of df with solo_fecha and solo_hora as text, as they are written to CSV files"""
+    columns = {}
+    if "solo_fecha" in df.columns and pd.api.types.is_integer_dtype(df["solo_fecha"]):
+        columns["solo_fecha"] = format_dates(df["solo_fecha"])
+    if "solo_hora" in df.columns and pd.api.types.is_integer_dtype(df["solo_hora"]):
+        columns["solo_hora"] = format_times(df["solo_hora"])
+    return df.assign(**columns)
@@ -6,6 +6,18 @@ class Config:
     UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
     STATIC_FOLDER = os.path.join(os.path.dirname(__file__), 'app', 'static')
     ALLOWED_EXTENSIONS = {'csv'}
+    # Rows read per chunk when preprocessing uploads (None reads the whole file)
+    PREPROCESS_CHUNK_SIZE = 500_000
+    # GeoJSON files of the offices ({cod_unidad}.geojson), shared with the frontend
+    GEOJSON_FOLDER = os.environ.get('GEOJSON_FOLDER', os.path.join(os.path.dirname(__file__), '..', 'Frontend', 'app', 'static', 'geojson'))
+    # Worker processes used to assign portals (None uses one per CPU)
+    PORTAL_WORKERS = int(os.environ['PORTAL_WORKERS']) if os.environ.get('PORTAL_WORKERS') else None
+    # Worker processes used to join files B and C by date (None uses one per CPU)
+    MERGE_WORKERS = int(os.environ['MERGE_WORKERS']) if os.environ.get('MERGE_WORKERS') else None
+    # Outlier removal passes per route (1 is a single pass, more iterate until no outliers are left)
+    OUTLIER_MAX_ITERATIONS = int(os.environ.get('OUTLIER_MAX_ITERATIONS', 1))
+    # Worker processes used to remove outliers (None uses one per CPU)
+    OUTLIER_WORKERS = int(os.environ['OUTLIER_WORKERS']) if os.environ.get('OUTLIER_WORKERS') else None
 
 class DevConfig(Config):
     DEBUG = True
@@ -1,3 +1,8 @@
+import os, sys
+
+# Modules shared with the backend (shared/ at the root of the repository)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
 from flask import Flask
 from flask_apscheduler import APScheduler
 from .controllers.main import main_bp
@@ -164,8 +164,8 @@ def agrupar_puntos_duplicados(resultados):
             # Si hay un punto anterior, actualizar su tiempo con el acumulado
             if punto_anterior is not None and resultados_agrupados:
                 if tiempo_acumulado > 0:
-                    resultados_agrupados[-1]["tiempo"] = f"{int(tiempo_acumulado)} sec"
-                    resultados_agrupados[-1]["velocidad"] = f"{round(velocidad_acumulada / indice,2)} km/h"
+                    resultados_agrupados[-1]["tiempo"] = int(tiempo_acumulado)
+                    resultados_agrupados[-1]["velocidad"] = velocidad_acumulada / indice
             
             # Añadir el punto actual como nuevo punto
             nuevo_punto = r.copy()
@@ -177,18 +177,13 @@ def agrupar_puntos_duplicados(resultados):
             indice += 1
         else:
             # Mismo punto que el anterior, acumular tiempo
-            if r["tiempo"] != "-":
-                try:
-                    tiempo_sec = float(r["tiempo"].replace(" sec", ""))
-                    tiempo_acumulado += tiempo_sec
-                    velocidad_km_h = float(r["velocidad"].replace(" km/h",""))
-                    velocidad_acumulada += velocidad_km_h
-                except ValueError:
-                    pass
+            if r["tiempo"] is not None:
+                tiempo_acumulado += r["tiempo"]
+                velocidad_acumulada += r["velocidad"] or 0
 
     # No olvidar el último grupo
     if resultados_agrupados and tiempo_acumulado > 0:
-        resultados_agrupados[-1]["tiempo"] = f"{int(tiempo_acumulado)} sec"
+        resultados_agrupados[-1]["tiempo"] = int(tiempo_acumulado)
 
     return resultados_agrupados
 
@@ -211,12 +206,10 @@ def agrupar_portales_duplicados(tabla):
     # Crear dataframe
     df = pd.DataFrame(tabla)
 
-    # Limpiar datos
-    df.loc[df['tiempo'] == "-", 'tiempo'] = "0 sec"
-    df['tiempo_seg'] = df['tiempo'].str.replace(" sec", "", regex=False).astype(float)
+    # Limpiar datos (el primer punto de cada ruta no tiene tiempo ni distancia)
+    df['tiempo_seg'] = pd.to_numeric(df['tiempo']).fillna(0).astype(float)
     df['tiempo_signed'] = df['tiempo_seg'].where(~df['es_parada'], -df['tiempo_seg'])
-    df.loc[df['distancia'] == "-", 'distancia'] = "0 m"
-    df['distancia'] = df['distancia'].str.replace(" m", "", regex=False).astype(float)
+    df['distancia'] = pd.to_numeric(df['distancia']).fillna(0).astype(float)
 
     # Agrupar puntos
     df_agrupado = df.groupby(['street', 'number']).agg(
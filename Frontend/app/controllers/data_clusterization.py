@@ -1,6 +1,8 @@
 from flask import Blueprint, request, current_app, session, jsonify
 from .map_generation import create_cluster_map
 from .data_generation import calcular_resumen
+from .geo_analysis import get_portal_index
+from .util import parse_coords
 from pathlib import Path
 import os,json, requests
 import pandas as pd
@@ -111,6 +113,82 @@ def agrupar_por_tipo():
 
 
 
+@data_clusterization_bp.route('/portales_candidatos', methods=['POST'])
+def portales_candidatos():
+    """
+    Endpoint que lista, para cada parada agrupada (table_data_filtered.json), los portales candidatos:
+    los que estan a menos de 'radio' metros o, si no se indica radio, los 'k' mas cercanos (5 por defecto)
+    JSON: {"paradas": [{"latitud_portal", "longitud_portal", "street", "number", "candidatos": [...]}]}
+    """
+    data = request.get_json() or {}
+    cod = data.get('cod')
+    radio = data.get('radio')
+    k = data.get('k', 5)
+
+    file_path = Path(os.path.join(current_app.config['UPLOAD_FOLDER'], session['id'], 'table_data_filtered.json'))
+    if not file_path.exists():
+        current_app.logger.error(f"No hay paradas agrupadas en: {file_path}")
+        return jsonify({"paradas": [], "warnings": ["No hay paradas agrupadas."]})
+
+    file_geojson = os.path.join(current_app.config.get("GEOJSON_FOLDER"), f'{cod}.geojson')
+    index = get_portal_index(file_geojson, cod)
+    if index is None:
+        return jsonify({"error": f"No hay portales para la oficina {cod}"}), 404
+
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            paradas = json.load(f)
+
+        if not paradas:
+            return jsonify({"paradas": []})
+
+        df = pd.DataFrame(paradas)
+        latitud = parse_coords(df['latitud_portal']).to_numpy(dtype=float)
+        longitud = parse_coords(df['longitud_portal']).to_numpy(dtype=float)
+
+        # Todas las paradas en una sola consulta (resultado en formato CSR)
+        if radio is not None:
+            offsets, indices, distancias = index.query_radius(latitud, longitud, float(radio))
+        else:
+            offsets, indices, distancias = index.query_knn(latitud, longitud, int(k))
+
+        calles = index.street[indices].tolist()
+        numeros = index.number[indices].tolist()
+        codigos = index.post_code[indices].tolist()
+        lat_portales = index.latitud[indices].tolist()
+        lon_portales = index.longitud[indices].tolist()
+        distancias = distancias.tolist()
+
+        resultado = []
+        for i, parada in enumerate(paradas):
+            candidatos = [
+                {
+                    "street": calles[j],
+                    "number": numeros[j],
+                    "post_code": codigos[j],
+                    "latitud": lat_portales[j],
+                    "longitud": lon_portales[j],
+                    "distance": distancias[j]
+                }
+                for j in range(offsets[i], offsets[i + 1])
+            ]
+            resultado.append({
+                "latitud_portal": parada.get("latitud_portal"),
+                "longitud_portal": parada.get("longitud_portal"),
+                "street": parada.get("street"),
+                "number": parada.get("number"),
+                "candidatos": candidatos
+            })
+
+        return jsonify({"paradas": resultado})
+
+    except Exception as e:
+        current_app.logger.error(f"Error al buscar portales candidatos: {e}")
+        return jsonify({"error": f"Error al buscar portales candidatos: {str(e)}"}), 500
+
+
+
+
 # ------------------------------------------------------------
 # AUXILIARY FUNCTIONS
 # ------------------------------------------------------------
@@ -1,14 +1,22 @@
 from flask import Blueprint, request, current_app, redirect, url_for, session, jsonify, flash
-from .geo_analysis import asociar_direcciones_a_puntos
+from .geo_analysis import asociar_direcciones_a_puntos, get_portal_index_cache, has_precomputed_portals
 from .file_upload import ensure_session_folder
-from .util import parse_coord
+from .util import parse_coords
+from .dataset_cache import get_session_rows, get_session_catalog, get_cache
+from shared.date_format import format_times
 from .map_generation import create_map
-from geopy.distance import geodesic
+from pyproj import Geod
 import os, urllib, json
 import pandas as pd
+import numpy as np
 
 data_generation_bp = Blueprint('data_generation', __name__, template_folder='templates')
 
+GEOD = Geod(ellps='WGS84')
+
+# Columnas del fichero E con el portal asignado por el backend al unificar
+COLUMNAS_PORTAL = ['portal_calle', 'portal_numero', 'portal_cp', 'portal_latitud', 'portal_longitud', 'portal_distancia']
+
 
 
 
@@ -20,38 +28,33 @@ data_generation_bp = Blueprint('data_generation', __name__, template_folder='tem
 def calcular_resumen(resultados):
     """
     Calcula resumen global a partir de la lista de resultados generada en calcular_metricas().
-    Retorna un diccionario con:
-        puntos_totales, distancia_total, tiempo_total, velocidad_media
+    Retorna un diccionario con valores numéricos (el formato se aplica al mostrarlos):
+        puntos_totales, distancia_total (km), tiempo_total (min), velocidad_media (km/h)
     """
 
-    # Ignorar el primer punto (que no tiene valores numéricos)
-    distancias = []
-    tiempos = []
+    # Ignorar los puntos sin valores numéricos (el primero de cada ruta)
+    distancia_total = 0.0
+    tiempo_total = 0.0
 
     for r in resultados:
-        try:
-            if r["distancia"] != "-" and r["tiempo"] != "-":
-                # Extraer valores numéricos
-                d = float(r["distancia"].replace(" m", ""))
-                t_sec = float(r["tiempo"].replace(" sec", ""))
-                distancias.append(d)
-                tiempos.append(t_sec)
-        except Exception:
-            continue
+        distancia = r.get("distancia")
+        tiempo = r.get("tiempo")
+        if isinstance(distancia, (int, float)) and isinstance(tiempo, (int, float)):
+            distancia_total += distancia
+            tiempo_total += tiempo
 
     puntos_totales = len(resultados)
-    distancia_total = sum(distancias) / 1000.0
-    tiempo_total_min = sum(tiempos) / 60.0
+    distancia_total = distancia_total / 1000.0
+    tiempo_total_min = tiempo_total / 60.0
     tiempo_total_h = tiempo_total_min / 60.0 if tiempo_total_min > 0 else 0
 
     velocidad_media = (distancia_total / tiempo_total_h) if tiempo_total_h > 0 else 0
 
-    # Formatear valores legibles
     resumen = {
         "puntos_totales": puntos_totales,
-        "distancia_total": f"{distancia_total:.2f} km",
-        "tiempo_total": f"{int(tiempo_total_min)} min",
-        "velocidad_media": f"{velocidad_media:.2f} km/h"
+        "distancia_total": distancia_total,
+        "tiempo_total": int(tiempo_total_min),
+        "velocidad_media": velocidad_media
     }
 
     return resumen
@@ -70,88 +73,84 @@ def calcular_metricas(df_filtrado):
         Diccionario con los campos:
         tabla: {[{n, hora, longitud, latitud, distancia, tiempo, velocidad, cod_pda, fecha},...]},
         resumen: {puntos_totales, distancia_total, tiempo_total, velocidad_media}
+        distancia (m), tiempo (s) y velocidad (km/h) son numéricos, y None en el
+        primer punto de cada ruta.
     """
 
     # Asegurar que el DataFrame esté ordenado por fecha/hora
-    df_filtrado = df_filtrado.sort_values(['cod_pda', 'fecha_hora'], ascending=[True, True]).reset_index(drop=True)
-
-    # Obtener todos los dias
-    dias = df_filtrado['solo_fecha'].unique()
-
-    resultados = []
-
-    # Recorrer todos los dias
-    for dia in dias:
-        df_diario = df_filtrado[df_filtrado['solo_fecha'] == dia]
-        # Obtener todas las pdas del dia
-        pdas = df_filtrado['cod_pda'].unique()
-        for pda in pdas:
-            df_diario_pda = df_diario[df_diario['cod_pda'] == pda]
-
-            # Generar datos de cada df por dia
-            for i in range(len(df_diario_pda)):
-                fila = df_diario_pda.iloc[i]
-
-                hora = fila['solo_hora']
-                es_parada = fila['es_parada']
-                cod_pda = fila['cod_pda']
-                fecha = fila['solo_fecha']
-
-                lon = parse_coord(fila['longitud'])
-                lat = parse_coord(fila['latitud'])
-
-                # Primer punto
-                if i == 0:
-                    distancia = "-"
-                    tiempo = "-"
-                    velocidad = "-"
-                else:
-                    fila_prev = df_diario_pda.iloc[i - 1]
-
-                    # Calcular distancia (en km)
-                    lon2 = parse_coord(fila_prev['longitud'])
-                    lat2 = parse_coord(fila_prev['latitud'])
-
-                    punto1 = (lat2, lon2)
-                    punto2 = (lat, lon)
-
-                                
-                    try:
-                        distancia_km = geodesic(punto1, punto2).kilometers
-                        distancia_m = geodesic(punto1, punto2).meters
-                    except Exception:
-                        flash("Error: El punto no es válido", 'warning')
-                    
-
-                    # Calcular tiempo en horas
-                    hora_i = pd.to_timedelta(fila['solo_hora'])
-                    hora_prev = pd.to_timedelta(fila_prev['solo_hora'])
-                    delta_t = int((hora_i - hora_prev).total_seconds())
-                    tiempo_horas = delta_t / 3600.0
-
-                    # Calcular velocidad (km/h)
-                    if tiempo_horas > 0:
-                        velocidad_kmh = distancia_km / tiempo_horas
-                    else:
-                        velocidad_kmh = 0.0
-
-                    # Formatear resultados legibles
-                    distancia = f"{distancia_m:.3f} m"
-                    tiempo = f"{int(delta_t)} sec"
-                    velocidad = f"{velocidad_kmh:.2f} km/h"
-
-                resultados.append({
-                    "n": i + 1,
-                    "hora": hora,
-                    "longitud": lon,
-                    "latitud": lat,
-                    "distancia": distancia,
-                    "tiempo": tiempo,
-                    "velocidad": velocidad,
-                    "es_parada": bool(es_parada),
-                    "cod_pda": cod_pda,
-                    "fecha": fecha
-                })
+    df = df_filtrado.sort_values(['cod_pda', 'fecha_hora'], ascending=[True, True]).reset_index(drop=True)
+
+    # Orden de la tabla: por dia y, dentro de cada dia, por PDA (en orden de aparicion)
+    dias = pd.factorize(df['solo_fecha'])[0]
+    pdas = pd.factorize(df['cod_pda'])[0]
+    orden = np.lexsort((np.arange(len(df)), pdas, dias))
+    df = df.iloc[orden].reset_index(drop=True)
+    dias = dias[orden]
+    pdas = pdas[orden]
+
+    # Cada ruta (dia y PDA) empieza donde cambia alguna de las claves
+    inicio_ruta = np.ones(len(df), dtype=bool)
+    inicio_ruta[1:] = (dias[1:] != dias[:-1]) | (pdas[1:] != pdas[:-1])
+    n = df.groupby([dias, pdas], sort=False).cumcount().to_numpy() + 1
+
+    lon = parse_coords(df['longitud']).to_numpy(dtype=float)
+    lat = parse_coords(df['latitud']).to_numpy(dtype=float)
+    lon_prev = np.roll(lon, 1)
+    lat_prev = np.roll(lat, 1)
+    lon_prev[inicio_ruta] = lon[inicio_ruta]
+    lat_prev[inicio_ruta] = lat[inicio_ruta]
+
+    # Distancia con el punto anterior (m), todas en una sola llamada
+    _, _, distancia_m = GEOD.inv(lon_prev, lat_prev, lon, lat)
+    distancia_m = np.asarray(distancia_m)
+    if not np.isfinite(distancia_m).all():
+        flash("Error: El punto no es válido", 'warning')
+
+    # Tiempo con el punto anterior (s): solo_hora ya son segundos desde medianoche
+    segundos = df['solo_hora'].to_numpy(dtype=np.int64)
+    delta_t = np.zeros(len(df), dtype=np.int64)
+    delta_t[1:] = segundos[1:] - segundos[:-1]
+    delta_t[inicio_ruta] = 0
+
+    # Velocidad (km/h)
+    tiempo_horas = delta_t / 3600.0
+    velocidad_kmh = np.zeros(len(df))
+    np.divide(distancia_m / 1000.0, tiempo_horas, out=velocidad_kmh, where=tiempo_horas > 0)
+
+    resultados = [
+        {
+            "n": n_i,
+            "hora": hora,
+            "longitud": lon_i,
+            "latitud": lat_i,
+            "distancia": None if primero else dist,
+            "tiempo": None if primero else dt,
+            "velocidad": None if primero else vel,
+            "es_parada": bool(es_parada),
+            "cod_pda": cod_pda,
+            "fecha": fecha
+        }
+        for n_i, hora, lon_i, lat_i, dist, dt, vel, primero, es_parada, cod_pda, fecha in zip(
+            n.tolist(), format_times(df['solo_hora']), lon.tolist(), lat.tolist(),
+            distancia_m.tolist(), delta_t.tolist(), velocidad_kmh.tolist(), inicio_ruta.tolist(),
+            df['es_parada'].tolist(), df['cod_pda'].tolist(), df['solo_fecha'].tolist()
+        )
+    ]
+
+    # Portal asignado por el backend (mismos campos que asociar_direcciones_a_puntos)
+    if all(col in df.columns for col in COLUMNAS_PORTAL):
+        encontrado = df['portal_distancia'].notna().tolist()
+        for fila, ok, dist, calle, numero, cp, lat_p, lon_p in zip(
+            resultados, encontrado, df['portal_distancia'].tolist(), df['portal_calle'].tolist(),
+            df['portal_numero'].tolist(), df['portal_cp'].tolist(),
+            df['portal_latitud'].tolist(), df['portal_longitud'].tolist()
+        ):
+            if ok:
+                fila.update(distance=dist, street=calle, number=numero, post_code=cp,
+                            nearest_latitud=lat_p, nearest_longitud=lon_p)
+            else:
+                fila.update(distance=None, street='No encontrado', number='N/A', post_code='N/A',
+                            nearest_latitud=None, nearest_longitud=None)
 
     resumen = calcular_resumen(resultados)
 
@@ -159,39 +158,18 @@ def calcular_metricas(df_filtrado):
 
 
 
-def get_datos(cod, pda, fecha_ini, fecha_fin):
+def get_datos(cod, pda, fecha_ini, fecha_fin, con_portales=False):
     """
     Devuelve un diccionario con los cambios tabla y resumen
+    Con con_portales, cada punto incluye el portal asignado por el backend
+    (columnas COLUMNAS_PORTAL del fichero E)
     """
-    # Obtener fichero
-    uploaded = session.get('uploaded_files', {})
-    path = uploaded.get('E')
-    
-    # Abrir fichero
+    # Filas de la oficina, PDA y fechas (rango contiguo del fichero E cacheado)
     try:
-        df = pd.read_csv(path, delimiter=';', low_memory=False)
+        df_filtrado = get_session_rows(cod, pda, fecha_ini, fecha_fin or fecha_ini)
     except Exception as e:
         current_app.logger.error(f"Error al leer el archivo CSV: {e}")
         return []
-    
-    df = df[df['cod_unidad'] == int(cod)]
-
-    # --- FILTRO POR PDA ---
-    if pda == "TODAS":
-        df_aux = df
-    else:
-        df_aux = df[df['cod_pda'] == pda]
-
-    # --- FILTRO POR FECHA SIN HORA
-    if fecha_fin:  
-        # rango de fechas
-        df_filtrado = df_aux[
-            (df_aux['solo_fecha'] >= fecha_ini) &
-            (df_aux['solo_fecha'] <= fecha_fin)
-        ].copy()
-    else:
-        # solo una fecha
-        df_filtrado = df_aux[df_aux['solo_fecha'] == fecha_ini].copy()
 
     if df_filtrado.empty:
         current_app.logger.error(f"No hay datos para PDA={pda} y fecha={fecha_ini}")
@@ -200,7 +178,10 @@ def get_datos(cod, pda, fecha_ini, fecha_fin):
     # Extraer solo las columnas que interesan
     # CAMBIO: se añade cod_pda
     columnas = ['fecha_hora', 'solo_fecha', 'solo_hora', 'longitud', 'latitud', 'es_parada','cod_pda']
-    df_filtrado = df_filtrado[columnas].dropna()
+    if con_portales:
+        df_filtrado = df_filtrado[columnas + COLUMNAS_PORTAL].dropna(subset=columnas)
+    else:
+        df_filtrado = df_filtrado[columnas].dropna()
     resultados = calcular_metricas(df_filtrado)
 
     return resultados
@@ -279,8 +260,8 @@ def asignar_tipo_de_calle(datos, conteo):
             dato["conteo_zigzag"] = conteo[calle]["zigzag"]
             dato["tipo"] = conteo[calle]["tipo"]
         else:
-            dato["conteo_par_impar"] = "-"
-            dato["conteo_zigzag"] = "-"
+            dato["conteo_par_impar"] = 0
+            dato["conteo_zigzag"] = 0
             dato["tipo"] = "-"
     return datos
 
@@ -301,10 +282,16 @@ def datos_tabla():
 
     # TODO: cambiar para que llame a la API del backend y no lo haga aqui
 
+    static_dir = current_app.config.get("GEOJSON_FOLDER")
+    file_geojson = os.path.join(static_dir, f'{cod}.geojson')
+
+    # Si el backend ya asigno los portales con el GeoJSON actual, solo se leen del fichero E
+    portales_precalculados = has_precomputed_portals(get_session_catalog(), cod, file_geojson)
+
     # Los argumentos son strings, por ejemplo
     # pda = "PDA01"
     # ini = "2025-10-18"
-    resultados = get_datos(cod, pda, ini, fin)
+    resultados = get_datos(cod, pda, ini, fin, con_portales=portales_precalculados)
 
     # Almacenar datos tabla en carpeta del usuario
     if not isinstance(resultados, dict) or 'tabla' not in resultados:
@@ -313,14 +300,16 @@ def datos_tabla():
     
     try:
         # 2. Preparar la Clusterización (Lógica traída de clusterizar_portales)
-        static_dir = current_app.config.get("GEOJSON_FOLDER")
-        file_geojson = os.path.join(static_dir, f'{cod}.geojson')
-
         # Verificar si existe el GeoJSON antes de procesar
         if not os.path.exists(file_geojson):
             current_app.logger.warning(f"No se encontró archivo GeoJSON en: {file_geojson}. Se devolverán datos sin clusterizar.")
             # Si no hay mapa, usamos los datos originales sin procesar geometría
             datos_finales = resultados['tabla']
+        elif portales_precalculados:
+            current_app.logger.info(f"Portales ya asignados en el fichero E")
+            datos_finales = resultados['tabla']
+            conteo = conteo_tipo_de_calles(resultados['tabla'])
+            asignar_tipo_de_calle(resultados['tabla'], conteo)
         else:
             current_app.logger.error(f"Empezando asignacion de portales...")
             # Llamamos a la función de geoAnalysis directamente pasando la lista 'tabla'
@@ -368,6 +357,17 @@ def datos_tabla():
         current_app.logger.error(f"Excepción en el proceso datos_tabla: {e}")
         return jsonify({"error": f"Error interno del servidor: {str(e)}"}), 500
 
+@data_generation_bp.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """
+    JSON: Contadores de las caches de este proceso (ficheros de sesion e indices de portales)
+    {'datasets': {...}, 'portal_indexes': {...}}
+    """
+    return jsonify({
+        'datasets': get_cache().stats(),
+        'portal_indexes': get_portal_index_cache().stats()
+    })
+
 @data_generation_bp.route('/generar_mapa/get_mapa', methods=['GET', 'POST'])
 def get_mapa():
     data = request.get_json()
@@ -0,0 +1,224 @@
+from flask import session, current_app
+from collections import OrderedDict
+from .file_schema import read_dataset
+import threading
+import json
+import time
+import os
+
+
+class DatasetCache:
+    """Process-level LRU cache of the files of each session.
+
+    Entries are keyed by session id and file type and remember the path,
+    modification time and size of the file they were read from, so a
+    file replaced on disk is read again. When the memory used by the
+    cached files exceeds ``max_bytes`` the least recently used
+    entries are evicted.
+
+    The cache counts hits, misses and the time spent in the loaders,
+    see `stats`.
+
+    Args:
+        max_bytes (int): Memory budget of the cache in bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.used_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+
+    def get(self, key, path, loader):
+        """Return the content of ``path``, reading it only if needed.
+
+        Args:
+            key (tuple): Key of the entry, (session id, file type).
+            path (str): Path to the file.
+            loader (callable): Reads the file. Receives ``path`` and
+                returns the content and its size in bytes.
+
+        Returns:
+            The content of the file. It is shared between requests, so
+            callers must not modify it in place.
+        """
+        stat = os.stat(path)
+        stamp = (path, stat.st_mtime_ns, stat.st_size)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        start = time.perf_counter()
+        value, size = loader(path)
+        elapsed = time.perf_counter() - start
+
+        with self.lock:
+            self.load_seconds += elapsed
+            self._remove(key)
+            # Files bigger than the whole budget are not cached
+            if size <= self.max_bytes:
+                self.entries[key] = (stamp, value, size)
+                self.used_bytes += size
+                while self.used_bytes > self.max_bytes:
+                    oldest = next(iter(self.entries))
+                    self._remove(oldest)
+                    self.evictions += 1
+
+        return value
+
+    def invalidate(self, key):
+        """Drop the entry of ``key``, if any, so the next `get` reloads it."""
+        with self.lock:
+            self._remove(key)
+
+    def stats(self):
+        """Return the counters of the cache.
+
+        Returns:
+            dict: Number of entries, used and maximum bytes, hits,
+            misses, evictions and seconds spent loading files.
+        """
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "used_bytes": self.used_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "load_seconds": round(self.load_seconds, 6)
+            }
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.used_bytes -= entry[2]
+
+
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-level cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DatasetCache(current_app.config.get("DATASET_CACHE_MAX_BYTES"))
+    return _cache
+
+
+
+
+def get_session_dataset(file_type="E", columns=None):
+    """Return a dataset of the current session from the cache.
+
+    Args:
+        file_type (str, optional): Type of the file. Defaults to 'E'.
+        columns (list[str] | None, optional): Columns to return. Defaults
+            to all of them.
+
+    Returns:
+        pandas.DataFrame: The dataset, which must not be modified in place.
+
+    Raises:
+        FileNotFoundError: If the session has no file of that type.
+    """
+    path = session.get('uploaded_files', {}).get(file_type)
+    if not path or not os.path.exists(path):
+        raise FileNotFoundError(f"No hay fichero {file_type} en la sesion")
+
+    def loader(path):
+        df = read_dataset(path, file_type)
+        return df, int(df.memory_usage(deep=True).sum())
+
+    df = get_cache().get((session.get("id"), file_type), path, loader)
+    if columns is not None:
+        df = df[columns]
+    return df
+
+
+
+
+def get_session_catalog():
+    """Return the catalog (offices -> PDAs -> dates) of the current session.
+
+    Returns:
+        dict | None: The catalog built by the backend together with
+        Fichero_E, or None if the session does not have one (e.g. only
+        file A was uploaded). It must not be modified.
+    """
+    path = session.get('uploaded_files', {}).get('catalog')
+    if not path or not os.path.exists(path):
+        return None
+
+    def loader(path):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f), os.path.getsize(path)
+
+    return get_cache().get((session.get("id"), 'catalog'), path, loader)
+
+
+
+
+def get_session_rows(cod, pda="TODAS", fecha_ini=None, fecha_fin=None):
+    """Return the rows of Fichero_E of an office, PDA and date range.
+
+    Fichero_E is stored sorted by office, PDA, date and time, and the
+    catalog holds the range of rows of each of them, so the rows are
+    returned as a slice of the cached dataset without scanning it.
+    Sessions without a catalog fall back to filtering the dataset.
+
+    Args:
+        cod (str | int): Office code.
+        pda (str, optional): PDA code, or "TODAS" for every PDA of the
+            office. Defaults to "TODAS".
+        fecha_ini (str | None, optional): First date (YYYY-MM-DD). If
+            None, every date is returned.
+        fecha_fin (str | None, optional): Last date, included. Defaults
+            to ``fecha_ini``.
+
+    Returns:
+        pandas.DataFrame: The selected rows, which must not be modified
+        in place.
+    """
+    df = get_session_dataset("E")
+    catalog = get_session_catalog()
+    if fecha_fin is None:
+        fecha_fin = fecha_ini
+
+    if catalog is None:
+        rows = df[df['cod_unidad'] == int(cod)]
+        if pda != "TODAS":
+            rows = rows[rows['cod_pda'] == pda]
+    else:
+        unit = catalog.get(str(int(cod)))
+        if unit is None:
+            return df.iloc[0:0]
+        if pda == "TODAS":
+            rows = df.iloc[unit["start"]:unit["end"]]
+        else:
+            # Las fechas de una PDA son contiguas: rango desde la primera a la ultima
+            dates = unit["pdas"].get(pda, {}).get("dates", {})
+            selected = [
+                entry for date, entry in dates.items()
+                if fecha_ini is None or fecha_ini <= date <= fecha_fin
+            ]
+            if not selected:
+                return df.iloc[0:0]
+            return df.iloc[selected[0]["start"]:selected[-1]["end"]]
+
+    if fecha_ini is not None:
+        rows = rows[(rows['solo_fecha'] >= fecha_ini) & (rows['solo_fecha'] <= fecha_fin)]
+    return rows
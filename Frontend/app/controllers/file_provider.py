@@ -1,6 +1,7 @@
 from flask import Blueprint, current_app,session, Response, request
 import requests, os, json, io, csv
 from datetime import date
+from shared.geojson_reader import read_geojson_points
 
 file_provider_bp = Blueprint('file_provider', __name__, template_folder='templates')
 
@@ -187,32 +188,31 @@ def fill_data(cod, og_data):
     static_dir = current_app.config.get("GEOJSON_FOLDER")
     geojson_path = os.path.join(static_dir, f'{cod}.geojson')
 
-    with open(geojson_path, "r", encoding="utf-8") as f:
-        geojson_data = json.load(f)
-    
+    # Lectura incremental: solo columnas de coordenadas y direcciones
+    points = read_geojson_points(geojson_path)
+
     geojson_data_list = []
-    for feature in geojson_data.get('features', []):
-        coords = feature.get('geometry', {}).get('coordinates', [])
-        if len(coords) == 2:
-            data = feature.get('properties', {})
-            geojson_data_list.append({
-                # GeoJSON coordinates are in [longitude, latitude] order
-                "cod_pda": "-",
-                "street": data.get('street', ""),
-                "number": data.get('number', ""),
-                "latitud_portal": str(coords[1]).replace('.', ','),
-                "longitud_portal": str(coords[0]).replace('.', ','),
-                "distance_portal": 0,
-                "post_code": data.get('postcode', ""),
-                "pts_cluster" : "-",
-                "times_visited": 0,
-                "time_accumulated" : 0,
-                "time_mean" : 0,
-                "is_stop" : "-",
-                "even_odd_count" : 0,
-                "zigzag_count" : 0,
-                "type" : "-"
-            })
+    for street, number, post_code, latitud, longitud in zip(
+        points.street.tolist(), points.number.tolist(), points.post_code.tolist(),
+        points.latitud.tolist(), points.longitud.tolist()
+    ):
+        geojson_data_list.append({
+            "cod_pda": "-",
+            "street": street,
+            "number": number,
+            "latitud_portal": str(latitud).replace('.', ','),
+            "longitud_portal": str(longitud).replace('.', ','),
+            "distance_portal": 0,
+            "post_code": post_code,
+            "pts_cluster" : "-",
+            "times_visited": 0,
+            "time_accumulated" : 0,
+            "time_mean" : 0,
+            "is_stop" : "-",
+            "even_odd_count" : 0,
+            "zigzag_count" : 0,
+            "type" : "-"
+        })
 
     # Crear índice de lista2 por clave compuesta
     index_og_data = {
@@ -0,0 +1,176 @@
+from shared.date_format import format_dates
+import pandas as pd
+import pyarrow.parquet as pq
+
+
+# Values treated as missing when reading any file
+INVALID_VALUES = [
+    "#N/A", "#N/D", "#N/A N/A", "#NA", "-N/A",
+    "#NULL!", "#DIV/0!", "#NUM!", "#NAME?", "#VALUE!",
+    "NULL", "null", "Nil", "nil", "",
+    "nan", "NaN", "NAN", "<NA>",
+    "#n/a", "N/A", "n/a", "NA", "na", "NULL", "-",
+    "?", "*", " ", ".."
+]
+
+# Schema of every file handled by the frontend:
+#   columns : columns the file must contain (uploaded files) or that can be read (E)
+#   dtypes  : column name -> dtype used when reading it. The backend stores
+#             solo_fecha and solo_hora as integers (days since 1970-01-01 and
+#             seconds since midnight): "date" columns are read as text
+#             (YYYY-MM-DD), the key of the catalog and the selectors, and
+#             "time" columns as seconds since midnight (int32)
+FILE_SCHEMAS = {
+    "A": {
+        "columns": ["fec_lectura_medicion", "longitud_wgs84_gd", "latitud_wgs84_gd", "cod_inv_pda", "codired"],
+        "dtypes": {}
+    },
+    "B": {
+        "columns": ["Num Inv", "Fec Actividad", "Seg Transcurrido", "Cod Unidad", "Cod Actividad", "Seccion", "Turno"],
+        "dtypes": {}
+    },
+    "C": {
+        "columns": ["COD_SECCION", "INSTANTE_EVENTO", "NUM_GEO_LONGITUD", "NUM_GEO_LATITUD", "COD_NODOEMI", "IND_TURNO"],
+        "dtypes": {}
+    },
+    "E": {
+        "columns": [
+            "cod_unidad", "cod_pda", "fecha_hora", "solo_fecha", "solo_hora", "longitud", "latitud", "es_parada",
+            # Nearest portal, only present for offices with a GeoJSON when the file was unified
+            "portal_calle", "portal_numero", "portal_cp", "portal_latitud", "portal_longitud", "portal_distancia"
+        ],
+        "dtypes": {
+            "cod_unidad": "int32",
+            "cod_pda": "category",
+            "fecha_hora": "str",
+            "solo_fecha": "date",
+            "solo_hora": "time",
+            "longitud": "float32",
+            "latitud": "float32",
+            "es_parada": "bool",
+            "portal_calle": "str",
+            "portal_numero": "str",
+            "portal_cp": "str",
+            "portal_latitud": "float64",
+            "portal_longitud": "float64",
+            "portal_distancia": "float64"
+        }
+    }
+}
+
+
+
+
+def _read_dates(values):
+    """Text (YYYY-MM-DD) of a date column stored as day numbers or as text."""
+    if pd.api.types.is_integer_dtype(values):
+        return pd.Series(format_dates(values), index=values.index)
+    return values.astype(str).where(values.notna())
+
+
+
+
+def _read_times(values):
+    """Seconds since midnight of a time column stored as seconds or as text (HH:MM:SS)."""
+    if pd.api.types.is_integer_dtype(values):
+        return values.astype("int32")
+    return pd.to_timedelta(values.astype(str)).dt.total_seconds().astype("int32")
+
+
+
+
+def read_header(path):
+    """Returns the column names of a CSV file without reading its rows"""
+    return pd.read_csv(path, delimiter=';', nrows=0).columns
+
+
+
+
+def read_typed_csv(path, file_type, columns=None):
+    """Read a CSV file using the schema of its type.
+
+    Only the requested columns are parsed, and each one is read with
+    the dtype defined in the schema, so unused columns are never
+    materialized.
+
+    Args:
+        path (str): Path to the CSV file.
+        file_type (str): Type of the file (e.g. 'E').
+        columns (list[str] | None, optional): Columns to read. Defaults
+            to all the columns of the schema.
+
+    Returns:
+        pandas.DataFrame: Typed DataFrame with the requested columns
+        that are present in the file.
+    """
+    schema = FILE_SCHEMAS[file_type]
+    available = set(read_header(path))
+    usecols = [
+        col for col in schema["columns"]
+        if col in available and (columns is None or col in columns)
+    ]
+    dtypes = {col: schema["dtypes"][col] for col in usecols if col in schema["dtypes"]}
+
+    df = pd.read_csv(
+        path,
+        delimiter=';',
+        usecols=usecols,
+        dtype={col: "str" if dtype in ("date", "time") else dtype for col, dtype in dtypes.items()},
+        na_values=INVALID_VALUES
+    )
+
+    for col, dtype in dtypes.items():
+        if dtype == "date":
+            df[col] = _read_dates(df[col])
+        elif dtype == "time":
+            df[col] = _read_times(df[col])
+
+    return df
+
+
+
+
+def read_dataset(path, file_type, columns=None, filters=None):
+    """Read a dataset downloaded from the backend, Parquet or CSV.
+
+    Parquet files are memory mapped and only the requested columns
+    and the row groups matching the filters are read. The result has
+    the same dtypes as ``read_typed_csv`` so callers can handle both
+    formats the same way.
+
+    Args:
+        path (str): Path to the Parquet or CSV file.
+        file_type (str): Type of the file (e.g. 'E').
+        columns (list[str] | None, optional): Columns to read. Defaults
+            to all the columns of the schema.
+        filters (list[tuple] | None, optional): Predicates pushed down to
+            the Parquet reader, e.g. ``[("cod_unidad", "=", 2801234)]``.
+            Ignored for CSV files.
+
+    Returns:
+        pandas.DataFrame: Typed DataFrame with the requested columns.
+    """
+    if not path.endswith('.parquet'):
+        return read_typed_csv(path, file_type, columns)
+
+    schema = FILE_SCHEMAS[file_type]
+    available = pq.read_schema(path, memory_map=True).names
+    usecols = [
+        col for col in schema["columns"]
+        if col in available and (columns is None or col in columns)
+    ]
+    df = pq.read_table(path, columns=usecols, filters=filters, memory_map=True).to_pandas()
+
+    for col in usecols:
+        dtype = schema["dtypes"].get(col)
+        if dtype == "str":
+            # Same text as in the CSV, keeping missing values as NaN
+            df[col] = df[col].astype(str).where(df[col].notna())
+        elif dtype == "date":
+            df[col] = _read_dates(df[col])
+        elif dtype == "time":
+            df[col] = _read_times(df[col])
+        elif dtype is not None:
+            df[col] = df[col].astype(dtype)
+
+    return df
@@ -1,5 +1,6 @@
 from flask import Blueprint, request, current_app, session, jsonify
 from .file_validation import ensure_session_folder, valid_file
+from .geo_analysis import invalidate_portal_index
 from werkzeug.utils import secure_filename
 from pathlib import Path
 import os, requests
@@ -238,5 +239,7 @@ def upload_geojson():
     static_path = current_app.config.get("GEOJSON_FOLDER")
     geojson_path = Path(os.path.join(static_path, f'{cod}.geojson'))
     file.save(geojson_path)
+    # El indice de portales de la oficina se reconstruye con el nuevo fichero
+    invalidate_portal_index(str(geojson_path), cod)
 
     return jsonify({'success': True})
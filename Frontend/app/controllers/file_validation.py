@@ -1,5 +1,5 @@
 from flask import Blueprint, current_app, session, jsonify, request
-import pandas as pd
+from .file_schema import FILE_SCHEMAS, read_header
 from pathlib import Path
 import os, requests
 
@@ -137,8 +137,8 @@ def ensure_session_folder():
 def valid_file(path, file_type):
     """Validate the structure of an uploaded CSV file.
 
-    This endpoint reads a CSV file from the given path, checks for
-    required columns based on the file type, and returns a JSON
+    This endpoint reads the header of a CSV file from the given path,
+    checks for required columns based on the file type schema, and returns a JSON
     response indicating whether the file is valid. Designed for
     use with files of types 'A', 'B', or 'C'.
 
@@ -159,21 +159,15 @@ def valid_file(path, file_type):
         - Logs a message to `current_app.logger` if the file is valid.
     """
     try:
-        df = pd.read_csv(path, delimiter=';', low_memory=False)
+        columns = read_header(path)
     except Exception:
         return jsonify({
             'error': 'Error al leer el archivo: Asegurese de que el archivo es de tipo CSV.'
         }), 500
 
-    required_columns_map = {
-        "A": {"fec_lectura_medicion", "longitud_wgs84_gd", "latitud_wgs84_gd", "cod_inv_pda", "codired"},
-        "B": {"Num Inv", "Fec Actividad", "Seg Transcurrido", "Cod Unidad", "Cod Actividad", "Seccion", "Turno"},
-        "C": {"COD_SECCION", "INSTANTE_EVENTO", "NUM_GEO_LONGITUD", "NUM_GEO_LATITUD", "COD_NODOEMI", "IND_TURNO"}
-    }
-
-    required_columns = required_columns_map.get(file_type)
+    required_columns = set(FILE_SCHEMAS[file_type]["columns"])
     
-    if not required_columns.issubset(df.columns):
+    if not required_columns.issubset(columns):
         return jsonify({
             'error': f'El fichero CSV "{file_type}" debe contener las columnas: {", ".join(required_columns)}'
         }), 400
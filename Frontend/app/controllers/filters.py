@@ -186,9 +186,12 @@ def filter_data():
 # ------------------------------------------------------------
 
 def extraer_num(text):
-    """Busca el primer número (entero o decimal) en un string y lo devuelve como float."""
+    """Devuelve el valor como float. Los valores numéricos se usan tal cual; en los
+    strings se busca el primer número (entero o decimal)."""
     if text is None:
         return None
+    if isinstance(text, (int, float)) and not isinstance(text, bool):
+        return float(text)
     # Usa re.search para encontrar el patrón de dígitos y puntos
     match = re.search(r'[\d\.]+', str(text)) 
     if match:
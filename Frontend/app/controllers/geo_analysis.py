@@ -1,60 +1,13 @@
+from flask import current_app
 from pyproj import Geod
-import pandas as pd
+from shared.portal_index import geojson_stamp, portal_index_path, load_portal_index
+from .dataset_cache import DatasetCache
 import numpy as np
-import json, os
-
-kd_tree_dic = {}
-
-class Node:
-    """Tree node representing a spatial point and its partitioning metadata.
-
-    This class is typically used in spatial data structures such as
-    k-d trees. Each node stores geographic coordinates, a reference
-    to the original feature, and the dimension used to split the
-    space at this node.
-
-    Attributes:
-        longitud (float): Longitude coordinate of the point.
-        latitud (float): Latitude coordinate of the point.
-        feature_original (Any): Reference to the original data
-            structure or feature associated with this node.
-        splitting_dimension (int): Dimension index used to split
-            the space (e.g., 0 for longitude, 1 for latitude).
-        left_node (Node | None): Left child node in the tree.
-        right_node (Node | None): Right child node in the tree.
-    """
-
-    def __init__(
-        self,
-        longitud,
-        latitud,
-        feature_original,
-        splitting_dimension,
-        left_node=None,
-        right_node=None
-    ):
-        """Initialize a Node instance.
-
-        Args:
-            longitud (float): Longitude coordinate of the point.
-            latitud (float): Latitude coordinate of the point.
-            feature_original (Any): Original feature or data object
-                associated with this node.
-            splitting_dimension (int): Dimension index used to split
-                the space at this node.
-            left_node (Node | None, optional): Left child node.
-                Defaults to None.
-            right_node (Node | None, optional): Right child node.
-                Defaults to None.
-        """
-        self.longitud = longitud
-        self.latitud = latitud
-        self.feature_original = feature_original
-        self.splitting_dimension = splitting_dimension
-        self.left_node = left_node
-        self.right_node = right_node
-
+import threading
+import os
 
+_portal_index_cache = None
+_portal_index_cache_lock = threading.Lock()
 
 # --- GLOBAL SUPPORT FUNCTIONS ---
 g = Geod(ellps='WGS84')
@@ -81,218 +34,13 @@ def geodesic_distance_meters(lat1, lon1, lat2, lon2):
 
 # ------------------------------------
 
-def convertToDataframe(geojson_data):
-    """Convert GeoJSON feature data into a Pandas DataFrame.
-
-    This function extracts point coordinates and selected properties
-    from a GeoJSON FeatureCollection and returns them as a structured
-    Pandas DataFrame. Only features with valid 2D point coordinates
-    are processed.
-
-    GeoJSON coordinates are expected in the format:
-    `[longitude, latitude]`.
-
-    Args:
-        geojson_data (dict): GeoJSON object containing a
-            `FeatureCollection` with point geometries.
-
-    Returns:
-        pandas.DataFrame: DataFrame with the following columns:
-            - longitud (float): Longitude coordinate.
-            - latitud (float): Latitude coordinate.
-            - feature_original (dict): Subset of properties extracted
-              from the original GeoJSON feature, including country,
-              postcode, street, and number.
-    """
-    data_list = []
-    for feature in geojson_data.get('features', []):
-        coords = feature.get('geometry', {}).get('coordinates', [])
-        if len(coords) == 2:
-            data = feature.get('properties', {})
-            data_list.append({
-                # GeoJSON coordinates are in [longitude, latitude] order
-                'longitud': coords[0],
-                'latitud': coords[1],
-                'feature_original': {
-                    'country': data.get('country', ""),
-                    'postcode': data.get('postcode', ""),
-                    'street': data.get('street', ""),
-                    'number': data.get('number', ""),
-                }
-            })
-
-    df = pd.DataFrame(data_list)
-    return df
-
-
-def create_kd_tree_optimized(coord_array, metadata_array, indices=None, depth=0):
-    """Build an optimized k-d tree from spatial coordinate data.
-
-    This function recursively constructs a balanced k-d tree (k=2)
-    from a set of latitude/longitude coordinates. It uses NumPy's
-    `argpartition` to select the median in linear time, avoiding
-    full sorting at each recursion level.
-
-    The tree alternates the splitting dimension at each depth:
-    - 0: latitude
-    - 1: longitude
-
-    Args:
-        coord_array (numpy.ndarray): Array of shape (N, 2) containing
-            spatial coordinates in the form:
-            `[latitud, longitud]`.
-        metadata_array (Sequence[Any]): Array-like structure containing
-            metadata associated with each coordinate. Each entry is
-            attached to the corresponding tree node.
-        indices (numpy.ndarray | None, optional): Indices of
-            `coord_array` to consider at the current recursion level.
-            If None, all points are used. Defaults to None.
-        depth (int, optional): Current recursion depth, used to
-            determine the splitting dimension. Defaults to 0.
-
-    Returns:
-        Node | None: Root node of the constructed k-d tree subtree,
-        or None if no indices are provided.
-    """
-    if indices is None:
-        indices = np.arange(len(coord_array))
-        
-    if len(indices) == 0:
-        return None 
-    
-    k = 2 
-    current_dim = depth % k
-
-    median_pos = len(indices) // 2
-    
-    # (0=lat, 1=lon)
-    partition_indices = np.argpartition(coord_array[indices, current_dim], median_pos)
-    median_idx_in_subset = partition_indices[median_pos]
-    
-    median_absolute_index = indices[median_idx_in_subset]
-    
-    is_left = coord_array[indices, current_dim] < coord_array[median_absolute_index, current_dim]
-    
-    is_left[median_idx_in_subset] = False
-    
-    # Indices for the left and right subtrees
-    left_indices = indices[is_left]
-    right_indices = indices[~is_left]
-    
-    right_indices = right_indices[right_indices != median_absolute_index]
-    
-    # Create Node and Recurse
-    node = Node(
-        latitud=coord_array[median_absolute_index][0],
-        longitud=coord_array[median_absolute_index][1],
-        feature_original=metadata_array[median_absolute_index],
-        splitting_dimension=current_dim,
-        
-        left_node=create_kd_tree_optimized(coord_array, metadata_array, left_indices, depth + 1),
-        right_node=create_kd_tree_optimized(coord_array, metadata_array, right_indices, depth + 1)
-    )
-
-    return node
-
-# --- RECURSIVE SEARCH FUNCTION ---
-def _nearest_neighbor_recursive(current_node, target_point, best_dist_m, nearest_node):
-    """Recursively search a k-d tree for the nearest neighbor.
-
-    This function implements the core recursive logic for a k-d tree
-    nearest-neighbor query with heuristic pruning. Distances are
-    computed using geodesic distance (WGS84) via `pyproj.Geod`.
-
-    The algorithm first explores the subtree closest to the target
-    point and only explores the opposite subtree if the distance to
-    the splitting plane indicates a closer point may exist.
-
-    Args:
-        current_node (Node | None): Current node in the k-d tree.
-        target_point (tuple[float, float]): Target point coordinates
-            in the form `(latitud, longitud)`.
-        best_dist_m (float): Current best distance found, in meters.
-        nearest_node (Node | None): Node corresponding to the current
-            nearest neighbor.
-
-    Returns:
-        tuple[float, Node | None]: A tuple containing:
-            - Best (minimum) distance found, in meters.
-            - Node corresponding to the nearest neighbor.
-    """
-    if current_node is None:
-        return best_dist_m, nearest_node
-
-    target_lat, target_lon = target_point
-    
-    current_dist_m = geodesic_distance_meters(
-        target_lat,
-        target_lon,
-        current_node.latitud,
-        current_node.longitud
-    )
-    
-    if current_dist_m < best_dist_m:
-        best_dist_m = current_dist_m
-        nearest_node = current_node
-
-    dim = current_node.splitting_dimension
-    
-    # target_point is (lat, lon): dim=0 -> latitude, dim=1 -> longitude
-    target_val = target_point[dim]
-    node_val = (
-        current_node.latitud if dim == 0
-        else current_node.longitud
-    )
-    
-    if target_val < node_val:
-        search_first, search_second = (
-            current_node.left_node,
-            current_node.right_node
-        )
-    else:
-        search_first, search_second = (
-            current_node.right_node,
-            current_node.left_node
-        )
-
-    # Search the "near" subtree first
-    best_dist_m, nearest_node = _nearest_neighbor_recursive(
-        search_first,
-        target_point,
-        best_dist_m,
-        nearest_node
-    )
-    
-    # Pruning: distance from target to splitting plane
-    dist_to_plane_sq = (target_val - node_val) ** 2
-    
-    # Heuristic conversion: meters to squared degrees
-    meters_per_degree = 111_320
-    best_dist_degrees_sq = (best_dist_m / meters_per_degree) ** 2
-    
-    if dist_to_plane_sq < best_dist_degrees_sq:
-        # Search the "far" subtree only if necessary
-        best_dist_m, nearest_node = _nearest_neighbor_recursive(
-            search_second,
-            target_point,
-            best_dist_m,
-            nearest_node
-        )
-        
-    return best_dist_m, nearest_node
-
-
-def find_nearest_address(kd_tree_root, target_lat, target_lon):
+def find_nearest_address(index, target_lat, target_lon):
     """Find the nearest address to a target geographic coordinate.
 
-    This function serves as a public wrapper around the internal
-    k-d tree nearest-neighbor search. It initializes the recursive
-    search, then formats the result into a user-friendly dictionary
-    containing distance and address information.
+    Single point wrapper around `PortalIndex.query_nearest`.
 
     Args:
-        kd_tree_root (Node | None): Root node of the k-d tree
-            containing address points.
+        index (PortalIndex): Index with the address points.
         target_lat (float): Latitude of the target location.
         target_lon (float): Longitude of the target location.
 
@@ -306,91 +54,111 @@ def find_nearest_address(kd_tree_root, target_lat, target_lon):
             - number (str): Street number of the nearest address.
             - post_code (str): Postal code of the nearest address.
     """
-    # target_point is defined as (latitude, longitude)
-    # to match dim=0 (lat) and dim=1 (lon) indexing
-    target_point = (target_lat, target_lon)
-    
-    best_dist_m, nearest_node = _nearest_neighbor_recursive(
-        current_node=kd_tree_root,
-        target_point=target_point,
-        best_dist_m=float('inf'),
-        nearest_node=None
-    )
-    
-    if nearest_node:
-        address_data = nearest_node.feature_original
-        
-        return {
-            'distance_meters': best_dist_m,
-            'nearest_latitud': nearest_node.latitud,
-            'nearest_longitud': nearest_node.longitud,
-            'street': address_data.get('street', 'N/A'),
-            'number': address_data.get('number', 'N/A'),
-            'post_code': address_data.get('postcode', 'N/A')
-        }
-
-    return None
-
-def initialize_global_tree(file_geojson, cod):
-    """Initialize and cache a global k-d tree from a GeoJSON file.
-
-    This function loads a GeoJSON file, converts its contents into a
-    structured DataFrame, builds an optimized k-d tree from the
-    extracted coordinates, and stores the resulting tree in a global
-    dictionary keyed by the provided code.
-
-    If the tree for the given code already exists, or if the input
-    file is missing or invalid, the function exits silently.
+    nearest, distance = index.query_nearest([target_lat], [target_lon])
+    i = nearest[0]
+    if i < 0:
+        return None
+
+    return {
+        'distance_meters': float(distance[0]),
+        'nearest_latitud': float(index.latitud[i]),
+        'nearest_longitud': float(index.longitud[i]),
+        'street': index.street[i],
+        'number': index.number[i],
+        'post_code': index.post_code[i]
+    }
+
+def get_portal_index_cache():
+    """Return the process-level cache of portal indexes, creating it on first use."""
+    global _portal_index_cache
+    with _portal_index_cache_lock:
+        if _portal_index_cache is None:
+            _portal_index_cache = DatasetCache(current_app.config.get("PORTAL_INDEX_CACHE_MAX_BYTES"))
+    return _portal_index_cache
+
+
+def get_portal_index(file_geojson, cod):
+    """Return the portal index of an office from the cache.
+
+    Entries are keyed by office code and remember the modification
+    time and size of the GeoJSON file, so a replaced file is indexed
+    again. The least recently used indexes are evicted when the cache
+    exceeds `PORTAL_INDEX_CACHE_MAX_BYTES`.
+
+    If the input file is missing or invalid, None is returned (the
+    error is logged).
 
     Args:
         file_geojson (str): Path to the GeoJSON file containing
             point features with geographic coordinates.
-        cod (Hashable): Key used to store and retrieve the k-d tree
-            instance from the global cache.
-
-    Side Effects:
-        - Reads data from disk.
-        - Modifies the global `kd_tree_dic` dictionary by adding a
-          new k-d tree entry when successful.
+        cod (Hashable): Office code used as key of the cache.
 
     Returns:
-        None
+        PortalIndex | None: The index of the office, or None.
     """
-    global kd_tree_dic
-    if cod in kd_tree_dic:
-        return
-
     if not os.path.exists(file_geojson):
-        return
+        return None
+
+    def loader(path):
+        index = load_portal_index(path)
+        return index, 0 if index is None else index.nbytes
 
     try:
-        with open(file_geojson, "r", encoding="utf-8") as f:
-            geojson_data = json.load(f)
-        
-        df_geojson = convertToDataframe(geojson_data)
-        if df_geojson.empty:
-            return
+        return get_portal_index_cache().get(str(cod), file_geojson, loader)
+    except Exception:
+        current_app.logger.exception(f"No se pudo cargar el indice de portales de {file_geojson}")
+        return None
+
 
-        coord_array = df_geojson[['latitud', 'longitud']].to_numpy()
-        metadata_array = df_geojson['feature_original'].to_numpy()
+def invalidate_portal_index(file_geojson, cod):
+    """Discard the cached and persisted portal index of an office.
 
-        KD_TREE_ROOT = create_kd_tree_optimized(coord_array, metadata_array)
+    Called when the GeoJSON of the office is replaced, so the next
+    query builds the index from the new file.
+
+    Args:
+        file_geojson (str): Path to the GeoJSON file of the office.
+        cod (Hashable): Office code used as key of the cache.
+    """
+    get_portal_index_cache().invalidate(str(cod))
+    index_path = portal_index_path(file_geojson)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+def has_precomputed_portals(catalog, cod, file_geojson):
+    """Check whether Fichero_E already holds the portals of an office.
+
+    When the files are unified, the backend assigns the nearest portal
+    to every row of the offices with a GeoJSON (columns `portal_*`) and
+    records the size and modification time of that GeoJSON in the
+    catalog. The columns are only valid while the GeoJSON is the same.
+
+    Args:
+        catalog (dict | None): Catalog of the session.
+        cod (str | int): Office code.
+        file_geojson (str): Path to the current GeoJSON of the office.
+
+    Returns:
+        bool: True if the `portal_*` columns can be used for the office.
+    """
+    if catalog is None or not os.path.exists(file_geojson):
+        return False
+    stamp = catalog.get(str(int(cod)), {}).get("portales")
+    return stamp is not None and stamp == geojson_stamp(file_geojson)
 
-        kd_tree_dic[cod] = KD_TREE_ROOT
-    except Exception as e:
-        return
 
 # --- MAIN FUNCTION ---
 def asociar_direcciones_a_puntos(complete_data, file_geojson, cod):
     """Associate the nearest address to each user-provided point.
 
     This function acts as the main orchestration layer of the workflow.
-    It ensures that a k-d tree is initialized for the specified code,
-    then iterates over a list of user points and enriches each point
-    with the nearest address information obtained from the k-d tree.
+    It ensures that a portal index is initialized for the specified
+    code, then matches the distinct locations of the user points
+    against it in a single batch query (see `PortalIndex.match`) and
+    enriches each point with the nearest address information.
 
     Address matching is performed using geodesic distance (WGS84)
-    and a nearest-neighbor search on a k-d tree.
+    and a nearest-neighbor search on the grid of `PortalIndex`.
 
     Args:
         complete_data (list[dict]): List of user-provided points.
@@ -399,12 +167,12 @@ def asociar_direcciones_a_puntos(complete_data, file_geojson, cod):
             - 'longitud' (float)
         file_geojson (str): Path to the GeoJSON file containing
             address point data.
-        cod (Hashable): Key used to identify and cache the k-d tree
-            instance.
+        cod (Hashable): Key used to identify and cache the portal
+            index instance.
 
     Side Effects:
-        - Initializes and caches a k-d tree in the global `kd_tree_dic`
-          dictionary if it does not already exist.
+        - Loads the portal index of the office into the portal index
+          cache if it is not there (see `get_portal_index`).
         - Mutates each dictionary in `complete_data` by adding
           address-related fields.
 
@@ -413,43 +181,46 @@ def asociar_direcciones_a_puntos(complete_data, file_geojson, cod):
         nearest address data. If initialization fails, a dictionary
         with an error description is returned.
     """
-    global kd_tree_dic
-    if cod not in kd_tree_dic:
-        print("Iniciando árbol binario")
-        initialize_global_tree(file_geojson, cod)
-        if cod not in kd_tree_dic:
-            return {"error": "Failure to initialize portal data"}
-
-    KD_TREE_ROOT = kd_tree_dic[cod]
-
-    for point in complete_data:
-        target_lat = point.get('latitud')
-        target_lon = point.get('longitud')
-        
-        if target_lat is not None and target_lon is not None:
-            
-            # Find nearest address using the k-d tree and geodesic distance
-            nearest_info = find_nearest_address(
-                KD_TREE_ROOT,
-                target_lat,
-                target_lon
-            )
-            
-            if nearest_info:
-                # Update point with nearest address information
-                point['distance'] = nearest_info['distance_meters']
-                point['street'] = nearest_info['street']
-                point['number'] = nearest_info['number']
-                point['post_code'] = nearest_info['post_code']
-                point['nearest_latitud'] = nearest_info['nearest_latitud']
-                point['nearest_longitud'] = nearest_info['nearest_longitud']
-            else:
-                # Case where no nearest neighbor is found
-                point['distance'] = 'N/A'
-                point['street'] = 'No encontrado'
-                point['number'] = 'N/A'
-                point['post_code'] = 'N/A'
-                point['nearest_latitud'] = 'N/A'
-                point['nearest_longitud'] = 'N/A'
-        
-    return complete_data
\ No newline at end of file
+    index = get_portal_index(file_geojson, cod)
+    if index is None:
+        return {"error": "Failure to initialize portal data"}
+
+    # Only points with both coordinates are matched
+    points = [
+        point for point in complete_data
+        if point.get('latitud') is not None and point.get('longitud') is not None
+    ]
+
+    # Find the nearest address of every distinct location in one batch query
+    nearest, distances = index.match(
+        [point['latitud'] for point in points],
+        [point['longitud'] for point in points],
+        tolerance=current_app.config.get("PORTAL_MATCH_TOLERANCE_METERS", 0)
+    )
+    found = nearest >= 0
+    safe = np.where(found, nearest, 0)
+    nearest_lat = index.latitud[safe].tolist()
+    nearest_lon = index.longitud[safe].tolist()
+    streets = index.street[safe].tolist()
+    numbers = index.number[safe].tolist()
+    post_codes = index.post_code[safe].tolist()
+
+    for i, point in enumerate(points):
+        if found[i]:
+            # Update point with nearest address information
+            point['distance'] = float(distances[i])
+            point['street'] = streets[i]
+            point['number'] = numbers[i]
+            point['post_code'] = post_codes[i]
+            point['nearest_latitud'] = nearest_lat[i]
+            point['nearest_longitud'] = nearest_lon[i]
+        else:
+            # Case where no nearest neighbor is found
+            point['distance'] = None
+            point['street'] = 'No encontrado'
+            point['number'] = 'N/A'
+            point['post_code'] = 'N/A'
+            point['nearest_latitud'] = None
+            point['nearest_longitud'] = None
+
+    return complete_data
@@ -14,18 +14,29 @@ index_bp = Blueprint('index', __name__, template_folder='templates')
 def visualize_data():
     uploaded = session.get('uploaded_files', {})
     api_url = current_app.config.get("API_URL")
-    data = {"id": session.get("id")}
+    data = {"id": session.get("id"), "format": "parquet"}
 
     response = requests.post(f"{api_url}/get_fichero_unificado", data=data)
     save_path=""
 
     if response.status_code == 200:
         upload_dir = current_app.config.get("UPLOAD_FOLDER")
-        save_path = os.path.join(upload_dir, session.get("id"), "Fichero_E.csv")
+        save_path = os.path.join(upload_dir, session.get("id"), "Fichero_E.parquet")
         with open(save_path, "wb") as f:
             f.write(response.content)
         uploaded["E"] = save_path
         current_app.logger.info("Se ha descargado el fichero unificado")
+
+        # Catalogo oficinas -> PDAs -> fechas (solo existe si se ha creado el fichero E)
+        uploaded.pop("catalog", None)
+        response = requests.post(f"{api_url}/get_catalogo", data={"id": session.get("id")})
+        if response.status_code == 200:
+            catalog_path = os.path.join(upload_dir, session.get("id"), "Fichero_E_catalogo.json")
+            with open(catalog_path, "wb") as f:
+                f.write(response.content)
+            uploaded["catalog"] = catalog_path
+            current_app.logger.info("Se ha descargado el catalogo del fichero unificado")
+        session["uploaded_files"] = uploaded
     else:
         current_app.logger.error("Error:", response.text)
 
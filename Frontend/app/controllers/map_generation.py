@@ -1,5 +1,6 @@
 from flask import current_app, session
 from .util import parse_coord
+from .dataset_cache import get_session_rows
 import folium, statistics, os, json
 import pandas as pd
 import numpy as np
@@ -49,18 +50,13 @@ def save_map(cod, pda, fecha, map):
 
 def create_map(cod, pda, fecha_ini, fecha_fin):
     """Crea un archivo html temporal con el mapa y agrega la dirección a la sesion"""
-    # Obtener fichero
-    uploaded = session.get('uploaded_files', {})
-    path = uploaded.get('E')
-    
-    # Abrir fichero
+    # Filas de la oficina (rango contiguo del fichero E cacheado)
     try:
-        df = pd.read_csv(path, delimiter=';', low_memory=False)
+        df = get_session_rows(cod)
     except Exception as e:
         current_app.logger.error(f"Error al leer el archivo CSV: {e}")
         return []
     
-    df = df[df['cod_unidad'] == int(cod)]
     current_app.logger.info(f"Encontrados {len(df)} en la oficina {cod}")
 
     if (pda == "TODAS"):
@@ -99,12 +95,7 @@ def create_map(cod, pda, fecha_ini, fecha_fin):
         current_app.logger.info(f"Buscando fecha especifica en el df")
 
         # Filtrar por PDA y fecha (ignorando hora)
-        df_aux = df[df['cod_pda'] == pda_unica].copy()
-
-        df_aux = df_aux[
-            (df_aux['solo_fecha'] >= fecha_ini) &
-            (df_aux['solo_fecha'] <= fecha_fin)
-        ].copy()
+        df_aux = get_session_rows(cod, pda_unica, fecha_ini, fecha_fin)
 
         dias = df_aux['solo_fecha'].unique()
         for dia in dias:
@@ -113,7 +104,7 @@ def create_map(cod, pda, fecha_ini, fecha_fin):
             else:
                 ruta_color = color_map[dia]
 
-            df_filtrado = df_aux[df_aux['solo_fecha'] == dia].copy()
+            df_filtrado = get_session_rows(cod, pda_unica, dia).copy()
             if df_filtrado.empty:
                 current_app.logger.error(f"No hay datos para PDA={pda_unica} y fecha={dia}")
                 continue
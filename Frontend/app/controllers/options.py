@@ -1,5 +1,5 @@
 from flask import Blueprint, request, current_app, session, jsonify
-import pandas as pd
+from .dataset_cache import get_session_dataset, get_session_catalog
 import numpy as np
 import os
 
@@ -28,9 +28,15 @@ def get_unit_code():
         current_app.logger.warning("Ruta de Fichero E no disponible o archivo no encontrado en disco.")
         return jsonify({'codireds': [], 'error': 'Ruta de Fichero E no disponible o no válido.'})
 
+    catalog = get_session_catalog()
+    if catalog is not None:
+        cods = sorted(int(cod) for cod in catalog)
+        current_app.logger.info(f"Se han encontrado {len(cods)} códigos de oficinas en el catálogo")
+        return jsonify({'codireds' : cods})
+
     try:
         current_app.logger.info(f"Abriendo fichero E desde: {path}")
-        df = pd.read_csv(path, delimiter=';', low_memory=False)
+        df = get_session_dataset("E", columns=['cod_unidad'])
         
     except Exception as e:
         current_app.logger.error(f"Error al leer el archivo CSV: {e}")
@@ -57,19 +63,25 @@ def get_pdas_per_unit_code():
     uploaded = session.get('uploaded_files', {})
     path = uploaded.get('E')
     current_app.logger.info("Abriendo fichero E")
+    if not path or not cod:
+        return jsonify({'pdas': []})
+
+    catalog = get_session_catalog()
+    if catalog is not None:
+        pdas = sorted(catalog.get(str(int(cod)), {}).get("pdas", {}))
+        current_app.logger.info(f"Se han encontrado {len(pdas)} pdas en la oficina {cod} en el catálogo")
+        return jsonify({'pdas': pdas})
+
     try:
-        df = pd.read_csv(path, delimiter=';', low_memory=False)
+        df = get_session_dataset("E", columns=['cod_unidad', 'cod_pda'])
     except Exception as e:
         print(f"Error al leer el archivo CSV: {e}")
         return []
-
-    if not path or not cod:
-        return jsonify({'pdas': []})
     
     current_app.logger.info(f"Buscando regsitros perteneciente a la oficina {cod}")
     df = df[df['cod_unidad'] == int(cod)]
     current_app.logger.info(f"Se han encotrado {len(df)} registros de la oficina {cod}")
-    pdas = df['cod_pda'].dropna().unique()
+    pdas = df['cod_pda'].dropna().unique().astype(str)
     pdas = np.sort(pdas).tolist()
     current_app.logger.info(f"Se han encontrado {len(pdas)} pdas en la oficina {cod}")
     return jsonify({'pdas': pdas})
@@ -83,15 +95,21 @@ def get_dates_per_pda_and_unit_code():
     unit_code = request.args.get('unit_code')
     uploaded = session.get('uploaded_files', {})
     path = uploaded.get('E')
+    if not path or not pda:
+        return jsonify({'fechas': []})
+
+    catalog = get_session_catalog()
+    if catalog is not None:
+        fechas = get_dates_from_catalog(catalog, pda, unit_code)
+        current_app.logger.info(f"fechas encontradas en {unit_code} para {pda}:\n{fechas}")
+        return jsonify({'fechas': fechas})
+
     try:
-        df = pd.read_csv(path, delimiter=';', low_memory=False)
+        df = get_session_dataset("E", columns=['cod_unidad', 'cod_pda', 'solo_fecha'])
     except Exception as e:
         print(f"Error al leer el archivo CSV: {e}")
         return []
 
-    if not path or not pda:
-        return jsonify({'fechas': []})
-
     if pda == "TODAS":
         fechas = get_dates_for_all_pdas(df, unit_code)
     else:
@@ -117,4 +135,13 @@ def get_dates_per_pda(df, pda, unit_code):
 
 def get_dates_for_all_pdas(df, unit_code):
     df_filtered = df[df['cod_unidad'] == int(unit_code)]
-    return (sorted(df_filtered['solo_fecha'].dropna().unique()))
\ No newline at end of file
+    return (sorted(df_filtered['solo_fecha'].dropna().unique()))
+
+
+
+
+def get_dates_from_catalog(catalog, pda, unit_code):
+    unit = catalog.get(str(int(unit_code)), {})
+    if pda == "TODAS":
+        return unit.get("dates", [])
+    return sorted(unit.get("pdas", {}).get(pda, {}).get("dates", {}))
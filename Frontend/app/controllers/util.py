@@ -1,3 +1,8 @@
+from shared.coordinates import decimal_coordinates
+import numpy as np
+import pandas as pd
+
+
 
 def parse_coord(value):
     if value is None:
@@ -25,4 +30,36 @@ def parse_coord(value):
         raise ValueError(f"Coordenada inválida: {value}")
 
     s_fixed = s_clean[:2] + '.' + s_clean[2:]
-    return float(s_fixed)
\ No newline at end of file
+    return float(s_fixed)
+
+
+
+def parse_coords(values):
+    """Vectorized ``parse_coord`` for a whole column of coordinates.
+
+    Float32 columns (as stored in the datasets) take the decimal value
+    of each coordinate, the same as the backend (see
+    ``decimal_coordinates``). Values that already are valid numbers
+    (with '.' or ',' as decimal separator) are converted in a single
+    pass; only the malformed ones go through ``parse_coord``.
+
+    Args:
+        values (pandas.Series): Column of coordinates.
+
+    Returns:
+        pandas.Series: Coordinates as float.
+    """
+    if values.dtype == np.float32:
+        return pd.Series(decimal_coordinates(values.to_numpy()), index=values.index)
+
+    text = values.astype(str).str.strip()
+    coords = pd.to_numeric(text, errors='coerce')
+
+    pending = coords.isna()
+    coords[pending] = pd.to_numeric(text[pending].str.replace(',', '.', regex=False), errors='coerce')
+
+    pending = coords.isna() & values.notna()
+    if pending.any():
+        coords[pending] = values[pending].map(parse_coord)
+
+    return coords
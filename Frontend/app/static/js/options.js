@@ -624,9 +624,9 @@ document.addEventListener("DOMContentLoaded", () => {
                 // === Actualizar los resultados del resumen ===
                 const resumen = data.resumen;
                 document.getElementById('res-puntos').textContent = resumen.puntos_totales;
-                document.getElementById('res-distancia').textContent = resumen.distancia_total;
-                document.getElementById('res-tiempo').textContent = resumen.tiempo_total;
-                document.getElementById('res-velocidad').textContent = resumen.velocidad_media;
+                document.getElementById('res-distancia').textContent = `${Number(resumen.distancia_total).toFixed(2)} km`;
+                document.getElementById('res-tiempo').textContent = `${resumen.tiempo_total} min`;
+                document.getElementById('res-velocidad').textContent = `${Number(resumen.velocidad_media).toFixed(2)} km/h`;
                 const segundos = (t_fin - t_inicio) / 1000;
                 document.getElementById('res-t-ejecucion').textContent = `${segundos.toFixed(3)} s`;
 
@@ -792,9 +792,9 @@ document.addEventListener("DOMContentLoaded", () => {
                 
                 // if (resumen){
                 //     document.getElementById('res-puntos').textContent = resumen.puntos_totales;
-                //     document.getElementById('res-distancia').textContent = resumen.distancia_total;
-                //     document.getElementById('res-tiempo').textContent = resumen.tiempo_total;
-                //     document.getElementById('res-velocidad').textContent = resumen.velocidad_media;
+                //     document.getElementById('res-distancia').textContent = `${Number(resumen.distancia_total).toFixed(2)} km`;
+                //     document.getElementById('res-tiempo').textContent = `${resumen.tiempo_total} min`;
+                //     document.getElementById('res-velocidad').textContent = `${Number(resumen.velocidad_media).toFixed(2)} km/h`;
                 // }
         
                 // === Guardar los datos globalmente y renderizar ===
@@ -11,6 +11,13 @@ class Config:
     PERMANENT_SESSION_LIFETIME = timedelta(minutes=55)
     SESSION_REFRESH_EACH_REQUEST = True
     API_URL = 'http://0.0.0.0:5001'
+    # Memoria maxima (bytes) de los ficheros E cacheados entre peticiones
+    DATASET_CACHE_MAX_BYTES = int(os.environ.get('DATASET_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+    # Memoria maxima (bytes) de los indices de portales cacheados por oficina
+    PORTAL_INDEX_CACHE_MAX_BYTES = int(os.environ.get('PORTAL_INDEX_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+    # Lado (metros) de la rejilla con la que se agrupan puntos GPS cercanos antes de
+    # buscar su portal. Con 0 solo se agrupan coordenadas identicas
+    PORTAL_MATCH_TOLERANCE_METERS = float(os.environ.get('PORTAL_MATCH_TOLERANCE_METERS', 0))
 
 class DevConfig(Config):
     DEBUG = True
@@ -0,0 +1,22 @@
+import numpy as np
+
+
+# Coordinates of the GPS points, stored as float32 in the datasets. Both the
+# backend and the frontend compute with the decimal value of each coordinate.
+
+
+def decimal_coordinates(values):
+    """Float64 value of the decimal text of float32 coordinates.
+
+    A float32 coordinate such as 40.4168 is 40.41680145263672 when cast
+    to float64. The shortest text of the float32 value ('40.4168') is
+    parsed instead, so the coordinate is the number that was read from
+    the original file.
+
+    Args:
+        values (array-like): Coordinates. Missing values (NaN) are allowed.
+
+    Returns:
+        numpy.ndarray: Coordinates as float64, NaN if missing.
+    """
+    return np.asarray(values, dtype=np.float32).astype(str).astype(np.float64)
@@ -0,0 +1,41 @@
+import pandas as pd
+import numpy as np
+
+
+# Text of the day numbers and seconds since midnight used to store dates and
+# times (solo_fecha, solo_hora), shared by the backend and the frontend.
+
+
+def format_dates(days):
+    """Text (YYYY-MM-DD) of day numbers since 1970-01-01.
+
+    Each distinct day is converted once.
+
+    Args:
+        days (array-like): Day numbers. Missing values (NaN) are allowed.
+
+    Returns:
+        numpy.ndarray: Text of each value (object array), None if missing.
+    """
+    codes, uniques = pd.factorize(np.asarray(days))
+    text = np.datetime_as_string(np.asarray(uniques, dtype=np.int64).astype("datetime64[D]"), unit="D")
+    # Code -1 (missing) takes the last element
+    return np.append(text.astype(object), None)[codes]
+
+
+def format_times(seconds):
+    """Text (HH:MM:SS) of seconds since midnight.
+
+    Each distinct time is converted once.
+
+    Args:
+        seconds (array-like): Seconds since midnight. Missing values
+            (NaN) are allowed.
+
+    Returns:
+        numpy.ndarray: Text of each value (object array), None if missing.
+    """
+    codes, uniques = pd.factorize(np.asarray(seconds))
+    text = [f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in np.asarray(uniques, dtype=np.int64).tolist()]
+    # Code -1 (missing) takes the last element
+    return np.array(text + [None], dtype=object)[codes]
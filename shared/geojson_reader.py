@@ -0,0 +1,177 @@
+from .portal_store import StringColumn
+import numpy as np
+import json
+
+
+# Characters read from the file at a time
+CHUNK_SIZE = 1 << 20
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+class _Buffer:
+    """Text of a file read incrementally, consumed from the front."""
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def _read_more(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Drop the consumed text before growing the buffer
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non-whitespace character (not consumed), or '' at the end."""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self._read_more():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"GeoJSON no valido: se esperaba '{char}' en la posicion {self.pos}")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next JSON value, reading more text until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if self.eof or not self._read_more():
+                    raise
+                continue
+            # A number may continue in the next chunk
+            if end == len(self.text) and not self.eof and isinstance(value, (int, float)) and self._read_more():
+                continue
+            self.pos = end
+            return value
+
+
+class _StringColumnBuilder:
+    """Appends strings as UTF-8 bytes plus offsets, growing the offsets array as needed."""
+
+    def __init__(self, capacity):
+        self.data = bytearray()
+        self.offsets = np.zeros(capacity + 1, dtype=np.int64)
+        self.size = 0
+
+    def append(self, value):
+        if self.size + 1 == len(self.offsets):
+            self.offsets = np.resize(self.offsets, 2 * len(self.offsets))
+        self.data += ("" if value is None else str(value)).encode("utf-8")
+        self.size += 1
+        self.offsets[self.size] = len(self.data)
+
+    def build(self):
+        return StringColumn(np.frombuffer(bytes(self.data), dtype=np.uint8), self.offsets[:self.size + 1].copy())
+
+
+class GeoJSONPoints:
+    """Columnar content of the point features of a GeoJSON file.
+
+    Attributes:
+        latitud (numpy.ndarray): Latitude of each point.
+        longitud (numpy.ndarray): Longitude of each point.
+        street (StringColumn): `street` property of each point.
+        number (StringColumn): `number` property of each point.
+        post_code (StringColumn): `postcode` property of each point.
+    """
+
+    def __init__(self, latitud, longitud, street, number, post_code):
+        self.latitud = latitud
+        self.longitud = longitud
+        self.street = street
+        self.number = number
+        self.post_code = post_code
+
+    def __len__(self):
+        return len(self.latitud)
+
+
+def read_geojson_points(path, chunk_size=CHUNK_SIZE):
+    """Read the point features of a GeoJSON FeatureCollection incrementally.
+
+    The file is read in chunks and the `features` array is decoded one
+    feature at a time, straight into coordinate arrays and string
+    columns, so neither the whole document nor the list of features is
+    ever held in memory. Only features with 2D coordinates
+    (`[longitude, latitude]`) are kept.
+
+    Args:
+        path (str): Path to the GeoJSON file.
+        chunk_size (int, optional): Characters read at a time.
+
+    Returns:
+        GeoJSONPoints: Coordinates and address properties of the points.
+
+    Raises:
+        ValueError: If the file is not a valid GeoJSON object.
+    """
+    capacity = 1024
+    latitud = np.empty(capacity)
+    longitud = np.empty(capacity)
+    street = _StringColumnBuilder(capacity)
+    number = _StringColumnBuilder(capacity)
+    post_code = _StringColumnBuilder(capacity)
+    size = 0
+
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = _Buffer(f, chunk_size)
+        buffer.expect("{")
+        while buffer.peek() != "}":
+            key = buffer.value()
+            buffer.expect(":")
+            if key != "features":
+                # Other members (type, crs, ...) are small: skip them
+                buffer.value()
+            else:
+                buffer.expect("[")
+                while buffer.peek() != "]":
+                    feature = buffer.value()
+                    if buffer.peek() == ",":
+                        buffer.pos += 1
+
+                    coords = (feature.get('geometry') or {}).get('coordinates', [])
+                    if len(coords) != 2:
+                        continue
+
+                    if size == capacity:
+                        capacity *= 2
+                        latitud = np.resize(latitud, capacity)
+                        longitud = np.resize(longitud, capacity)
+                    # GeoJSON coordinates are in [longitude, latitude] order
+                    longitud[size] = coords[0]
+                    latitud[size] = coords[1]
+                    data = feature.get('properties') or {}
+                    street.append(data.get('street', ""))
+                    number.append(data.get('number', ""))
+                    post_code.append(data.get('postcode', ""))
+                    size += 1
+                buffer.expect("]")
+
+            if buffer.peek() == ",":
+                buffer.pos += 1
+        buffer.expect("}")
+
+    return GeoJSONPoints(
+        latitud[:size].copy(),
+        longitud[:size].copy(),
+        street.build(),
+        number.build(),
+        post_code.build()
+    )
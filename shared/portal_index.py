@@ -0,0 +1,685 @@
+from pyproj import Geod
+from .portal_store import StringColumn, write_arrays, read_arrays
+from .geojson_reader import read_geojson_points
+import pandas as pd
+import numpy as np
+import os
+
+
+# Portal index shared by the backend (portals of every row of Fichero_E)
+# and the frontend (portals of the routes and clusters of a query).
+
+g = Geod(ellps='WGS84')
+
+# WGS84 semi-major axis (m) and squared eccentricity
+WGS84_A = 6378137.0
+WGS84_E2 = 0.00669437999014
+
+
+def geojson_stamp(file_geojson):
+    """Size and modification time of a GeoJSON file, used to detect stale indexes."""
+    stat = os.stat(file_geojson)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class PortalIndex:
+    """Flat, array-backed spatial index over the portal coordinates.
+
+    Coordinates are projected to a local equirectangular plane (in
+    meters) centred on the office, so distances and pruning bounds are
+    metric in both axes. Portals are bucketed in a regular grid of that
+    plane stored in CSR form: the portal indices sorted by cell (`order`)
+    and the offset of each cell in that array (`cell_start`).
+    Nearest-neighbor queries are answered for many points at once,
+    scanning rings of cells around every query point until no unscanned
+    cell can hold a closer portal. The exact geodesic distance (WGS84,
+    `pyproj.Geod.inv`) is only computed for the final candidates.
+
+    Attributes:
+        latitud (numpy.ndarray): Latitude of each portal.
+        longitud (numpy.ndarray): Longitude of each portal.
+        street (StringColumn): Street name of each portal.
+        number (StringColumn): Street number of each portal.
+        post_code (StringColumn): Postal code of each portal.
+        x (numpy.ndarray): Projected x coordinate of each portal (m).
+        y (numpy.ndarray): Projected y coordinate of each portal (m).
+        cell_size (float): Side of the grid cells, in meters.
+        order (numpy.ndarray): Portal indices sorted by grid cell.
+        cell_start (numpy.ndarray): Offset in `order` of the first
+            portal of each cell (plus a final end offset).
+        memo (dict): Locations already matched by `match`, per
+            tolerance: sorted location keys and the nearest portal and
+            distance of each one, as arrays.
+    """
+
+    # Average number of portals per grid cell
+    POINTS_PER_CELL = 4
+
+    # Locations remembered by `match` before the memo is cleared, and
+    # bytes per location (complex key, portal index and distance)
+    MEMO_MAX_ENTRIES = 200_000
+    MEMO_ENTRY_BYTES = 32
+
+    # Queries with a larger projection error (e.g. bad GPS fixes far from
+    # the office) are measured against every portal instead of the grid
+    MAX_DISTORTION = 0.5
+
+    def __init__(self, latitud, longitud, street, number, post_code):
+        """Project the portals and build the grid over them.
+
+        Args:
+            latitud (array-like): Latitude of each portal.
+            longitud (array-like): Longitude of each portal.
+            street (array-like | StringColumn): Street name of each portal.
+            number (array-like | StringColumn): Street number of each portal.
+            post_code (array-like | StringColumn): Postal code of each portal.
+
+        The address fields are stored as strings (None becomes '').
+        """
+        self.latitud = np.asarray(latitud, dtype=np.float64)
+        self.longitud = np.asarray(longitud, dtype=np.float64)
+        self.street = street if isinstance(street, StringColumn) else StringColumn.from_strings(street)
+        self.number = number if isinstance(number, StringColumn) else StringColumn.from_strings(number)
+        self.post_code = post_code if isinstance(post_code, StringColumn) else StringColumn.from_strings(post_code)
+
+        # Local projection centred on the portals
+        self.lat_c = (self.latitud.min() + self.latitud.max()) / 2
+        self.lon_c = (self.longitud.min() + self.longitud.max()) / 2
+        sin_c = np.sin(np.radians(self.lat_c))
+        w = np.sqrt(1 - WGS84_E2 * sin_c ** 2)
+        self.m_per_rad_lat = WGS84_A * (1 - WGS84_E2) / w ** 3
+        self.m_per_rad_lon = WGS84_A / w * np.cos(np.radians(self.lat_c))
+        self.x, self.y = self.project(self.latitud, self.longitud)
+
+        self.x0 = self.x.min()
+        self.y0 = self.y.min()
+        span_x = self.x.max() - self.x0
+        span_y = self.y.max() - self.y0
+        num_cells = max(len(self.x) / self.POINTS_PER_CELL, 1)
+        self.cell_size = max(
+            np.sqrt(span_x * span_y / num_cells),
+            max(span_x, span_y) / num_cells,
+            0.1
+        )
+        self.n_rows = int(span_y // self.cell_size) + 1
+        self.n_cols = int(span_x // self.cell_size) + 1
+
+        rows, cols = self._cell_of(self.x, self.y)
+        cell_ids = rows * self.n_cols + cols
+        self.order = np.argsort(cell_ids, kind='stable')
+        self.cell_start = np.searchsorted(
+            cell_ids[self.order],
+            np.arange(self.n_rows * self.n_cols + 1)
+        )
+        self.memo = {}
+
+    # Attributes written to disk by `save`
+    SAVED_VALUES = ("lat_c", "lon_c", "m_per_rad_lat", "m_per_rad_lon", "x0", "y0", "cell_size", "n_rows", "n_cols")
+    SAVED_ARRAYS = ("latitud", "longitud", "x", "y", "order", "cell_start")
+    SAVED_STRINGS = ("street", "number", "post_code")
+
+    def save(self, path, source=None):
+        """Write the index to a binary file that `load` memory maps.
+
+        Args:
+            path (str): Destination path.
+            source (dict | None, optional): Stamp of the file the index
+                was built from, used by `load` to detect stale files.
+        """
+        values = {name: getattr(self, name) for name in self.SAVED_VALUES}
+        values = {name: value.item() if isinstance(value, np.generic) else value for name, value in values.items()}
+        values["source"] = source
+        arrays = {name: getattr(self, name) for name in self.SAVED_ARRAYS}
+        for name in self.SAVED_STRINGS:
+            arrays[f"{name}_data"] = getattr(self, name).data
+            arrays[f"{name}_offsets"] = getattr(self, name).offsets
+        write_arrays(path, values, arrays)
+
+    @classmethod
+    def load(cls, path, source=None):
+        """Load an index written by `save`, memory mapping its arrays.
+
+        The arrays are not copied into the process: every worker that
+        loads the same file shares its pages through the OS page cache.
+
+        Args:
+            path (str): Path to the index file.
+            source (dict | None, optional): Expected stamp of the source
+                file. If given and different from the stored one, the
+                file is considered stale.
+
+        Returns:
+            PortalIndex | None: The index, or None if the file is
+            missing, invalid or stale.
+        """
+        stored = read_arrays(path)
+        if stored is None:
+            return None
+        values, arrays = stored
+        if source is not None and values.get("source") != source:
+            return None
+
+        index = cls.__new__(cls)
+        for name in cls.SAVED_VALUES:
+            setattr(index, name, values[name])
+        for name in cls.SAVED_ARRAYS:
+            setattr(index, name, arrays[name])
+        for name in cls.SAVED_STRINGS:
+            setattr(index, name, StringColumn(arrays[f"{name}_data"], arrays[f"{name}_offsets"]))
+        index.memo = {}
+        return index
+
+    def __len__(self):
+        return len(self.latitud)
+
+    @property
+    def nbytes(self):
+        """Memory used by the index, in bytes.
+
+        Covers the arrays of the index and the largest size the memo of
+        `match` can reach, so callers that record the size once (e.g.
+        a cache) also account for the memo filled afterwards.
+        """
+        arrays = [getattr(self, name) for name in self.SAVED_ARRAYS]
+        for name in self.SAVED_STRINGS:
+            arrays += [getattr(self, name).data, getattr(self, name).offsets]
+        return int(sum(array.nbytes for array in arrays)) + self.MEMO_MAX_ENTRIES * self.MEMO_ENTRY_BYTES
+
+    def project(self, latitud, longitud):
+        """Project coordinates to the local plane of the index.
+
+        Args:
+            latitud (numpy.ndarray): Latitudes, in degrees.
+            longitud (numpy.ndarray): Longitudes, in degrees.
+
+        Returns:
+            tuple[numpy.ndarray, numpy.ndarray]: x and y, in meters.
+        """
+        x = np.radians(longitud - self.lon_c) * self.m_per_rad_lon
+        y = np.radians(latitud - self.lat_c) * self.m_per_rad_lat
+        return x, y
+
+    def distortion(self, latitud):
+        """Maximum relative error of projected distances from each query latitude to the portals.
+
+        The east-west scale of the projection is exact at the centre
+        latitude and drifts with cos(latitud) away from it, so the bound
+        of each query covers its own latitude and those of the portals.
+
+        Args:
+            latitud (numpy.ndarray): Latitude of each query, in degrees.
+
+        Returns:
+            numpy.ndarray: Relative error bound of each query.
+        """
+        cos_c = np.cos(np.radians(self.lat_c))
+        cos_extent = np.cos(np.radians([self.latitud.min(), self.latitud.max()]))
+        extent = np.abs(cos_extent / cos_c - 1).max()
+        return np.maximum(np.abs(np.cos(np.radians(latitud)) / cos_c - 1), extent) + 1e-3
+
+    def _geodesic_to_all(self, latitud, longitud):
+        """Geodesic distance (m) from one point to every portal."""
+        n = len(self)
+        _, _, dist = g.inv(np.full(n, longitud), np.full(n, latitud), self.longitud, self.latitud)
+        return np.asarray(dist, dtype=np.float64)
+
+    def _cell_of(self, x, y):
+        """Grid row and column of each point (clipped to the grid)."""
+        rows = np.clip((y - self.y0) // self.cell_size, 0, self.n_rows - 1).astype(np.int64)
+        cols = np.clip((x - self.x0) // self.cell_size, 0, self.n_cols - 1).astype(np.int64)
+        return rows, cols
+
+    def _ring_candidates(self, rows, cols, ring):
+        """Portals in the cells at Chebyshev distance `ring` of each query cell.
+
+        Args:
+            rows (numpy.ndarray): Grid row of each query.
+            cols (numpy.ndarray): Grid column of each query.
+            ring (int): Distance, in cells, of the ring to scan.
+
+        Returns:
+            tuple[numpy.ndarray, numpy.ndarray]: Position of the query
+            and index of the portal of every (query, candidate) pair.
+        """
+        if ring == 0:
+            d_rows = np.zeros(1, dtype=np.int64)
+            d_cols = np.zeros(1, dtype=np.int64)
+        else:
+            side = np.arange(-ring, ring + 1)
+            inner = side[1:-1]
+            d_rows = np.concatenate([np.full(len(side), -ring), np.full(len(side), ring), inner, inner])
+            d_cols = np.concatenate([side, side, np.full(len(inner), -ring), np.full(len(inner), ring)])
+
+        cand_rows = rows[:, None] + d_rows[None, :]
+        cand_cols = cols[:, None] + d_cols[None, :]
+        valid = (
+            (cand_rows >= 0) & (cand_rows < self.n_rows) &
+            (cand_cols >= 0) & (cand_cols < self.n_cols)
+        )
+        query_pos = np.nonzero(valid)[0]
+        cells = cand_rows[valid] * self.n_cols + cand_cols[valid]
+        starts = self.cell_start[cells]
+        counts = self.cell_start[cells + 1] - starts
+
+        total = counts.sum()
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        portals = self.order[np.repeat(starts, counts) + offsets]
+        return np.repeat(query_pos, counts), portals
+
+    def query_nearest(self, latitud, longitud, refine=True):
+        """Find the nearest portal to every query point.
+
+        The search runs in the projected plane, where the grid gives
+        exact pruning bounds. With `refine`, every portal whose projected
+        distance is within the distortion of the projection of the best
+        one is measured with the exact geodesic, so the result is the
+        geodesic nearest portal (usually a single candidate per query).
+        Without it, only the projected nearest portal is measured.
+
+        Args:
+            latitud (array-like): Latitude of each query point.
+            longitud (array-like): Longitude of each query point.
+            refine (bool, optional): Resolve near ties with the exact
+                geodesic distance. Defaults to True.
+
+        Returns:
+            tuple[numpy.ndarray, numpy.ndarray]: Index of the nearest
+            portal (-1 if there is none) and geodesic distance to it in
+            meters (inf if there is none), for each query point. Points
+            with missing coordinates get no portal.
+        """
+        latitud = np.asarray(latitud, dtype=np.float64)
+        longitud = np.asarray(longitud, dtype=np.float64)
+        best_idx = np.full(len(latitud), -1, dtype=np.int64)
+        best_dist = np.full(len(latitud), np.inf)
+
+        valid = np.flatnonzero(np.isfinite(latitud) & np.isfinite(longitud))
+        if len(self) == 0 or len(valid) == 0:
+            return best_idx, best_dist
+
+        x, y = self.project(latitud[valid], longitud[valid])
+        rows, cols = self._cell_of(x, y)
+
+        # Portals closer than best * ratio (projected) may be the geodesic nearest
+        eps = self.distortion(latitud[valid]) if refine else np.zeros(len(valid))
+        exact = eps > self.MAX_DISTORTION
+        ratio = (1 + eps) / (1 - np.minimum(eps, self.MAX_DISTORTION))
+
+        # Distance (in cells) from each query to the closest edge of its own cell
+        pos_rows = (y - self.y0) / self.cell_size - rows
+        pos_cols = (x - self.x0) / self.cell_size - cols
+        margin = np.clip(np.minimum.reduce([pos_rows, 1 - pos_rows, pos_cols, 1 - pos_cols]), 0, None)
+
+        best_proj = np.full(len(valid), np.inf)
+        found_pos, found_portals, found_dist = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0)]
+        active = np.flatnonzero(~exact)
+
+        ring = 0
+        max_ring = max(self.n_rows, self.n_cols)
+        while len(active) > 0 and ring <= max_ring:
+            query_pos, portals = self._ring_candidates(rows[active], cols[active], ring)
+            query_pos = active[query_pos]
+
+            if len(query_pos) > 0:
+                dist = np.hypot(self.x[portals] - x[query_pos], self.y[portals] - y[query_pos])
+                np.minimum.at(best_proj, query_pos, dist)
+                keep = dist <= best_proj[query_pos] * ratio[query_pos]
+                found_pos.append(query_pos[keep])
+                found_portals.append(portals[keep])
+                found_dist.append(dist[keep])
+
+            # Unscanned cells are at least `ring` cells plus the margin away
+            reach = (ring + margin[active]) * self.cell_size
+            active = active[best_proj[active] * ratio[active] > reach]
+            ring += 1
+
+        # Candidates that can still be the nearest one
+        query_pos = np.concatenate(found_pos)
+        portals = np.concatenate(found_portals)
+        dist = np.concatenate(found_dist)
+        keep = dist <= best_proj[query_pos] * ratio[query_pos]
+        if not refine:
+            keep &= dist == best_proj[query_pos]
+        query_pos, portals = query_pos[keep], portals[keep]
+
+        # Exact geodesic distance, only for the final candidates
+        targets = valid[query_pos]
+        _, _, geo_dist = g.inv(longitud[targets], latitud[targets], self.longitud[portals], self.latitud[portals])
+        geo_dist = np.asarray(geo_dist, dtype=np.float64)
+
+        # Queries with a large projection error: nearest of every portal
+        exact_pos = np.flatnonzero(exact)
+        if len(exact_pos) > 0:
+            exact_portals = np.empty(len(exact_pos), dtype=np.int64)
+            exact_dist = np.empty(len(exact_pos))
+            for i, pos in enumerate(exact_pos.tolist()):
+                dist_all = self._geodesic_to_all(latitud[valid[pos]], longitud[valid[pos]])
+                exact_portals[i] = np.argmin(dist_all)
+                exact_dist[i] = dist_all[exact_portals[i]]
+            query_pos = np.concatenate([query_pos, exact_pos])
+            portals = np.concatenate([portals, exact_portals])
+            geo_dist = np.concatenate([geo_dist, exact_dist])
+
+        sort = np.lexsort((geo_dist, query_pos))
+        query_pos, portals, geo_dist = query_pos[sort], portals[sort], geo_dist[sort]
+        first = np.ones(len(query_pos), dtype=bool)
+        first[1:] = query_pos[1:] != query_pos[:-1]
+
+        targets = valid[query_pos[first]]
+        best_idx[targets] = portals[first]
+        best_dist[targets] = geo_dist[first]
+        return best_idx, best_dist
+
+    def _to_csr(self, n, query_pos, portals, dist):
+        """Group (query, portal, distance) triples by query, nearest first.
+
+        Returns:
+            tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]: `offsets`
+            (length n + 1), `indices` and `distances`, where the portals
+            of query i are `indices[offsets[i]:offsets[i + 1]]`.
+        """
+        sort = np.lexsort((portals, dist, query_pos))
+        query_pos, portals, dist = query_pos[sort], portals[sort], dist[sort]
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(query_pos, minlength=n), out=offsets[1:])
+        return offsets, portals.astype(np.int64), dist.astype(np.float64)
+
+    def query_radius(self, latitud, longitud, radius):
+        """Find every portal within `radius` meters of each query point.
+
+        All the cells that can hold a portal at that distance (taking
+        into account the distortion of the projection) are scanned at
+        once, and the exact geodesic distance is computed for the
+        portals inside the projected radius.
+
+        Args:
+            latitud (array-like): Latitude of each query point.
+            longitud (array-like): Longitude of each query point.
+            radius (float): Search radius, in meters.
+
+        Returns:
+            tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]: CSR
+            arrays `offsets`, `indices` and `distances` (geodesic, in
+            meters). The portals of query i, sorted by distance, are
+            `indices[offsets[i]:offsets[i + 1]]`. Points with missing
+            coordinates get no portals.
+        """
+        latitud = np.asarray(latitud, dtype=np.float64)
+        longitud = np.asarray(longitud, dtype=np.float64)
+        empty = np.zeros(0, dtype=np.int64)
+
+        valid = np.flatnonzero(np.isfinite(latitud) & np.isfinite(longitud))
+        if len(self) == 0 or len(valid) == 0 or radius < 0:
+            return self._to_csr(len(latitud), empty, empty, np.zeros(0))
+
+        x, y = self.project(latitud[valid], longitud[valid])
+        rows, cols = self._cell_of(x, y)
+
+        # Projected distances are at most (1 + eps) times the geodesic ones
+        eps = self.distortion(latitud[valid])
+        exact = eps > self.MAX_DISTORTION
+        reach = radius * (1 + eps)
+        max_ring = np.minimum(np.ceil(reach / self.cell_size), max(self.n_rows, self.n_cols)).astype(np.int64)
+        max_ring[exact] = -1
+
+        found_pos, found_portals = [empty], [empty]
+        for ring in range(int(max_ring.max()) + 1):
+            active = np.flatnonzero(max_ring >= ring)
+            query_pos, portals = self._ring_candidates(rows[active], cols[active], ring)
+            query_pos = active[query_pos]
+            dist = np.hypot(self.x[portals] - x[query_pos], self.y[portals] - y[query_pos])
+            keep = dist <= reach[query_pos]
+            found_pos.append(query_pos[keep])
+            found_portals.append(portals[keep])
+        query_pos = np.concatenate(found_pos)
+        portals = np.concatenate(found_portals)
+
+        targets = valid[query_pos]
+        _, _, geo_dist = g.inv(longitud[targets], latitud[targets], self.longitud[portals], self.latitud[portals])
+        geo_dist = np.asarray(geo_dist, dtype=np.float64)
+
+        # Queries with a large projection error: every portal is measured
+        for pos in np.flatnonzero(exact).tolist():
+            dist_all = self._geodesic_to_all(latitud[valid[pos]], longitud[valid[pos]])
+            targets = np.concatenate([targets, np.full(len(self), valid[pos])])
+            portals = np.concatenate([portals, np.arange(len(self))])
+            geo_dist = np.concatenate([geo_dist, dist_all])
+        keep = geo_dist <= radius
+
+        return self._to_csr(len(latitud), targets[keep], portals[keep], geo_dist[keep])
+
+    def query_knn(self, latitud, longitud, k):
+        """Find the `k` nearest portals to each query point.
+
+        Generalizes `query_nearest`: rings of cells are scanned around
+        every query until no unscanned cell can hold a portal closer
+        than its k-th best candidate, and the candidates that can still
+        be among the k nearest are measured with the exact geodesic.
+
+        Args:
+            latitud (array-like): Latitude of each query point.
+            longitud (array-like): Longitude of each query point.
+            k (int): Number of portals per query point.
+
+        Returns:
+            tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]: CSR
+            arrays `offsets`, `indices` and `distances` (geodesic, in
+            meters), as in `query_radius`. Each query gets min(k, number
+            of portals) portals, or none if its coordinates are missing.
+        """
+        latitud = np.asarray(latitud, dtype=np.float64)
+        longitud = np.asarray(longitud, dtype=np.float64)
+        empty = np.zeros(0, dtype=np.int64)
+
+        valid = np.flatnonzero(np.isfinite(latitud) & np.isfinite(longitud))
+        if len(self) == 0 or len(valid) == 0 or k < 1:
+            return self._to_csr(len(latitud), empty, empty, np.zeros(0))
+        k = min(int(k), len(self))
+
+        x, y = self.project(latitud[valid], longitud[valid])
+        rows, cols = self._cell_of(x, y)
+
+        eps = self.distortion(latitud[valid])
+        exact = eps > self.MAX_DISTORTION
+        ratio = (1 + eps) / (1 - np.minimum(eps, self.MAX_DISTORTION))
+
+        pos_rows = (y - self.y0) / self.cell_size - rows
+        pos_cols = (x - self.x0) / self.cell_size - cols
+        margin = np.clip(np.minimum.reduce([pos_rows, 1 - pos_rows, pos_cols, 1 - pos_cols]), 0, None)
+
+        query_pos = empty
+        portals = empty
+        dist = np.zeros(0)
+        kth = np.full(len(valid), np.inf)
+        active = np.flatnonzero(~exact)
+
+        ring = 0
+        max_ring = max(self.n_rows, self.n_cols)
+        while len(active) > 0 and ring <= max_ring:
+            new_pos, new_portals = self._ring_candidates(rows[active], cols[active], ring)
+            new_pos = active[new_pos]
+            query_pos = np.concatenate([query_pos, new_pos])
+            portals = np.concatenate([portals, new_portals])
+            dist = np.concatenate([dist, np.hypot(self.x[new_portals] - x[new_pos], self.y[new_portals] - y[new_pos])])
+
+            # k-th smallest projected distance found so far for each query
+            sort = np.lexsort((dist, query_pos))
+            query_pos, portals, dist = query_pos[sort], portals[sort], dist[sort]
+            starts = np.searchsorted(query_pos, np.arange(len(valid)))
+            counts = np.diff(np.r_[starts, len(query_pos)])
+            full = counts >= k
+            kth[full] = dist[starts[full] + k - 1]
+
+            # Drop the candidates that can no longer be among the k nearest
+            keep = dist <= kth[query_pos] * ratio[query_pos]
+            query_pos, portals, dist = query_pos[keep], portals[keep], dist[keep]
+
+            reach = (ring + margin[active]) * self.cell_size
+            active = active[kth[active] * ratio[active] > reach]
+            ring += 1
+
+        targets = valid[query_pos]
+        _, _, geo_dist = g.inv(longitud[targets], latitud[targets], self.longitud[portals], self.latitud[portals])
+        geo_dist = np.asarray(geo_dist, dtype=np.float64)
+
+        # Queries with a large projection error: k nearest of every portal
+        for pos in np.flatnonzero(exact).tolist():
+            dist_all = self._geodesic_to_all(latitud[valid[pos]], longitud[valid[pos]])
+            nearest = np.argsort(dist_all, kind='stable')[:k]
+            query_pos = np.concatenate([query_pos, np.full(k, pos)])
+            portals = np.concatenate([portals, nearest])
+            geo_dist = np.concatenate([geo_dist, dist_all[nearest]])
+
+        # Keep the k nearest by geodesic distance
+        sort = np.lexsort((portals, geo_dist, query_pos))
+        query_pos, portals, geo_dist = query_pos[sort], portals[sort], geo_dist[sort]
+        starts = np.searchsorted(query_pos, query_pos, side='left')
+        keep = np.arange(len(query_pos)) - starts < k
+
+        return self._to_csr(len(latitud), valid[query_pos[keep]], portals[keep], geo_dist[keep])
+
+    def match(self, latitud, longitud, tolerance=0.0):
+        """Find the nearest portal to every point, once per distinct location.
+
+        GPS tracks repeat the same coordinates many times (e.g. while the
+        courier is parked), so the points are collapsed to their distinct
+        locations and only those are searched. With a `tolerance`, points
+        in the same cell of a grid of that side (in meters) share a
+        location. Results are remembered in `memo`, so locations matched
+        by earlier calls (e.g. other date ranges of the same office) are
+        not searched again.
+
+        Args:
+            latitud (array-like): Latitude of each point.
+            longitud (array-like): Longitude of each point.
+            tolerance (float, optional): Side in meters of the grid used
+                to snap points to shared locations. 0 only collapses
+                identical coordinates. Defaults to 0.
+
+        Returns:
+            tuple[numpy.ndarray, numpy.ndarray]: Same as `query_nearest`.
+            With a tolerance, the portal is the one of the location of
+            the point but the distance is measured from the point itself.
+        """
+        latitud = np.asarray(latitud, dtype=np.float64)
+        longitud = np.asarray(longitud, dtype=np.float64)
+        best_idx = np.full(len(latitud), -1, dtype=np.int64)
+        best_dist = np.full(len(latitud), np.inf)
+
+        valid = np.flatnonzero(np.isfinite(latitud) & np.isfinite(longitud))
+        if len(self) == 0 or len(valid) == 0:
+            return best_idx, best_dist
+        lat, lon = latitud[valid], longitud[valid]
+
+        if tolerance > 0:
+            x, y = self.project(lat, lon)
+            keys = np.floor(x / tolerance) + 1j * np.floor(y / tolerance)
+        else:
+            keys = lat + 1j * lon
+        inverse, locations = pd.factorize(keys)
+        locations = np.asarray(locations, dtype=np.complex128)
+        _, first = np.unique(inverse, return_index=True)
+
+        # Locations already in the memo of this tolerance
+        memo_keys, memo_portals, memo_dist = self.memo.get(
+            tolerance, (np.zeros(0, dtype=np.complex128), np.zeros(0, dtype=np.int64), np.zeros(0))
+        )
+        loc_portals = np.full(len(locations), -1, dtype=np.int64)
+        loc_dist = np.full(len(locations), np.inf)
+        if len(memo_keys) > 0:
+            pos = np.minimum(np.searchsorted(memo_keys, locations), len(memo_keys) - 1)
+            known = memo_keys[pos] == locations
+            loc_portals[known] = memo_portals[pos[known]]
+            loc_dist[known] = memo_dist[pos[known]]
+        else:
+            known = np.zeros(len(locations), dtype=bool)
+
+        missing = np.flatnonzero(~known)
+        if len(missing) > 0:
+            rows = first[missing]
+            loc_portals[missing], loc_dist[missing] = self.query_nearest(lat[rows], lon[rows])
+            if sum(len(entry[0]) for entry in self.memo.values()) + len(missing) > self.MEMO_MAX_ENTRIES:
+                self.memo = {}
+                memo_keys, memo_portals, memo_dist = memo_keys[:0], memo_portals[:0], memo_dist[:0]
+            if len(missing) <= self.MEMO_MAX_ENTRIES:
+                memo_keys = np.concatenate([memo_keys, locations[missing]])
+                sort = np.argsort(memo_keys, kind='stable')
+                self.memo[tolerance] = (
+                    memo_keys[sort],
+                    np.concatenate([memo_portals, loc_portals[missing]])[sort],
+                    np.concatenate([memo_dist, loc_dist[missing]])[sort]
+                )
+
+        portals = loc_portals[inverse]
+        dist = loc_dist[inverse]
+
+        if tolerance > 0:
+            # The portal is shared by the location, the distance is not
+            found = np.flatnonzero(portals >= 0)
+            _, _, geo_dist = g.inv(lon[found], lat[found], self.longitud[portals[found]], self.latitud[portals[found]])
+            dist[found] = geo_dist
+
+        best_idx[valid] = portals
+        best_dist[valid] = dist
+        return best_idx, best_dist
+
+
+def build_portal_index(file_geojson):
+    """Build a `PortalIndex` from the points of a GeoJSON file.
+
+    The file is streamed with `read_geojson_points`, so large address
+    files are never loaded as Python objects.
+
+    Args:
+        file_geojson (str): Path to the GeoJSON file containing
+            point features with geographic coordinates.
+
+    Returns:
+        PortalIndex | None: The index, or None if the file has no
+        valid points.
+    """
+    points = read_geojson_points(file_geojson)
+    if len(points) == 0:
+        return None
+
+    return PortalIndex(
+        latitud=points.latitud,
+        longitud=points.longitud,
+        street=points.street,
+        number=points.number,
+        post_code=points.post_code
+    )
+
+
+
+def portal_index_path(file_geojson):
+    """Path of the binary portal index stored next to a GeoJSON file."""
+    return os.path.splitext(file_geojson)[0] + ".portal_index"
+
+
+def load_portal_index(file_geojson):
+    """Load the portal index of a GeoJSON file, building it if needed.
+
+    The index is persisted next to the GeoJSON file (see
+    `portal_index_path`). If that file is up to date with the GeoJSON
+    it is memory mapped, so worker processes and restarts share it
+    instead of parsing the GeoJSON again. Otherwise the index is built
+    from the GeoJSON and written to disk.
+
+    Args:
+        file_geojson (str): Path to the GeoJSON file containing
+            point features with geographic coordinates.
+
+    Returns:
+        PortalIndex | None: The index, or None if the file has no
+        valid points.
+    """
+    index_path = portal_index_path(file_geojson)
+    stamp = geojson_stamp(file_geojson)
+
+    index = PortalIndex.load(index_path, stamp)
+    if index is None:
+        index = build_portal_index(file_geojson)
+        if index is not None:
+            index.save(index_path, stamp)
+    return index
@@ -0,0 +1,133 @@
+import numpy as np
+import json, os
+
+
+# Layout of the binary files: 8 bytes with the length of a JSON header,
+# the header and then every array, each one aligned to ALIGNMENT bytes.
+# The header holds the scalar values and the dtype, shape and offset of
+# each array so they can be memory mapped without reading the file.
+MAGIC = b"PIDX"
+VERSION = 1
+ALIGNMENT = 64
+
+
+class StringColumn:
+    """Column of strings stored as UTF-8 bytes plus offsets.
+
+    Keeps the strings in two flat arrays (`data` and `offsets`) that can
+    be written to disk and memory mapped, and only decodes the values
+    that are actually requested.
+
+    Attributes:
+        data (numpy.ndarray): UTF-8 bytes of all the strings (uint8).
+        offsets (numpy.ndarray): Start of each string in `data`, plus
+            the final end offset (int64, length n + 1).
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, values):
+        """Build a column from any iterable of values (None is stored as '')."""
+        encoded = [("" if value is None else str(value)).encode("utf-8") for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(data, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _decode(self, i):
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def tolist(self):
+        """Decode every string of the column."""
+        text = bytes(self.data)
+        offsets = self.offsets.tolist()
+        return [text[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def __getitem__(self, index):
+        """Return one string, or an object array of strings for an array of indices."""
+        if np.isscalar(index):
+            return self._decode(int(index))
+        return np.array([self._decode(i) for i in np.asarray(index).tolist()], dtype=object)
+
+
+
+
+def write_arrays(path, values, arrays):
+    """Write scalar values and arrays to a binary file that can be memory mapped.
+
+    The file is written to a temporary path of the process and then
+    renamed, so readers never see a partially written file and the
+    backend and the frontend can write the same index at once.
+
+    Args:
+        path (str): Destination path.
+        values (dict): JSON serializable scalar values.
+        arrays (dict[str, numpy.ndarray]): Arrays to store.
+    """
+    header = {"version": VERSION, "values": values, "arrays": {}}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        header["arrays"][name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset
+        }
+        offset += array.nbytes
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(8, "little"))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(start + header["arrays"][name]["offset"])
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+
+
+
+def read_arrays(path):
+    """Read a file written by `write_arrays`, memory mapping its arrays.
+
+    Args:
+        path (str): Path to the file.
+
+    Returns:
+        tuple[dict, dict[str, numpy.ndarray]] | None: Scalar values and
+        read-only memory mapped arrays, or None if the file is missing,
+        invalid or has a different format version.
+    """
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return None
+        header_length = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(header_length).decode("utf-8"))
+
+    if header.get("version") != VERSION:
+        return None
+
+    start = -(-(len(MAGIC) + 8 + header_length) // ALIGNMENT) * ALIGNMENT
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        shape = tuple(spec["shape"])
+        if int(np.prod(shape)) == 0:
+            arrays[name] = np.zeros(shape, dtype=spec["dtype"])
+        else:
+            arrays[name] = np.memmap(path, dtype=spec["dtype"], mode="r", offset=start + spec["offset"], shape=shape)
+    return header["values"], arrays